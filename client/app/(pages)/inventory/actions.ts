@@ -32,8 +32,13 @@ export const getRender = async ({ side, aisle_index }: GetRender) => {
   const render = await prisma.render.findFirst({
     where: {
       meta: {
-        side,
-        aisle_index,
+        is: {
+          side,
+          aisle_index,
+          // Renders of part of the aisle are stored with their x range
+          x_min: { isSet: false },
+          x_max: { isSet: false },
+        },
       },
     },
   });
@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import gzip
 import json
 import time
 
@@ -12,10 +13,13 @@ RABBITMQ_HOST = "rabbitmq"
 RABBITMQ_PORT = 5672
 RABBITMQ_USER = "guest"
 RABBITMQ_PASSWORD = "guest"
+# Messages larger than this are gzip compressed, as ouroboros accepts them
+COMPRESSION_THRESHOLD_BYTES = 65536
 
 
 class AMQPPublisher:
-    def __init__(self):
+    def __init__(self, compression_threshold: int | None = COMPRESSION_THRESHOLD_BYTES):
+        self.compression_threshold = compression_threshold
         self.wait_for_rabbitmq()
         self.reset_connection()
 
@@ -52,18 +56,35 @@ class AMQPPublisher:
     def add_queue(self, amqp_endpoint: str) -> None:
         self._channel.queue_declare(queue=amqp_endpoint)
 
+    def encode(self, data: dict) -> tuple[bytes, pika.BasicProperties]:
+        """Encode a message as JSON, gzip compressed above the threshold."""
+        body = json.dumps(data).encode()
+        content_encoding = None
+        if (
+            self.compression_threshold is not None
+            and len(body) >= self.compression_threshold
+        ):
+            body = gzip.compress(body, compresslevel=1)
+            content_encoding = "gzip"
+        properties = pika.BasicProperties(
+            content_type="application/json", content_encoding=content_encoding
+        )
+        return body, properties
+
     def publish(self, data: dict, amqp_endpoint: str) -> None:
-        data_str = json.dumps(data)
+        body, properties = self.encode(data)
         self._channel.basic_publish(
             exchange=amqp_endpoint,
             routing_key="",
-            body=data_str,
+            body=body,
+            properties=properties,
         )
 
     def publish_queue(self, data: dict, amqp_endpoint: str) -> None:
-        data_str = json.dumps(data)
+        body, properties = self.encode(data)
         self._channel.basic_publish(
             exchange="",
             routing_key=amqp_endpoint,
-            body=data_str,
+            body=body,
+            properties=properties,
         )
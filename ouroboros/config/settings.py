@@ -2,48 +2,242 @@
 
 """Configuration file for environment variables."""
 
+import json
 import logging
 import os
+import time
+from collections.abc import Callable
+from functools import cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
 
-from azure.identity import DefaultAzureCredential
-from azure.keyvault.secrets import SecretClient
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    from azure.keyvault.secrets import SecretClient
+
 logger = logging.getLogger("__main__")
 
 load_dotenv()
 
 key_vault_name = "RubicKeyVault"
 key_vault_uri = f"https://{key_vault_name}.vault.azure.net"
-credential = DefaultAzureCredential()
-az_client = SecretClient(vault_url=key_vault_uri, credential=credential)
-
-# RabbitMQ env
-AMQP_CONN_STR = os.environ.get("AMQP_SSL_CONN_STR")
-if AMQP_CONN_STR is None:
-    AMQP_CONN_STR = az_client.get_secret("AMQP-SSL-CONN-STR").value
-if not AMQP_CONN_STR:
-    raise ValueError(
-        "AMQP-SSL-CONN-STR environment variable not found. "
-        "Using default connection string."
-    )
-
-# Mongo DB env
-mongo_db_conn_str = os.environ.get("MONGODB_CONN_STR")
-if mongo_db_conn_str is None:
-    mongo_db_conn_str = az_client.get_secret("MONGODB-CONN-STR").value
-if not mongo_db_conn_str:
-    logger.warning(
-        "MONGODB-CONN-STR environment variable not found. "
-        "Using default connection string."
-    )
-    mongo_db_conn_str = "mongodb://localhost:27017/"
-MONGO_CONN_STR = mongo_db_conn_str
-
-# Azure Blob env
-AZUR_BLOB_CONN = az_client.get_secret("AZURE-BLOB-CONN").value
-if AZUR_BLOB_CONN is None:
-    raise ValueError(
-        "AZURE-BLOB-CONN environment variable not found. "
-        "Using default connection string."
-    )
+
+# Secrets fetched from the key vault are cached in this file, empty disables
+SECRET_CACHE_FILE = os.environ.get("SECRET_CACHE_FILE", "")
+SECRET_CACHE_TTL_SECONDS = float(os.environ.get("SECRET_CACHE_TTL_SECONDS", "3600"))
+
+# Connection strings, resolved on first access by __getattr__
+AMQP_CONN_STR: str
+MONGO_CONN_STR: str
+AZUR_BLOB_CONN: str
+
+
+@cache
+def get_secret_client() -> "SecretClient":
+    """Create the key vault client, only when a secret is not in the env."""
+    # Imported here, azure is slow to import and rarely needed
+    from azure.identity import DefaultAzureCredential  # noqa: PLC0415
+    from azure.keyvault.secrets import SecretClient  # noqa: PLC0415
+
+    return SecretClient(vault_url=key_vault_uri, credential=DefaultAzureCredential())
+
+
+def read_secret_cache() -> dict[str, Any]:
+    """Read the secrets cached on disk, empty if there are none."""
+    if not SECRET_CACHE_FILE:
+        return {}
+    try:
+        return json.loads(Path(SECRET_CACHE_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def write_secret_cache(name: str, value: str) -> None:
+    """Cache a secret on disk, readable by the owner only."""
+    if not SECRET_CACHE_FILE:
+        return
+    secrets = read_secret_cache()
+    secrets[name] = {"value": value, "fetched_at": time.time()}
+    path = Path(SECRET_CACHE_FILE)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(secrets, f)
+    except OSError:
+        logger.warning("Could not write the secret cache %s", SECRET_CACHE_FILE)
+
+
+@cache
+def get_secret(name: str) -> str | None:
+    """Get a secret from the disk cache, or else from the key vault."""
+    cached = read_secret_cache().get(name)
+    if cached and time.time() - cached["fetched_at"] < SECRET_CACHE_TTL_SECONDS:
+        return cached["value"]
+
+    value = get_secret_client().get_secret(name).value
+    if isinstance(value, str):
+        write_secret_cache(name, value)
+    return value
+
+
+def get_amqp_conn_str() -> str:
+    """RabbitMQ env."""
+    amqp_conn_str = os.environ.get("AMQP_SSL_CONN_STR")
+    if amqp_conn_str is None:
+        amqp_conn_str = get_secret("AMQP-SSL-CONN-STR")
+    if not amqp_conn_str:
+        raise ValueError(
+            "AMQP-SSL-CONN-STR environment variable not found. "
+            "Using default connection string."
+        )
+    return amqp_conn_str
+
+
+def get_mongo_conn_str() -> str:
+    """Mongo DB env."""
+    mongo_db_conn_str = os.environ.get("MONGODB_CONN_STR")
+    if mongo_db_conn_str is None:
+        mongo_db_conn_str = get_secret("MONGODB-CONN-STR")
+    if not mongo_db_conn_str:
+        logger.warning(
+            "MONGODB-CONN-STR environment variable not found. "
+            "Using default connection string."
+        )
+        mongo_db_conn_str = "mongodb://localhost:27017/"
+    return mongo_db_conn_str
+
+
+def get_azure_blob_conn() -> str:
+    """Azure Blob env."""
+    azure_blob_conn = os.environ.get("AZURE_BLOB_CONN")
+    if azure_blob_conn is None:
+        azure_blob_conn = get_secret("AZURE-BLOB-CONN")
+    if azure_blob_conn is None:
+        raise ValueError(
+            "AZURE-BLOB-CONN environment variable not found. "
+            "Using default connection string."
+        )
+    return azure_blob_conn
+
+
+LAZY_SETTINGS: dict[str, Callable[[], str]] = {
+    "AMQP_CONN_STR": get_amqp_conn_str,
+    "MONGO_CONN_STR": get_mongo_conn_str,
+    "AZUR_BLOB_CONN": get_azure_blob_conn,
+}
+
+
+def __getattr__(name: str) -> str:
+    """Resolve a connection string on first access and keep it."""
+    if name not in LAZY_SETTINGS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = LAZY_SETTINGS[name]()
+    globals()[name] = value
+    return value
+
+
+# Aisle sharding env, messages of an aisle go to the instance owning its shard
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "1"))
+INSTANCE_ID = os.environ.get("INSTANCE_ID", "0")
+# Comma separated ids of all instances sharing the shards
+SHARD_INSTANCES = os.environ.get("SHARD_INSTANCES", INSTANCE_ID).split(",")
+SHARD_EXCHANGE = os.environ.get("SHARD_EXCHANGE", "ouroboros.shards")
+
+# JSON codec of the broker messages, "auto" uses orjson when installed
+MESSAGE_CODEC = os.environ.get("MESSAGE_CODEC", "auto")
+# Codecs of single routers, as comma separated prefix=codec pairs
+ROUTER_MESSAGE_CODECS = dict(
+    pair.split("=", 1)
+    for pair in os.environ.get("ROUTER_MESSAGE_CODECS", "").split(",")
+    if pair
+)
+# Compression of published messages, "gzip" or "zstd", empty disables it.
+# Compressed messages are always accepted.
+COMPRESSION = os.environ.get("COMPRESSION", "")
+COMPRESSION_THRESHOLD_BYTES = int(
+    os.environ.get("COMPRESSION_THRESHOLD_BYTES", "65536")
+)
+
+# Render env
+RENDER_DEBOUNCE_SECONDS = float(os.environ.get("RENDER_DEBOUNCE_SECONDS", "0"))
+RENDER_PIXELS_PER_METER = int(os.environ.get("RENDER_PIXELS_PER_METER", "400"))
+# Precompute render resolution thumbnails when ingesting scan images
+SCAN_THUMBNAILS = os.environ.get("SCAN_THUMBNAILS", "false").lower() == "true"
+
+# Blob store env, "azure" or "local"
+BLOB_STORE = os.environ.get("BLOB_STORE", "azure")
+LOCAL_BLOB_DIR = os.environ.get("LOCAL_BLOB_DIR", "blobs")
+# Background blob uploads, handlers wait when the queue is full
+BLOB_UPLOAD_QUEUE_SIZE = int(os.environ.get("BLOB_UPLOAD_QUEUE_SIZE", "100"))
+BLOB_UPLOAD_WORKERS = int(os.environ.get("BLOB_UPLOAD_WORKERS", "4"))
+BLOB_UPLOAD_RETRIES = int(os.environ.get("BLOB_UPLOAD_RETRIES", "3"))
+BLOB_UPLOAD_RETRY_DELAY_SECONDS = float(
+    os.environ.get("BLOB_UPLOAD_RETRY_DELAY_SECONDS", "0.5")
+)
+# Interval of the retries of the failed scan image uploads, 0 disables
+SCAN_UPLOAD_SWEEP_SECONDS = float(os.environ.get("SCAN_UPLOAD_SWEEP_SECONDS", "300"))
+# Maximum number of failed scan image uploads retried per sweep
+SCAN_UPLOAD_SWEEP_LIMIT = int(os.environ.get("SCAN_UPLOAD_SWEEP_LIMIT", "100"))
+# Time a scan image upload is leased to the instance queueing it
+SCAN_UPLOAD_LEASE_SECONDS = float(os.environ.get("SCAN_UPLOAD_LEASE_SECONDS", "900"))
+
+# Time the mongodb commands by query shape, and log the slow ones
+MONGO_COMMAND_MONITORING = (
+    os.environ.get("MONGO_COMMAND_MONITORING", "true").lower() == "true"
+)
+MONGO_SLOW_COMMAND_MS = float(os.environ.get("MONGO_SLOW_COMMAND_MS", "100"))
+
+# Commit batch response writes inside a mongodb transaction (needs a replica set)
+MONGO_TRANSACTIONS = os.environ.get("MONGO_TRANSACTIONS", "false").lower() == "true"
+# Retries of the jobs whose items were changed by another consumer
+CONCURRENT_MODIFICATION_RETRIES = int(
+    os.environ.get("CONCURRENT_MODIFICATION_RETRIES", "3")
+)
+
+# Metrics env, served on http://METRICS_HOST:METRICS_PORT/metrics, 0 disables
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# Logging env, handler calls are logged as summaries of ids, counts and sizes
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# Write logs from a background thread, so handlers never wait on the sink
+LOG_ENQUEUE = os.environ.get("LOG_ENQUEUE", "true").lower() == "true"
+# Write logs as JSON lines, with the bound fields
+LOG_SERIALIZE = os.environ.get("LOG_SERIALIZE", "false").lower() == "true"
+# Fraction of the handler calls whose start and end are logged, failures always are
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1"))
+LOG_SUMMARY_MAX_LENGTH = int(os.environ.get("LOG_SUMMARY_MAX_LENGTH", "1000"))
+# Log the full messages handled, which can be very large
+LOG_PAYLOADS = os.environ.get("LOG_PAYLOADS", "false").lower() == "true"
+
+# Reorder the jobs of robot batches to shorten the travel of the robot
+JOB_SEQUENCING = os.environ.get("JOB_SEQUENCING", "false").lower() == "true"
+# Items the robot can carry at once
+ROBOT_CAPACITY = int(os.environ.get("ROBOT_CAPACITY", "8"))
+# Estimated extra distance, in meters, to go from an aisle to another
+AISLE_CHANGE_DISTANCE = float(os.environ.get("AISLE_CHANGE_DISTANCE", "5"))
+
+# Send jobs with compact items to the robot, the robot must echo them back
+COMPACT_ROBOT_JOBS = os.environ.get("COMPACT_ROBOT_JOBS", "false").lower() == "true"
+
+# Independent partitions of a batch response processed at the same time
+BATCH_RESPONSE_CONCURRENCY = int(os.environ.get("BATCH_RESPONSE_CONCURRENCY", "8"))
+
+# Processed robot jobs remembered in memory to skip redelivered responses
+PROCESSED_JOBS_CACHE_SIZE = int(os.environ.get("PROCESSED_JOBS_CACHE_SIZE", "10000"))
+
+# Barcode to item cache env
+BARCODE_CACHE_SIZE = int(os.environ.get("BARCODE_CACHE_SIZE", "10000"))
+# Invalidate the cache on changes made by other instances
+BARCODE_CACHE_CHANGE_STREAM = (
+    os.environ.get("BARCODE_CACHE_CHANGE_STREAM", "false").lower() == "true"
+)
+
+# Job type registry env, 0 disables the periodic refresh
+JOB_TYPE_TTL_SECONDS = float(os.environ.get("JOB_TYPE_TTL_SECONDS", "300"))
+# Reload job types as soon as they change
+JOB_TYPE_CHANGE_STREAM = (
+    os.environ.get("JOB_TYPE_CHANGE_STREAM", "false").lower() == "true"
+)
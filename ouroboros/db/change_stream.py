@@ -0,0 +1,72 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Background watcher of a MongoDB change stream."""
+
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+from pymongo.errors import PyMongoError
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from pymongo.collection import Collection
+
+
+class ChangeStreamWatcher:
+    """Calls back for every change of a collection, from a daemon thread.
+
+    When the stream fails, on_error is called since changes may have been
+    missed, and the stream is reopened.
+    """
+
+    def __init__(
+        self,
+        collection: Collection,
+        on_change: Callable[[dict[str, Any]], None],
+        on_error: Callable[[], None],
+    ):
+        """Initialize the watcher of the collection."""
+        self.collection = collection
+        self.on_change = on_change
+        self.on_error = on_error
+        self.thread: threading.Thread | None = None
+        self.stopped = threading.Event()
+
+    def start(self) -> None:
+        """Start watching, if not already."""
+        if self.thread is not None:
+            return
+
+        self.stopped.clear()
+        self.thread = threading.Thread(
+            target=self.watch, name=f"{self.collection.name}-watcher", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop watching."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def watch(self) -> None:
+        """Consume the change stream until stopped."""
+        logger.info("Watching changes of {}", self.collection.name)
+        while not self.stopped.is_set():
+            try:
+                with self.collection.watch(
+                    full_document="updateLookup", max_await_time_ms=1000
+                ) as stream:
+                    while stream.alive and not self.stopped.is_set():
+                        change = stream.try_next()
+                        if change is not None:
+                            self.on_change(change)
+            except PyMongoError:
+                logger.exception("Change stream of {} failed", self.collection.name)
+                self.on_error()
+                self.stopped.wait(1)
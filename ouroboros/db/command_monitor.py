@@ -0,0 +1,201 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Timing of the MongoDB commands by collection and query shape."""
+
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from loguru import logger
+from pymongo import monitoring
+
+from config import settings
+from src.metrics import metrics
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from src.metrics.registry import Labels
+
+command_seconds = metrics.histogram(
+    "mongo_command_seconds", "Duration of the mongodb commands in seconds"
+)
+command_failures = metrics.counter(
+    "mongo_command_failures_total", "Failed mongodb commands"
+)
+shape_calls = metrics.counter(
+    "mongo_shape_calls_total", "Mongodb commands by query shape"
+)
+shape_seconds = metrics.counter(
+    "mongo_shape_seconds_total", "Time spent in the mongodb commands of a query shape"
+)
+shape_documents = metrics.counter(
+    "mongo_shape_documents_total",
+    "Documents returned or written by the mongodb commands of a query shape",
+)
+
+
+class ShapeStats(NamedTuple):
+    """Totals of the commands of a query shape."""
+
+    collection: str
+    command: str
+    shape: str
+    calls: float
+    seconds: float
+    documents: float
+
+
+def get_shape(value: Any) -> str:
+    """Get the shape of a filter, with its values replaced by ?.
+
+    Filters differing only by their values have the same shape, and use the
+    same index.
+    """
+    if isinstance(value, dict):
+        fields = ", ".join(f"{key}: {get_shape(field)}" for key, field in value.items())
+        return f"{{{fields}}}"
+    if isinstance(value, list) and value and all(isinstance(x, dict) for x in value):
+        return f"[{', '.join(get_shape(x) for x in value)}]"
+    return "?"
+
+
+def get_filter(command_name: str, command: dict[str, Any]) -> Any:
+    """Get the filter of a command, None if it has none."""
+    if command_name in {"update", "delete"}:
+        statements = command.get(f"{command_name}s") or [{}]
+        return statements[0].get("q")
+    if command_name == "aggregate":
+        stages = command.get("pipeline") or [{}]
+        return stages[0].get("$match")
+    return command.get("filter", command.get("query"))
+
+
+def get_documents(reply: dict[str, Any]) -> int:
+    """Get the number of documents returned or written by a command."""
+    if "cursor" in reply:
+        cursor = reply["cursor"]
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    return int(reply.get("n", 0))
+
+
+def get_shape_stats(samples: Iterable[tuple[str, Labels, float]]) -> list[ShapeStats]:
+    """Group the samples of the shape counters by query shape."""
+    totals: dict[Labels, dict[str, float]] = {}
+    for name, labels, value in samples:
+        totals.setdefault(labels, {})[name] = value
+
+    stats = []
+    for labels, values in totals.items():
+        label_values = dict(labels)
+        stats.append(
+            ShapeStats(
+                label_values.get("collection", ""),
+                label_values.get("command", ""),
+                label_values.get("shape", ""),
+                values.get(shape_calls.name, 0),
+                values.get(shape_seconds.name, 0),
+                values.get(shape_documents.name, 0),
+            )
+        )
+    return stats
+
+
+def format_report(stats: list[ShapeStats], top: int) -> str:
+    """Format the query shapes which took the most time, for index tuning."""
+    lines = [f"{'total ms':>10} {'calls':>8} {'mean ms':>8} {'docs/call':>9}  command"]
+    for shape in sorted(stats, key=lambda x: x.seconds, reverse=True)[:top]:
+        calls = max(shape.calls, 1)
+        lines.append(
+            f"{shape.seconds * 1000:10.1f} {shape.calls:8.0f} "
+            f"{shape.seconds * 1000 / calls:8.2f} {shape.documents / calls:9.1f}  "
+            f"{shape.collection}.{shape.command} {shape.shape}"
+        )
+    return "\n".join(lines)
+
+
+class CommandMonitor(monitoring.CommandListener):
+    """Records the duration and documents of the commands by query shape.
+
+    Commands slower than the threshold are logged with their shape, never
+    with their values. Commands without a collection, like pings, are
+    skipped.
+    """
+
+    def __init__(self, slow_seconds: float):
+        """Initialize the monitor, logging commands slower than slow_seconds."""
+        self.slow_seconds = slow_seconds
+        # Shape of the running commands, by connection and request
+        self.running: dict[tuple[Any, int], tuple[str, str, str]] = {}
+        self.lock = threading.Lock()
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        """Remember the shape of a command."""
+        command = event.command
+        collection = command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = command.get("collection")
+        if not isinstance(collection, str):
+            return
+
+        shape = get_shape(get_filter(event.command_name, command))
+        with self.lock:
+            self.running[event.connection_id, event.request_id] = (
+                collection,
+                event.command_name,
+                shape,
+            )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        """Record a command which succeeded."""
+        with self.lock:
+            key = self.running.pop((event.connection_id, event.request_id), None)
+        if key is not None:
+            self.record(*key, event.duration_micros / 1e6, get_documents(event.reply))
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        """Record a command which failed."""
+        with self.lock:
+            key = self.running.pop((event.connection_id, event.request_id), None)
+        if key is not None:
+            collection, command, _ = key
+            command_failures.inc(collection=collection, command=command)
+            self.record(*key, event.duration_micros / 1e6, 0)
+
+    def record(
+        self,
+        collection: str,
+        command: str,
+        shape: str,
+        seconds: float,
+        documents: int,
+    ) -> None:
+        """Record the duration and documents of a command."""
+        command_seconds.observe(seconds, collection=collection, command=command)
+        labels = {"collection": collection, "command": command, "shape": shape}
+        shape_calls.inc(**labels)
+        shape_seconds.inc(seconds, **labels)
+        shape_documents.inc(documents, **labels)
+        if seconds >= self.slow_seconds:
+            logger.warning(
+                "Slow mongodb {} on {} took {:.1f} ms for {} documents, shape {}",
+                command,
+                collection,
+                seconds * 1000,
+                documents,
+                shape,
+            )
+
+    @staticmethod
+    def report(top: int = 20) -> str:
+        """Report the query shapes which took the most time."""
+        samples = [
+            *shape_calls.samples(),
+            *shape_seconds.samples(),
+            *shape_documents.samples(),
+        ]
+        return format_report(get_shape_stats(samples), top)
+
+
+command_monitor = CommandMonitor(settings.MONGO_SLOW_COMMAND_MS / 1000)
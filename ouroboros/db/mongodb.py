@@ -4,10 +4,11 @@
 
 from dotenv import load_dotenv
 from loguru import logger
-from pymongo import MongoClient
+from pymongo import ASCENDING, MongoClient
 from pymongo.server_api import ServerApi
 
 from config import settings
+from db.command_monitor import command_monitor
 
 load_dotenv()
 
@@ -15,13 +16,12 @@ logger.info("Setting up MongoDB")
 
 conn_str = settings.MONGO_CONN_STR
 
-mongo_client = MongoClient(conn_str, server_api=ServerApi("1"))
-try:
-    mongo_client.admin.command("ping")
-    logger.info(f"MongoDB server ping successful. {conn_str}")
-except Exception as e:
-    logger.error("Error connecting to MongoDB")
-    raise Exception(f"MongoDB server ping failed. {e}") from e
+# Connects in the background, the server is pinged on startup
+mongo_client = MongoClient(
+    conn_str,
+    server_api=ServerApi("1"),
+    event_listeners=[command_monitor] if settings.MONGO_COMMAND_MONITORING else [],
+)
 
 
 OrbitDB = mongo_client["Orbit"]
@@ -31,6 +31,7 @@ partial_barcode_collection = OrbitDB["partial_barcode_collection"]
 low_status_collection = OrbitDB["low_status_collection"]
 robot_batch_collection = OrbitDB["robot_batch_collection"]
 robot_job_collection = OrbitDB["robot_job_collection"]
+processed_job_collection = OrbitDB["processed_job_collection"]
 
 barcode_collection = OrbitDB["barcode_collection"]
 inventory_items = OrbitDB["inventory_items"]
@@ -46,3 +47,24 @@ renders_collection = OrbitDB["renders"]
 
 fos_translate_db = mongo_client["FOS_Translate"]
 job_type_collection = fos_translate_db["job_type"]
+
+
+def ping() -> None:
+    """Check the connection to the MongoDB server."""
+    try:
+        mongo_client.admin.command("ping")
+        logger.info(f"MongoDB server ping successful. {conn_str}")
+    except Exception as e:
+        logger.error("Error connecting to MongoDB")
+        raise Exception(f"MongoDB server ping failed. {e}") from e
+
+
+def create_indexes() -> None:
+    """Create the indexes the consumers rely on, if missing."""
+    processed_job_collection.create_index(
+        [("batch_id", ASCENDING), ("job_id", ASCENDING)], unique=True
+    )
+    # Compact jobs of batch responses are rebuilt from the sent jobs
+    robot_job_collection.create_index("job_id")
+    # Scan images kept after a failed upload are retried periodically
+    scan_image_collection.create_index("pending_blob_name", sparse=True)
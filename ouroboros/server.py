@@ -7,9 +7,21 @@ from faststream.rabbit import RabbitBroker
 from loguru import logger
 
 from config import settings
+from db.command_monitor import command_monitor
+from db.mongodb import create_indexes, ping
+from src.decorators import configure_logger
+from src.metrics import MetricsMiddleware, metrics, metrics_endpoint
 from src.routers import batch_router, inventory_router, robot_router, scan_router
+from src.services.blob_stores import blob_upload_queue
+from src.services.factories.job_type_registry import job_type_registry
+from src.services.handlers.scan.ingest_scan_data import IngestScanData
+from src.services.robot_requests.barcode_cache import barcode_cache
 
-broker = RabbitBroker(settings.AMQP_CONN_STR, logger=logger)
+configure_logger()
+
+broker = RabbitBroker(
+    settings.AMQP_CONN_STR, logger=logger, middlewares=[MetricsMiddleware]
+)
 
 app = FastStream(broker, logger=logger)
 
@@ -17,3 +29,89 @@ broker.include_router(batch_router)
 broker.include_router(inventory_router)
 broker.include_router(robot_router)
 broker.include_router(scan_router)
+
+
+@app.on_startup
+def connect_database() -> None:
+    """Check the database is reachable before consuming messages."""
+    ping()
+    create_indexes()
+
+
+@app.on_startup
+def load_job_types() -> None:
+    """Preload the job types, so lookups never wait on the database."""
+    job_type_registry.load()
+    if settings.JOB_TYPE_CHANGE_STREAM:
+        job_type_registry.start_watching()
+
+
+@app.on_shutdown
+def stop_job_type_watcher() -> None:
+    """Stop watching job type changes."""
+    job_type_registry.stop()
+
+
+@app.on_startup
+def start_barcode_cache_watcher() -> None:
+    """Keep the barcode cache coherent with other instances."""
+    if settings.BARCODE_CACHE_CHANGE_STREAM:
+        barcode_cache.start_watching()
+
+
+@app.on_shutdown
+def stop_barcode_cache_watcher() -> None:
+    """Stop watching barcode changes."""
+    barcode_cache.stop()
+
+
+@app.on_startup
+def start_scan_upload_sweep() -> None:
+    """Retry the scan image uploads which failed, periodically."""
+    if settings.SCAN_UPLOAD_SWEEP_SECONDS:
+        IngestScanData.start_upload_sweep(settings.SCAN_UPLOAD_SWEEP_SECONDS)
+
+
+@app.on_shutdown
+async def stop_scan_upload_sweep() -> None:
+    """Stop retrying the failed scan image uploads, before draining the uploads."""
+    await IngestScanData.stop_upload_sweep()
+
+
+@app.on_shutdown
+async def drain_blob_uploads() -> None:
+    """Finish the queued blob uploads before exiting."""
+    await blob_upload_queue.stop()
+
+
+@app.on_startup
+async def serve_metrics() -> None:
+    """Serve the metrics of the handlers and caches, if enabled."""
+    metrics.collector("barcode_cache", "Barcode cache statistics", barcode_cache.stats)
+    metrics.collector(
+        "job_type_registry", "Job type registry statistics", job_type_registry.stats
+    )
+    metrics.collector(
+        "blob_upload_queue", "Blob upload queue statistics", blob_upload_queue.stats
+    )
+    if settings.METRICS_PORT:
+        await metrics_endpoint.start(settings.METRICS_HOST, settings.METRICS_PORT)
+
+
+@app.on_shutdown
+async def stop_metrics() -> None:
+    """Stop serving the metrics."""
+    await metrics_endpoint.stop()
+
+
+@app.on_shutdown
+def log_mongo_report() -> None:
+    """Log the query shapes which took the most time, for index tuning."""
+    if settings.MONGO_COMMAND_MONITORING:
+        logger.info("Slowest mongodb query shapes:\n{}", command_monitor.report())
+
+
+@app.after_shutdown
+async def flush_logs() -> None:
+    """Write the queued logs before exiting."""
+    await logger.complete()
@@ -0,0 +1,45 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+from .compression import (
+    COMPRESSIONS,
+    Compression,
+    compress_body,
+    decompress_body,
+    decompressing_parser,
+    get_compression,
+)
+from .json_codecs import (
+    CODECS,
+    JsonCodec,
+    codec_options,
+    get_codec,
+    get_router_codec,
+    json_decoder,
+    json_publish_middleware,
+)
+from .scan_data import (
+    SCAN_DATA_CONTENT_TYPE,
+    decode_scan_data,
+    encode_scan_data,
+    scan_data_decoder,
+)
+
+__all__ = [
+    "CODECS",
+    "COMPRESSIONS",
+    "SCAN_DATA_CONTENT_TYPE",
+    "Compression",
+    "JsonCodec",
+    "codec_options",
+    "compress_body",
+    "decode_scan_data",
+    "decompress_body",
+    "decompressing_parser",
+    "encode_scan_data",
+    "get_codec",
+    "get_compression",
+    "get_router_codec",
+    "json_decoder",
+    "json_publish_middleware",
+    "scan_data_decoder",
+]
@@ -0,0 +1,81 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Compression of large broker messages, signalled by their content encoding."""
+
+from __future__ import annotations
+
+import gzip
+from functools import partial
+from typing import TYPE_CHECKING, NamedTuple
+
+from config import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+    from aio_pika import IncomingMessage
+    from faststream.rabbit.message import RabbitMessage
+
+
+class Compression(NamedTuple):
+    """Functions to compress and decompress message bodies."""
+
+    name: str
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+# The fastest levels, higher levels barely shrink JSON messages further
+COMPRESSIONS = {
+    "gzip": Compression(
+        "gzip", partial(gzip.compress, compresslevel=1), gzip.decompress
+    )
+}
+if zstandard is not None:
+    COMPRESSIONS["zstd"] = Compression(
+        "zstd",
+        zstandard.ZstdCompressor(level=1).compress,
+        zstandard.ZstdDecompressor().decompress,
+    )
+
+
+def get_compression(name: str) -> Compression | None:
+    """Get a compression by name, None if compression is disabled."""
+    if not name:
+        return None
+    if name not in COMPRESSIONS:
+        raise ValueError(
+            f"Compression {name} is not available, use one of {[*COMPRESSIONS]}"
+        )
+    return COMPRESSIONS[name]
+
+
+def compress_body(
+    body: bytes, compression: Compression | None
+) -> tuple[bytes, str | None]:
+    """Compress a body above the size threshold, with its content encoding."""
+    if compression is None or len(body) < settings.COMPRESSION_THRESHOLD_BYTES:
+        return body, None
+    return compression.compress(body), compression.name
+
+
+def decompress_body(body: bytes, content_encoding: str | None) -> bytes:
+    """Decompress a body, other content encodings are left as they are."""
+    if content_encoding in COMPRESSIONS:
+        return COMPRESSIONS[content_encoding].decompress(body)
+    return body
+
+
+async def decompressing_parser(
+    message: IncomingMessage,
+    original_parser: Callable[[IncomingMessage], Awaitable[RabbitMessage]],
+) -> RabbitMessage:
+    """Parse a message, decompressing its body before it is decoded."""
+    parsed = await original_parser(message)
+    parsed.body = decompress_body(parsed.body, message.content_encoding)
+    return parsed
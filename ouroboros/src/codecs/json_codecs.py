@@ -0,0 +1,123 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Registry of the JSON codecs used to (de)serialize broker messages."""
+
+from __future__ import annotations
+
+import json
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from aio_pika import Message
+from faststream import BaseMiddleware
+from faststream.broker.message import ContentTypes
+from pydantic_core import to_json, to_jsonable_python
+
+from config import settings
+
+from .compression import (
+    Compression,
+    compress_body,
+    decompressing_parser,
+    get_compression,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+    from faststream.rabbit.message import RabbitMessage
+    from faststream.types import DecodedMessage
+
+
+class JsonCodec(NamedTuple):
+    """Functions to parse and serialize JSON messages."""
+
+    name: str
+    loads: Callable[[bytes], Any]
+    dumps: Callable[[Any], bytes]
+
+
+def orjson_dumps(obj: Any) -> bytes:
+    """Serialize with orjson, converting models to JSON compatible objects first."""
+    return orjson.dumps(obj, default=to_jsonable_python)
+
+
+# pydantic_core serializes models, and lists of them, in one pass
+CODECS = {"json": JsonCodec("json", json.loads, to_json)}
+if orjson is not None:
+    CODECS["orjson"] = JsonCodec("orjson", orjson.loads, orjson_dumps)
+
+
+def get_codec(name: str) -> JsonCodec:
+    """Get a codec by name, "auto" is the fastest one installed."""
+    if name == "auto":
+        return CODECS.get("orjson", CODECS["json"])
+    if name not in CODECS:
+        raise ValueError(
+            f"Message codec {name} is not available, use one of {[*CODECS]}"
+        )
+    return CODECS[name]
+
+
+def get_router_codec(prefix: str) -> JsonCodec:
+    """Get the codec configured for the router with the given prefix."""
+    return get_codec(settings.ROUTER_MESSAGE_CODECS.get(prefix, settings.MESSAGE_CODEC))
+
+
+def json_decoder(
+    codec: JsonCodec,
+) -> Callable[..., Awaitable[DecodedMessage]]:
+    """Create a decoder parsing JSON messages with the codec."""
+
+    async def decoder(
+        message: RabbitMessage,
+        original_decoder: Callable[[RabbitMessage], Awaitable[DecodedMessage]],
+    ) -> DecodedMessage:
+        if message.content_type == ContentTypes.json.value:
+            return codec.loads(message.body)
+        return await original_decoder(message)
+
+    return decoder
+
+
+def json_publish_middleware(
+    codec: JsonCodec, compression: Compression | None = None
+) -> type[BaseMiddleware]:
+    """Create a middleware serializing published messages with the codec.
+
+    Large messages are compressed, unless they already have an encoding.
+    """
+
+    class JsonPublishMiddleware(BaseMiddleware):
+        async def publish_scope(
+            self,
+            call_next: Callable[..., Awaitable[Any]],
+            msg: Any,
+            *args: Any,
+            **kwargs: Any,
+        ) -> Any:
+            if msg is not None and not isinstance(msg, bytes | str | Message):
+                msg = codec.dumps(msg)
+                kwargs["content_type"] = (
+                    kwargs.get("content_type") or ContentTypes.json.value
+                )
+                if kwargs.get("content_encoding") is None:
+                    msg, kwargs["content_encoding"] = compress_body(msg, compression)
+            return await super().publish_scope(call_next, msg, *args, **kwargs)
+
+    return JsonPublishMiddleware
+
+
+def codec_options(prefix: str) -> dict[str, Any]:
+    """Get the router options to use the codec configured for a router."""
+    codec = get_router_codec(prefix)
+    compression = get_compression(settings.COMPRESSION)
+    return {
+        "parser": decompressing_parser,
+        "decoder": json_decoder(codec),
+        "middlewares": [json_publish_middleware(codec, compression)],
+    }
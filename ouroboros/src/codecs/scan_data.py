@@ -0,0 +1,93 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Binary wire format of scan data, carrying the image as raw bytes.
+
+A message is the magic bytes, the length of the JSON header and the header,
+which holds every field of the scan data but the image. The image follows in
+length prefixed chunks, ended by an empty chunk, so robots can send it as
+they read it. All lengths are unsigned 32 bit big endian integers.
+"""
+
+from __future__ import annotations
+
+import struct
+from typing import TYPE_CHECKING, Any
+
+from .json_codecs import get_router_codec, json_decoder
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+    from faststream.rabbit.message import RabbitMessage
+    from faststream.types import DecodedMessage
+
+    from src.models import ScanData
+
+    from .json_codecs import JsonCodec
+
+SCAN_DATA_CONTENT_TYPE = "application/vnd.rubic.scan-data"
+MAGIC = b"RSD1"
+LENGTH = struct.Struct(">I")
+# Chunks are at most 1 MiB, well under the frame size of the broker
+CHUNK_SIZE = 1 << 20
+
+
+def encode_scan_data(scan_data: ScanData, chunk_size: int = CHUNK_SIZE) -> bytes:
+    """Encode scan data in the binary wire format."""
+    header = scan_data.model_dump_json(exclude={"image"}).encode()
+    image = memoryview(scan_data.image)
+    parts = [MAGIC, LENGTH.pack(len(header)), header]
+    for start in range(0, len(image), chunk_size):
+        chunk = image[start : start + chunk_size]
+        parts.extend((LENGTH.pack(len(chunk)), chunk))
+    parts.append(LENGTH.pack(0))
+    return b"".join(parts)
+
+
+def decode_scan_data(body: bytes, codec: JsonCodec | None = None) -> dict[str, Any]:
+    """Decode scan data from the binary wire format, with the image as bytes.
+
+    The header is parsed with the codec, by default the one of the scan router.
+    """
+    if codec is None:
+        codec = get_router_codec("scan/")
+    view = memoryview(body)
+    if view[: len(MAGIC)] != MAGIC:
+        raise ValueError("Not a binary scan data message")
+
+    offset = len(MAGIC)
+    (header_length,) = LENGTH.unpack_from(view, offset)
+    offset += LENGTH.size
+    data = codec.loads(bytes(view[offset : offset + header_length]))
+    offset += header_length
+
+    chunks = []
+    while True:
+        if offset + LENGTH.size > len(view):
+            raise ValueError("Truncated binary scan data message")
+        (chunk_length,) = LENGTH.unpack_from(view, offset)
+        offset += LENGTH.size
+        if chunk_length == 0:
+            break
+        if offset + chunk_length > len(view):
+            raise ValueError("Truncated binary scan data message")
+        chunks.append(view[offset : offset + chunk_length])
+        offset += chunk_length
+
+    data["image"] = b"".join(chunks)
+    return data
+
+
+def scan_data_decoder(codec: JsonCodec) -> Callable[..., Awaitable[DecodedMessage]]:
+    """Create a decoder for binary scan data, and JSON with the codec."""
+    decode_json = json_decoder(codec)
+
+    async def decoder(
+        message: RabbitMessage,
+        original_decoder: Callable[[RabbitMessage], Awaitable[DecodedMessage]],
+    ) -> DecodedMessage:
+        if message.content_type == SCAN_DATA_CONTENT_TYPE:
+            return decode_scan_data(message.body, codec)
+        return await decode_json(message, original_decoder)
+
+    return decoder
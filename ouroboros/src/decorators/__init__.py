@@ -1,5 +1,5 @@
 # Copyright 2024 The Rubic. All Rights Reserved.
 
-from .logger import log
+from .logger import configure_logger, log
 
-__all__ = ["log"]
+__all__ = ["configure_logger", "log"]
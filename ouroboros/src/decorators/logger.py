@@ -3,26 +3,117 @@
 """Logger wrapper."""
 
 import functools
-import traceback
+import logging
+import random
+import sys
+import time
 from collections.abc import Callable
+from typing import Any
 
 from loguru import logger
+from pydantic import BaseModel
+
+from config import settings
+
+# Fields identifying a message, logged as they are
+ID_SUFFIXES = ("_id", "_index", "uuid")
+
+
+def configure_logger() -> None:
+    """Log from a background thread, so handlers never wait on the sink."""
+    logger.remove()
+    logger.add(
+        sys.stderr,
+        level=settings.LOG_LEVEL,
+        enqueue=settings.LOG_ENQUEUE,
+        serialize=settings.LOG_SERIALIZE,
+    )
+
+
+def summarize(value: Any) -> Any:
+    """Summarize a value by its ids, counts and byte sizes."""
+    if isinstance(value, BaseModel):
+        summary: dict[str, Any] = {"type": type(value).__name__}
+        for name, field in value:
+            if isinstance(field, bytes | list | dict):
+                summary[name] = summarize(field)
+            elif name.endswith(ID_SUFFIXES) and isinstance(field, str | int):
+                summary[name] = field
+        return summary
+    if isinstance(value, bytes | bytearray | memoryview):
+        return f"{len(value)} bytes"
+    if isinstance(value, list | tuple | set | dict):
+        return f"{len(value)} items"
+    if value is None or isinstance(value, bool | int | float | str):
+        return value
+    return type(value).__name__
+
+
+def cap(text: str) -> str:
+    """Cap a log text to the configured length."""
+    if len(text) > settings.LOG_SUMMARY_MAX_LENGTH:
+        return f"{text[: settings.LOG_SUMMARY_MAX_LENGTH]}..."
+    return text
+
+
+def format_args(args: tuple, kwargs: dict[str, Any]) -> str:
+    """Summarize the arguments of a call, or log them in full if enabled."""
+    if settings.LOG_PAYLOADS:
+        return str((args, kwargs))
+    # The injected loggers say nothing about the message
+    summaries = [summarize(arg) for arg in args if not isinstance(arg, logging.Logger)]
+    summaries += [
+        f"{name}={summarize(arg)}"
+        for name, arg in kwargs.items()
+        if not isinstance(arg, logging.Logger)
+    ]
+    return cap(str(summaries))
+
+
+def format_result(result: Any) -> str:
+    """Summarize the result of a call, or log it in full if enabled."""
+    if settings.LOG_PAYLOADS:
+        return str(result)
+    return cap(str(summarize(result)))
 
 
 def log(func: Callable) -> Callable:
-    """Logger wrapper."""
+    """Logger wrapper.
+
+    Logs a summary of the arguments and result of a sample of the calls,
+    with their duration. Failures are always logged. Full payloads are only
+    logged with LOG_PAYLOADS.
+    """
 
     @functools.wraps(func)
     async def wrapper(*args, **kwargs) -> None:
-        logger.log("INFO", "Started '{}' with args: {}", func.__name__, (args, kwargs))
+        sampled = random.random() < settings.LOG_SAMPLE_RATE
+        if sampled:
+            logger.info(
+                "Started '{}' with args: {}",
+                func.__name__,
+                format_args(args, kwargs),
+            )
 
+        start = time.perf_counter()
         try:
             result = await func(*args, **kwargs)
         except Exception:
-            logger.error(traceback.format_exc())
+            logger.opt(exception=True).error(
+                "Failed '{}' after {:.1f} ms with args: {}",
+                func.__name__,
+                (time.perf_counter() - start) * 1000,
+                format_args(args, kwargs),
+            )
             raise
 
-        logger.log("INFO", "Ended '{}' with result: {}", func.__name__, result)
+        if sampled:
+            logger.info(
+                "Ended '{}' in {:.1f} ms with result: {}",
+                func.__name__,
+                (time.perf_counter() - start) * 1000,
+                format_result(result),
+            )
         return result
 
     return wrapper
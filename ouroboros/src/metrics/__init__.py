@@ -0,0 +1,26 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+from .endpoint import MetricsEndpoint, metrics_endpoint
+from .middleware import MetricsMiddleware
+from .registry import (
+    Collector,
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsRegistry,
+    metrics,
+)
+from .stages import timed
+
+__all__ = [
+    "Collector",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MetricsEndpoint",
+    "MetricsMiddleware",
+    "MetricsRegistry",
+    "metrics",
+    "metrics_endpoint",
+    "timed",
+]
@@ -0,0 +1,80 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""HTTP endpoint serving the metrics to Prometheus."""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+from .registry import MetricsRegistry, metrics
+
+if TYPE_CHECKING:
+    from asyncio import StreamReader, StreamWriter
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsEndpoint:
+    """Serves GET /metrics in the Prometheus text format.
+
+    A bare asyncio server, so scrapes are answered on the event loop of the
+    broker without another dependency.
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        """Initialize the endpoint of a registry, not serving yet."""
+        self.registry = registry
+        self.server: asyncio.Server | None = None
+
+    @property
+    def port(self) -> int | None:
+        """Port the endpoint listens on, None if it is not serving."""
+        if self.server is None:
+            return None
+        return self.server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str, port: int) -> None:
+        """Listen for scrapes, port 0 picks a free port."""
+        self.server = await asyncio.start_server(self.handle, host, port)
+        logger.info("Serving metrics on http://{}:{}/metrics", host, self.port)
+
+    async def handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        """Answer a request with the metrics."""
+        try:
+            request_line = await reader.readline()
+            # The headers are not needed
+            while await reader.readline() not in {b"\r\n", b"\n", b""}:
+                pass
+
+            method, path, *_ = [*request_line.split(), b"", b""]
+            if method == b"GET" and path.split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: {CONTENT_TYPE}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def stop(self) -> None:
+        """Stop serving."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+
+metrics_endpoint = MetricsEndpoint(metrics)
@@ -0,0 +1,53 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Broker middleware recording the messages consumed by each subscriber."""
+
+import time
+from typing import Any
+
+from aio_pika import IncomingMessage
+from faststream import BaseMiddleware
+from faststream.broker.message import StreamMessage
+from faststream.types import AsyncFuncAny
+
+from .registry import SIZE_BUCKETS, metrics
+
+handler_seconds = metrics.histogram(
+    "handler_seconds", "Duration of the handling of a message in seconds"
+)
+handler_errors = metrics.counter(
+    "handler_errors_total", "Messages whose handler raised an exception"
+)
+handler_in_flight = metrics.gauge(
+    "handler_in_flight", "Messages being handled at the moment"
+)
+message_bytes = metrics.histogram(
+    "message_bytes", "Size of the consumed messages as sent", SIZE_BUCKETS
+)
+
+
+def get_queue(message: IncomingMessage) -> str:
+    """Get the queue of a message, the shards of a queue count as the queue."""
+    queue = message.routing_key or message.exchange or ""
+    return queue.partition(".shard.")[0]
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Records the latency, size and errors of the messages of each queue."""
+
+    async def consume_scope(  # noqa: PLR6301
+        self, call_next: AsyncFuncAny, msg: StreamMessage[IncomingMessage]
+    ) -> Any:
+        """Handle a message, recording its metrics."""
+        queue = get_queue(msg.raw_message)
+        message_bytes.observe(len(msg.raw_message.body), queue=queue)
+        handler_in_flight.inc(queue=queue)
+        start = time.perf_counter()
+        try:
+            return await call_next(msg)
+        except Exception:
+            handler_errors.inc(queue=queue)
+            raise
+        finally:
+            handler_in_flight.dec(queue=queue)
+            handler_seconds.observe(time.perf_counter() - start, queue=queue)
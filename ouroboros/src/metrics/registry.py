@@ -0,0 +1,229 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Counters, gauges and histograms, rendered in the Prometheus text format."""
+
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+from typing import TYPE_CHECKING, TypeVar
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+Labels = tuple[tuple[str, str], ...]
+
+# Upper bounds of the latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Upper bounds of the message size buckets, in bytes
+SIZE_BUCKETS = tuple(float(4**exponent) for exponent in range(5, 14))
+
+
+def get_labels(labels: dict[str, str]) -> Labels:
+    """Get the labels of a sample in a stable order."""
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(labels: Labels) -> str:
+    """Format the labels of a sample."""
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value: float) -> str:
+    """Format the value of a sample."""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """Metric with a value per set of labels."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        """Initialize the metric without samples."""
+        self.name = name
+        self.documentation = documentation
+        self.values: dict[Labels, float] = {}
+        self.lock = threading.Lock()
+
+    def samples(self) -> list[tuple[str, Labels, float]]:
+        """Get the name, labels and value of each sample."""
+        with self.lock:
+            return [(self.name, labels, value) for labels, value in self.values.items()]
+
+    def render(self) -> str:
+        """Render the metric in the Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines += [
+            f"{name}{format_labels(labels)} {format_value(value)}"
+            for name, labels, value in self.samples()
+        ]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Value which only goes up, like a number of messages."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increment the counter."""
+        key = get_labels(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value which goes up and down, like a number of messages in flight."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the gauge."""
+        with self.lock:
+            self.values[get_labels(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increment the gauge."""
+        key = get_labels(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        """Decrement the gauge."""
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Distribution of observed values, like latencies, in buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, buckets: tuple[float, ...]
+    ) -> None:
+        """Initialize the histogram with the upper bounds of its buckets."""
+        super().__init__(name, documentation)
+        self.buckets = (*sorted(buckets), math.inf)
+        self.counts: dict[Labels, list[int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Count a value in its bucket."""
+        key = get_labels(labels)
+        with self.lock:
+            if key not in self.counts:
+                self.counts[key] = [0] * len(self.buckets)
+            self.counts[key][bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = self.values.get(key, 0) + value
+
+    def samples(self) -> list[tuple[str, Labels, float]]:
+        """Get the cumulative buckets, sum and count of each set of labels."""
+        samples = []
+        with self.lock:
+            for labels, counts in self.counts.items():
+                total = 0
+                for bound, count in zip(self.buckets, counts, strict=True):
+                    total += count
+                    bucket_labels = (*labels, ("le", format_value(bound)))
+                    samples.append((f"{self.name}_bucket", bucket_labels, total))
+                samples.extend(
+                    (
+                        (f"{self.name}_sum", labels, self.values[labels]),
+                        (f"{self.name}_count", labels, total),
+                    )
+                )
+        return samples
+
+
+class Collector(Gauge):
+    """Gauge of statistics read when the metrics are rendered."""
+
+    def __init__(
+        self, name: str, documentation: str, collect: Callable[[], dict[str, float]]
+    ) -> None:
+        """Initialize the collector with the function returning the statistics."""
+        super().__init__(name, documentation)
+        self.collect = collect
+
+    def samples(self) -> list[tuple[str, Labels, float]]:
+        """Get a sample per statistic."""
+        return [
+            (self.name, (("stat", stat),), value)
+            for stat, value in self.collect().items()
+        ]
+
+
+M = TypeVar("M", bound=Metric)
+
+
+class MetricsRegistry:
+    """Metrics of the instance, by name.
+
+    Metrics are created on first use and shared afterwards, so modules can
+    declare the metrics they record without a central list.
+    """
+
+    def __init__(self, prefix: str):
+        """Initialize an empty registry, metric names start with the prefix."""
+        self.prefix = prefix
+        self.metrics: dict[str, Metric] = {}
+        self.lock = threading.Lock()
+
+    def get_or_create(self, name: str, kind: type[M], create: Callable[[str], M]) -> M:
+        """Get a metric, creating it if it does not exist yet."""
+        full_name = f"{self.prefix}_{name}"
+        with self.lock:
+            if full_name not in self.metrics:
+                self.metrics[full_name] = create(full_name)
+            metric = self.metrics[full_name]
+        if not isinstance(metric, kind):
+            raise TypeError(f"Metric {full_name} is a {metric.kind}, not a {kind.kind}")
+        return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        """Get a counter."""
+        return self.get_or_create(name, Counter, lambda x: Counter(x, documentation))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        """Get a gauge."""
+        return self.get_or_create(name, Gauge, lambda x: Gauge(x, documentation))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Get a histogram."""
+        return self.get_or_create(
+            name, Histogram, lambda x: Histogram(x, documentation, buckets)
+        )
+
+    def collector(
+        self, name: str, documentation: str, collect: Callable[[], dict[str, float]]
+    ) -> Collector:
+        """Register the statistics of a component, read on render."""
+        return self.get_or_create(
+            name, Collector, lambda x: Collector(x, documentation, collect)
+        )
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "".join(f"{metric.render()}\n" for metric in metrics)
+
+
+metrics = MetricsRegistry("ouroboros")
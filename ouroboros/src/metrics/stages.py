@@ -0,0 +1,23 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Durations of the inner stages of the handlers."""
+
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from .registry import metrics
+
+stage_seconds = metrics.histogram(
+    "stage_seconds", "Duration of the inner stages of the handlers in seconds"
+)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Record the duration of a stage, as a context manager or decorator."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=stage)
@@ -288,6 +288,8 @@ class Item(BaseModel, BoundingBoxMixin):
     absolute: ItemAbsolute
     relative: ItemRelative
     uuid: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    # Incremented by every write of a batch response, missing is 0
+    version: int = 0
 
     object_id: PyObjectId | None = Field(default=None, alias="_id", exclude=True)
 
@@ -297,11 +299,23 @@ class Item(BaseModel, BoundingBoxMixin):
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
 
+class ScanImageThumbnail(BaseModel):
+    """Downsampled grayscale and alpha version of a scan image."""
+
+    pixels_per_meter: int
+    container_name: str
+    blob_name: str
+
+
 class ScanImage(BaseModel):
     """Scan image model."""
 
+    # Legacy base64 image, new images are stored in the blob store
     image: str | None = None
     image_filename: str | None = None
+    container_name: str | None = None
+    blob_name: str | None = None
+    thumbnails: list[ScanImageThumbnail] = []
     image_bottom_left: Vector3
     image_top_right: Vector3
     stamp: Timestamp
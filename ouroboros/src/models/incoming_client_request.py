@@ -15,6 +15,11 @@ class RenderScanRequest(BaseModel):
     user_id: str
     item_type: str | None = None
     debug: bool | None = False
+    side: Literal["left", "right"] | None = None
+    aisle_index: int | None = None
+    scan_id: str | None = None
+    x_min: float | None = None
+    x_max: float | None = None
 
 
 class JobRequest(BaseModel):
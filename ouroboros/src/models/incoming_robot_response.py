@@ -2,11 +2,23 @@
 
 """Module containing the messages from robot."""
 
-from typing import Literal
+import base64
+from typing import Annotated, Any, Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, BeforeValidator, field_serializer
 
-from .db import Barcode, PartialItem, RobotJob, Timestamp, Vector2
+from .db import Barcode, PartialItem, Timestamp, Vector2
+from .outgoing_robot_request import RobotJobMessage
+
+
+def before_validate_image(v: Any) -> Any:
+    """Decodes the base64 image of JSON messages, binary ones carry raw bytes."""
+    if isinstance(v, str):
+        return base64.b64decode(v)
+    return v
+
+
+ImageBytes = Annotated[bytes, BeforeValidator(before_validate_image)]
 
 
 class ResultHeader(BaseModel):
@@ -22,7 +34,7 @@ class RobotBatchResponse(BaseModel):
     """Pydantic model for robot batch response."""
 
     batch_id: str
-    jobs: list[RobotJob]
+    jobs: list[RobotJobMessage]
     header: ResultHeader
 
 
@@ -38,10 +50,16 @@ class ScanData(BaseModel):
     stamp: Timestamp
     scan_id: str
     side: Literal["left", "right"]
-    image: str
+    image: ImageBytes
     aisle_index: int
     image_bottom_left: Vector2
     image_top_right: Vector2
     image_filename: str
     partial_items: list[PartialItem]
     barcodes: list[Barcode]
+
+    @field_serializer("image")
+    @staticmethod
+    def serialize_image(image: bytes, _) -> str:  # noqa: ANN001
+        """Method to serialize the image to base64, as in JSON messages."""
+        return base64.b64encode(image).decode()
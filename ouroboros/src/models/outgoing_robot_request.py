@@ -3,17 +3,103 @@
 """Module containing the messages sent to robot."""
 
 import uuid
+from typing import Annotated, Any, Self
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Discriminator, Field, Tag
 
-from .db import RobotJob
+from .db import Barcode, Item, ItemAbsolute, ItemRelative, RobotJob, RobotJobType
+
+
+class CompactItem(BaseModel):
+    """Item as sent to the robot, ouroboros keeps the rest of it."""
+
+    uuid: str
+    absolute: ItemAbsolute
+    relative: ItemRelative
+    primary_barcode: Barcode | None = None
+
+    @classmethod
+    def from_item(cls, item: Item) -> Self:
+        """Keep the ids, pose, dimensions and primary barcode of an item."""
+        return cls(
+            uuid=item.uuid,
+            absolute=item.absolute,
+            relative=item.relative,
+            primary_barcode=item.primary_barcode,
+        )
+
+    def to_item(self, item: Item) -> Item:
+        """Rebuild the full item, with the pose reported by the robot."""
+        return item.model_copy(
+            update={
+                "absolute": self.absolute,
+                "relative": self.relative,
+                "primary_barcode": self.primary_barcode,
+            },
+            deep=True,
+        )
+
+
+class CompactRobotJob(BaseModel):
+    """Robot job with compact items, to shrink large batches."""
+
+    job_id: str
+    job_type: RobotJobType
+    item: CompactItem
+    destination: CompactItem | None = None
+    future_uuid: str | None = None
+
+    # optional fields
+    attempted: bool | None = None
+    success: bool | None = None
+    error_code: int | None = None
+    error_message: str | None = None
+
+    @classmethod
+    def from_job(cls, job: RobotJob) -> Self:
+        """Compact the items of a job."""
+        return cls(
+            **job.model_dump(exclude={"item", "destination"}),
+            item=CompactItem.from_item(job.item),
+            destination=(
+                CompactItem.from_item(job.destination) if job.destination else None
+            ),
+        )
+
+    def to_job(self, job: RobotJob) -> RobotJob:
+        """Rebuild the full job from the job stored when it was sent."""
+        return job.model_copy(
+            update={
+                **self.model_dump(exclude={"item", "destination"}, exclude_unset=True),
+                "item": self.item.to_item(job.item),
+                "destination": (
+                    self.destination.to_item(job.destination)
+                    if self.destination and job.destination
+                    else job.destination
+                ),
+            }
+        )
+
+
+def get_robot_job_tag(v: Any) -> str:
+    """Tell compact jobs, whose items have no meta, from full ones."""
+    if isinstance(v, BaseModel):
+        return "compact" if isinstance(v, CompactRobotJob) else "full"
+    item = v.get("item") if isinstance(v, dict) else None
+    return "compact" if isinstance(item, dict) and "meta" not in item else "full"
+
+
+RobotJobMessage = Annotated[
+    Annotated[RobotJob, Tag("full")] | Annotated[CompactRobotJob, Tag("compact")],
+    Discriminator(get_robot_job_tag),
+]
 
 
 class RobotBatchRequest(BaseModel):
     """Model for robot batch request."""
 
     batch_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    jobs: list[RobotJob]
+    jobs: list[RobotJobMessage]
 
 
 class RobotScanRequest(BaseModel):
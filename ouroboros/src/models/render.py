@@ -5,7 +5,7 @@
 from datetime import UTC, datetime
 from typing import Literal
 
-from pydantic import BaseModel, computed_field
+from pydantic import BaseModel, computed_field, field_serializer
 
 from src.models import Item, RenderScanRequest
 
@@ -25,6 +25,9 @@ class RenderMeta(BaseModel):
 
     side: str
     aisle_index: int
+    # Only set for renders restricted to part of the aisle
+    x_min: float | None = None
+    x_max: float | None = None
 
 
 class RenderImageMeta(BaseModel):
@@ -41,11 +44,20 @@ class RenderImageMeta(BaseModel):
 class Render(BaseModel):
     """Pydantic model for render."""
 
+    # The first request of the render, joined requests only differ by vendor or user
     request: RenderScanRequest
+    # Users whose requests were served by the render
+    user_ids: list[str] = []
     meta: RenderMeta
     data: list[RenderItemData]
     img_meta: RenderImageMeta | None = None
 
+    @field_serializer("meta")
+    @staticmethod
+    def serialize_meta(meta: RenderMeta) -> dict:
+        """Leave the x range unset on full aisle renders, the client filters on it."""
+        return meta.model_dump(exclude_none=True)
+
     @computed_field
     @property
     def created_at_utc(self) -> float:
@@ -5,6 +5,7 @@
 from faststream.annotations import Logger
 from faststream.rabbit.router import RabbitRouter
 
+from src.codecs import codec_options
 from src.decorators import log
 from src.models import BatchRequest, ItemUpdate, RobotBatchRequest, RobotBatchResponse
 from src.services.handlers.batch import ProcessBatchRequest, ProcessBatchResponse
@@ -12,7 +13,8 @@ from src.services.handlers.batch import ProcessBatchRequest, ProcessBatchRespons
 from .inventory import inventory_router
 from .robot import robot_router
 
-batch_router = RabbitRouter(prefix="batch/")
+batch_router = RabbitRouter(prefix="batch/", **codec_options("batch/"))
+updates_publisher = inventory_router.publisher("updates")
 
 
 @batch_router.subscriber("request")
@@ -27,11 +29,12 @@ async def batch_request_handler(
 
 
 @batch_router.subscriber("response")
-@inventory_router.publisher("updates")
+@updates_publisher
 @log
 async def batch_response_handler(
     body: RobotBatchResponse, logger: Logger
 ) -> list[ItemUpdate]:
     """Handle batch response."""
-    handler = ProcessBatchResponse()
+    # The updates of the jobs committed before a failure are still published
+    handler = ProcessBatchResponse(updates_publisher.publish)
     return await handler.run(body, logger)
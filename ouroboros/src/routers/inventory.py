@@ -5,14 +5,16 @@
 from faststream.annotations import Logger
 from faststream.rabbit.router import RabbitRouter
 
+from src.codecs import codec_options
 from src.decorators import log
 from src.models import RenderScanRequest
+from src.routers.sharding import sharded_subscriber
 from src.services.handlers.render import RenderInventory
 
-inventory_router = RabbitRouter(prefix="inventory/")
+inventory_router = RabbitRouter(prefix="inventory/", **codec_options("inventory/"))
 
 
-@inventory_router.subscriber("render")
+@sharded_subscriber(inventory_router, "render")
 @log
 async def render_request_handler(body: RenderScanRequest, logger: Logger) -> None:
     """Handle process request messages."""
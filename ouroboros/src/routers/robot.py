@@ -4,4 +4,6 @@
 
 from faststream.rabbit.router import RabbitRouter
 
-robot_router = RabbitRouter(prefix="robot/")
+from src.codecs import codec_options
+
+robot_router = RabbitRouter(prefix="robot/", **codec_options("robot/"))
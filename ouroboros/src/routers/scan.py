@@ -5,6 +5,7 @@
 from faststream.annotations import Logger
 from faststream.rabbit.router import RabbitRouter
 
+from src.codecs import codec_options, get_router_codec, scan_data_decoder
 from src.decorators import log
 from src.models import (
     CompileScanDataRequest,
@@ -13,6 +14,7 @@ from src.models import (
     ScanData,
     ScanRequest,
 )
+from src.routers.sharding import sharded_subscriber
 from src.services.handlers.scan import (
     CompileScanData,
     IngestScanData,
@@ -22,10 +24,10 @@ from src.services.handlers.scan import (
 
 from .robot import robot_router
 
-scan_router = RabbitRouter(prefix="scan/")
+scan_router = RabbitRouter(prefix="scan/", **codec_options("scan/"))
 
 
-@scan_router.subscriber("request")
+@sharded_subscriber(scan_router, "request")
 @robot_router.publisher("scan_request")
 @log
 async def scan_request_handler(body: ScanRequest, logger: Logger) -> RobotScanRequest:
@@ -42,7 +44,7 @@ async def scan_response_handler(body: RobotScanResponse, logger: Logger) -> None
     await handler.run(body, logger)
 
 
-@scan_router.subscriber("compile")
+@sharded_subscriber(scan_router, "compile")
 @log
 async def compile_scan_data_handler(
     body: CompileScanDataRequest, logger: Logger
@@ -52,7 +54,9 @@ async def compile_scan_data_handler(
     await handler.run(logger)
 
 
-@scan_router.subscriber("data")
+@sharded_subscriber(
+    scan_router, "data", decoder=scan_data_decoder(get_router_codec("scan/"))
+)
 @log
 async def scan_data_handler(body: ScanData, logger: Logger) -> None:
     """Handle scan data message."""
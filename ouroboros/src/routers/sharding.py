@@ -0,0 +1,108 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Aisle sharded subscribers, to split the aisles across instances."""
+
+from collections.abc import Callable
+from typing import Any
+
+from faststream.rabbit import ExchangeType, RabbitExchange, RabbitQueue
+from faststream.rabbit.annotations import RabbitBroker, RabbitMessage
+from faststream.rabbit.router import RabbitRouter
+from loguru import logger
+
+from config import settings
+from src.utils import HashRing
+
+sharded_exchange = RabbitExchange(
+    settings.SHARD_EXCHANGE, type=ExchangeType.TOPIC, durable=True
+)
+
+
+def is_sharded() -> bool:
+    """Check if messages of an aisle are routed to the instance owning it."""
+    return settings.SHARD_COUNT > 1
+
+
+def get_shard(aisle_index: int | None) -> int:
+    """Get the shard of an aisle, messages without an aisle go to shard 0."""
+    if aisle_index is None:
+        return 0
+    return aisle_index % settings.SHARD_COUNT
+
+
+def get_routing_key(queue: str, shard: int) -> str:
+    """Get the routing key, and queue name, of a shard of a queue."""
+    return f"{queue}.shard.{shard}"
+
+
+def get_owned_shards() -> list[int]:
+    """Get the shards owned by this instance."""
+    ring = HashRing(settings.SHARD_INSTANCES)
+    return [
+        shard
+        for shard in range(settings.SHARD_COUNT)
+        if ring.get_node(str(shard)) == settings.INSTANCE_ID
+    ]
+
+
+def sharded_subscriber(
+    router: RabbitRouter, queue: str, **kwargs: Any
+) -> Callable[[Callable[..., Any]], Any]:
+    """Subscribe a handler to the shards of a queue owned by this instance.
+
+    Producers publish to the sharded exchange with the routing key of the
+    shard of the aisle. Messages still sent to the plain queue are forwarded
+    to their shard, so producers can move over one by one. Without sharding
+    the handler consumes the plain queue. Keyword arguments, such as a
+    decoder, are passed to the subscribers.
+    """
+
+    def decorator(func: Callable[..., Any]) -> Any:
+        if not is_sharded():
+            return router.subscriber(queue, **kwargs)(func)
+
+        add_forwarder(router, queue, **kwargs)
+        owned_shards = get_owned_shards()
+        logger.info(
+            "Instance {} consumes shards {} of {}{}",
+            settings.INSTANCE_ID,
+            owned_shards,
+            router.prefix,
+            queue,
+        )
+        for shard in owned_shards:
+            routing_key = get_routing_key(queue, shard)
+            func = router.subscriber(
+                RabbitQueue(routing_key, durable=True, routing_key=routing_key),
+                sharded_exchange,
+                **kwargs,
+            )(func)
+        return func
+
+    return decorator
+
+
+def add_forwarder(router: RabbitRouter, queue: str, **kwargs: Any) -> None:
+    """Forward the messages of the plain queue to the shard of their aisle.
+
+    The body is forwarded as received, it is only decoded to read the aisle.
+    """
+
+    @router.subscriber(queue, **kwargs)
+    async def forward_to_shard(
+        body: dict[str, Any],
+        message: RabbitMessage,
+        broker: RabbitBroker,
+    ) -> None:
+        shard = get_shard(body.get("aisle_index"))
+        await broker.publish(
+            # Forwarded as received, still compressed if it was
+            message.raw_message.body,
+            exchange=sharded_exchange,
+            routing_key=get_routing_key(f"{router.prefix}{queue}", shard),
+            correlation_id=message.correlation_id,
+            reply_to=message.reply_to or "",
+            content_type=message.content_type,
+            content_encoding=message.raw_message.content_encoding,
+            headers=message.headers,
+        )
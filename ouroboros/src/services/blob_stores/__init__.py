@@ -0,0 +1,13 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+from .azure_blob_store import AzureBlobStore
+from .local_blob_store import LocalBlobStore
+from .upload_queue import BlobUpload, BlobUploadQueue, blob_upload_queue
+
+__all__ = [
+    "AzureBlobStore",
+    "BlobUpload",
+    "BlobUploadQueue",
+    "LocalBlobStore",
+    "blob_upload_queue",
+]
@@ -0,0 +1,39 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Azure blob store."""
+
+import io
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from src.services.blob_stores.base_blob_store import BlobReader, BlobStoreABC
+
+
+class AzureBlobStore(BlobStoreABC):
+    """Stores blobs in Azure blob storage."""
+
+    def __init__(self, connection_string: str):
+        """Initialize the Azure blob service client."""
+        # Imported here, azure is slow to import and unused with a local store
+        from azure.storage.blob import BlobServiceClient  # noqa: PLC0415
+
+        self.blob_service_client = BlobServiceClient.from_connection_string(
+            connection_string
+        )
+
+    def upload(
+        self, container: str, name: str, data: bytes, *, overwrite: bool = False
+    ) -> None:
+        """Upload the bytes of a blob to the container."""
+        container_client = self.blob_service_client.get_container_client(container)
+        container_client.upload_blob(name=name, data=data, overwrite=overwrite)
+
+    @contextmanager
+    def open(self, container: str, name: str) -> Iterator[BlobReader]:
+        """Download a blob into memory."""
+        container_client = self.blob_service_client.get_container_client(container)
+        downloader = container_client.download_blob(name)
+        with io.BytesIO() as buf:
+            downloader.readinto(buf)
+            buf.seek(0)
+            yield buf
@@ -0,0 +1,26 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Implements abstract class for blob stores."""
+
+import mmap
+from abc import ABC, abstractmethod
+from contextlib import AbstractContextManager
+from typing import IO, TypeAlias
+
+BlobReader: TypeAlias = IO[bytes] | mmap.mmap
+
+
+class BlobStoreABC(ABC):
+    """Abstract class for binary blob storage."""
+
+    @abstractmethod
+    def upload(
+        self, container: str, name: str, data: bytes, *, overwrite: bool = False
+    ) -> None:
+        """Store the bytes of a blob."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def open(self, container: str, name: str) -> AbstractContextManager[BlobReader]:
+        """Open a blob as a seekable binary reader."""
+        raise NotImplementedError
@@ -0,0 +1,64 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Local filesystem blob store."""
+
+import io
+import mmap
+import os
+import tempfile
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from src.services.blob_stores.base_blob_store import BlobReader, BlobStoreABC
+
+
+class LocalBlobStore(BlobStoreABC):
+    """Stores blobs as files, one directory per container.
+
+    Used by offline sites and tests. Blobs are memory mapped when read so
+    large images are not copied into memory.
+    """
+
+    def __init__(self, root: str | Path):
+        """Initialize the store in the root directory."""
+        self.root = Path(root)
+
+    def get_path(self, container: str, name: str) -> Path:
+        """Get the path of a blob, refusing names escaping the container."""
+        container_dir = (self.root / container).resolve()
+        path = (container_dir / name).resolve()
+        if not path.is_relative_to(container_dir):
+            raise ValueError(f"Invalid blob name {name}")
+        return path
+
+    def upload(
+        self, container: str, name: str, data: bytes, *, overwrite: bool = False
+    ) -> None:
+        """Write the blob atomically, so readers never see a partial file."""
+        path = self.get_path(container, name)
+        if not overwrite and path.exists():
+            raise FileExistsError(f"Blob {name} already exists in {container}")
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            Path(tmp_path).replace(path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    @contextmanager
+    def open(self, container: str, name: str) -> Iterator[BlobReader]:
+        """Memory map the blob."""
+        path = self.get_path(container, name)
+        with path.open("rb") as f:
+            # Empty files cannot be memory mapped
+            if path.stat().st_size == 0:
+                yield io.BytesIO()
+                return
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm
@@ -0,0 +1,166 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Bounded queue of blob uploads done in the background."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, NamedTuple
+
+from loguru import logger
+
+from config import settings
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from src.services.blob_stores.base_blob_store import BlobStoreABC
+
+
+class BlobUpload(NamedTuple):
+    """A blob to upload, and what to do once it is stored or failed."""
+
+    store: BlobStoreABC
+    container: str
+    name: str
+    data: bytes
+    overwrite: bool = False
+    on_uploaded: Callable[[], None] | None = None
+    on_failed: Callable[[], None] | None = None
+
+
+class BlobUploadQueue:
+    """Uploads blobs in the background, after the message is acknowledged.
+
+    The queue is bounded, so handlers wait for room instead of buffering
+    without limit when the blob store is slow. Failed uploads are retried
+    with an exponential backoff, then handed back to `on_failed` to be kept.
+    Workers start with the first upload on the running event loop, and the
+    queue is drained on shutdown.
+    """
+
+    def __init__(self, max_size: int, workers: int, retries: int, retry_delay: float):
+        """Initialize the queue, without starting the workers."""
+        self.max_size = max_size
+        self.workers = workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.queue: asyncio.Queue[BlobUpload] | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.worker_tasks: list[asyncio.Task[None]] = []
+
+        self.uploaded = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self) -> asyncio.Queue[BlobUpload]:
+        """Start the workers on the running event loop, if not started."""
+        loop = asyncio.get_running_loop()
+        if self.queue is None or self.loop is not loop:
+            self.cancel_workers()
+            self.queue = asyncio.Queue(self.max_size)
+            self.loop = loop
+            self.worker_tasks = [
+                asyncio.create_task(self.work(self.queue)) for _ in range(self.workers)
+            ]
+        return self.queue
+
+    def cancel_workers(self) -> None:
+        """Cancel the workers of another event loop, failing their queued uploads."""
+        if self.loop is not None and not self.loop.is_closed():
+            for task in self.worker_tasks:
+                self.loop.call_soon_threadsafe(task.cancel)
+        self.worker_tasks = []
+
+        while self.queue is not None and not self.queue.empty():
+            upload = self.queue.get_nowait()
+            logger.warning(
+                "Dropped upload of blob {} queued on another event loop", upload.name
+            )
+            self.fail(upload)
+
+    async def submit(self, upload: BlobUpload) -> None:
+        """Queue an upload, waiting while the queue is full."""
+        await self.start().put(upload)
+
+    async def work(self, queue: asyncio.Queue[BlobUpload]) -> None:
+        """Upload the queued blobs one at a time."""
+        while True:
+            upload = await queue.get()
+            try:
+                await self.upload(upload)
+            finally:
+                queue.task_done()
+
+    async def upload(self, upload: BlobUpload) -> None:
+        """Upload a blob, retrying failures, then run its callback."""
+        for attempt in range(self.retries + 1):
+            try:
+                await asyncio.to_thread(
+                    upload.store.upload,
+                    upload.container,
+                    upload.name,
+                    upload.data,
+                    overwrite=upload.overwrite,
+                )
+                break
+            except Exception:  # noqa: BLE001
+                if attempt == self.retries:
+                    logger.exception(
+                        "Failed to upload blob {} to {} after {} attempts",
+                        upload.name,
+                        upload.container,
+                        attempt + 1,
+                    )
+                    await asyncio.to_thread(self.fail, upload)
+                    return
+                self.retried += 1
+                await asyncio.sleep(self.retry_delay * 2**attempt)
+
+        self.uploaded += 1
+        if upload.on_uploaded is not None:
+            try:
+                await asyncio.to_thread(upload.on_uploaded)
+            except Exception:  # noqa: BLE001
+                logger.exception("Failed to record uploaded blob {}", upload.name)
+
+    def fail(self, upload: BlobUpload) -> None:
+        """Count a failed upload and run its failure callback."""
+        self.failed += 1
+        if upload.on_failed is not None:
+            try:
+                upload.on_failed()
+            except Exception:  # noqa: BLE001
+                logger.exception("Failed to keep failed blob upload {}", upload.name)
+
+    async def drain(self) -> None:
+        """Wait for the queued uploads to finish."""
+        if self.queue is not None and self.loop is asyncio.get_running_loop():
+            await self.queue.join()
+
+    async def stop(self) -> None:
+        """Finish the queued uploads and stop the workers."""
+        await self.drain()
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+        self.queue = None
+        self.loop = None
+
+    def stats(self) -> dict[str, float]:
+        """Upload statistics."""
+        return {
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "uploaded": self.uploaded,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+blob_upload_queue = BlobUploadQueue(
+    settings.BLOB_UPLOAD_QUEUE_SIZE,
+    settings.BLOB_UPLOAD_WORKERS,
+    settings.BLOB_UPLOAD_RETRIES,
+    settings.BLOB_UPLOAD_RETRY_DELAY_SECONDS,
+)
@@ -1,6 +1,12 @@
 # Copyright 2024 The Rubic. All Rights Reserved.
 
+from .blob_store_factory import BlobStoreFactory, LazyBlobStore
 from .robot_job_factory import RobotJobFactory
 from .robot_response_factory import RobotResponseFactory
 
-__all__ = ["RobotJobFactory", "RobotResponseFactory"]
+__all__ = [
+    "BlobStoreFactory",
+    "LazyBlobStore",
+    "RobotJobFactory",
+    "RobotResponseFactory",
+]
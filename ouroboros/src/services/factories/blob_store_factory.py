@@ -0,0 +1,40 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Module to implement factory pattern for blob stores."""
+
+from functools import cache
+from typing import Any
+
+from config import settings
+from src.services.blob_stores import AzureBlobStore, LocalBlobStore
+from src.services.blob_stores.base_blob_store import BlobStoreABC
+
+
+class BlobStoreFactory:
+    """Implements factory design for blob stores."""
+
+    @staticmethod
+    @cache
+    def get_blob_store() -> BlobStoreABC:
+        """Get the blob store configured in the settings."""
+        match settings.BLOB_STORE:
+            case "azure":
+                return AzureBlobStore(settings.AZUR_BLOB_CONN)
+            case "local":
+                return LocalBlobStore(settings.LOCAL_BLOB_DIR)
+            case _:
+                raise NotImplementedError(
+                    f"Blob store {settings.BLOB_STORE} is not supported"
+                )
+
+
+class LazyBlobStore:
+    """Class attribute getting the configured blob store on first use.
+
+    Creating the blob store client is deferred until a handler needs it, so
+    importing the handlers needs no secret nor network.
+    """
+
+    def __get__(self, instance: object, owner: type[Any]) -> BlobStoreABC:
+        """Get the blob store."""
+        return BlobStoreFactory.get_blob_store()
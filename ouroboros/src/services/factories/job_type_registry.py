@@ -0,0 +1,160 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Registry of the job types of all vendors."""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any
+
+from loguru import logger
+from pydantic import ValidationError
+
+from config import settings
+from db.change_stream import ChangeStreamWatcher
+from db.mongodb import job_type_collection
+from src.models import JobType
+
+
+class JobTypeRegistry:
+    """Keeps all job types in memory.
+
+    Job types are loaded in one query, at startup or on first use. Once older
+    than the TTL, or when the change stream reports a change, they are
+    reloaded in the background and served meanwhile. Job types missing from
+    the registry are looked up individually, so new job types are available
+    before the next reload.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        """Initialize an empty registry."""
+        self.ttl_seconds = ttl_seconds
+        self.job_types: dict[tuple[str, str], JobType] = {}
+        self.loaded_at: float | None = None
+        self.stale = False
+        self.lock = threading.Lock()
+        # Held while loading, so a single load queries the job types at a time
+        self.load_lock = threading.Lock()
+        self.reload_thread: threading.Thread | None = None
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+        self.watcher = ChangeStreamWatcher(
+            job_type_collection, self.on_change, self.expire
+        )
+
+    def load(self, *, if_unloaded: bool = False) -> None:
+        """Load all job types, or only if not loaded yet."""
+        with self.load_lock:
+            if if_unloaded and self.loaded_at is not None:
+                return
+
+            # Changes reported during the query expire the loaded job types
+            with self.lock:
+                self.stale = False
+
+            job_types = {}
+            for doc in job_type_collection.find({}):
+                try:
+                    job_type = JobType.model_validate(doc)
+                except ValidationError:
+                    logger.exception("Skipping invalid job type {}", doc.get("_id"))
+                    continue
+                job_types[job_type.vendor, job_type.job_type] = job_type
+
+            with self.lock:
+                self.job_types = job_types
+                self.loaded_at = time.monotonic()
+                self.reloads += 1
+        logger.info("Loaded {} job types", len(job_types))
+
+    def is_expired(self) -> bool:
+        """Check if the job types must be reloaded."""
+        if self.loaded_at is None or self.stale:
+            return True
+        return 0 < self.ttl_seconds < time.monotonic() - self.loaded_at
+
+    def expire(self) -> None:
+        """Reload the job types in the background."""
+        with self.lock:
+            self.stale = True
+        self.reload()
+
+    def reload(self) -> None:
+        """Start reloading the job types in the background, unless already."""
+        with self.lock:
+            if self.reload_thread is not None and self.reload_thread.is_alive():
+                return
+            self.reload_thread = threading.Thread(
+                target=self.try_load, name="job-type-reload", daemon=True
+            )
+            self.reload_thread.start()
+
+    def try_load(self) -> None:
+        """Load all job types, expired ones are served if it fails."""
+        try:
+            self.load()
+        except Exception:  # noqa: BLE001
+            logger.exception("Failed to reload the job types")
+
+    def get(self, vendor: str, job_type: str) -> JobType:
+        """Get the job type of a vendor."""
+        if self.loaded_at is None:
+            # Nothing to serve yet, concurrent first lookups share one load
+            self.load(if_unloaded=True)
+        elif self.is_expired():
+            self.reload()
+
+        with self.lock:
+            found = self.job_types.get((vendor, job_type))
+            if found is not None:
+                self.hits += 1
+                return found
+            self.misses += 1
+
+        job_type_doc = job_type_collection.find_one(
+            {
+                "vendor": vendor,
+                "job_type": job_type,
+            },
+        )
+        if job_type_doc is None:
+            msg = f"Job type {job_type} not found for vendor {vendor}"
+            logger.error(msg)
+            raise ValueError(msg)
+
+        found = JobType.model_validate(job_type_doc)
+        with self.lock:
+            self.job_types[vendor, job_type] = found
+        return found
+
+    def stats(self) -> dict[str, float]:
+        """Registry statistics."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.job_types),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "reloads": self.reloads,
+            }
+
+    def on_change(self, change: dict[str, Any]) -> None:
+        """Reload the job types after any change."""
+        logger.info("Job types changed ({})", change["operationType"])
+        self.expire()
+
+    def start_watching(self) -> None:
+        """Reload the job types when they change."""
+        self.watcher.start()
+
+    def stop(self) -> None:
+        """Stop watching job type changes."""
+        self.watcher.stop()
+
+
+job_type_registry = JobTypeRegistry(settings.JOB_TYPE_TTL_SECONDS)
@@ -4,58 +4,147 @@
 
 from __future__ import annotations
 
-import functools
 from typing import TYPE_CHECKING
 
 from loguru import logger
 
-from db.mongodb import job_type_collection
-from src.models import JobType, RobotJob
+from config import settings
+from src.services.factories.job_type_registry import job_type_registry
+from src.services.persistence import IdentityMap
 from src.services.robot_requests import (
     FetchDesignatedRobotJobBuilder,
     FetchInventoryRobotJobBuilder,
+    FetchPlanner,
     StoreDesignatedRobotJobBuilder,
     StoreInventoryRobotJobBuilder,
 )
+from src.services.robot_requests.barcode_cache import barcode_cache
 
 if TYPE_CHECKING:
-    from src.models import JobRequest
+    from src.models import BatchRequest, JobRequest, JobType, RobotJob
     from src.services.robot_requests.base_robot_job_builder import RobotJobBuilderABC
 
 
-@functools.lru_cache
 def get_job_type(vendor: str, job_type: str) -> JobType:
     """Get job_type object."""
-    job_type_doc = job_type_collection.find_one(
-        {
-            "vendor": vendor,
-            "job_type": job_type,
-        },
-    )
-    if job_type_doc is None:
-        msg = f"Job type {job_type} not found for vendor {vendor}"
-        logger.error(msg)
-        raise ValueError(msg)
-
-    return JobType.model_validate(job_type_doc)
+    return job_type_registry.get(vendor, job_type)
 
 
 class RobotJobFactory:
     """Implements factory design for robot job builders."""
 
-    def __init__(self):
+    def __init__(self, identity_map: IdentityMap | None = None):
         """Initialize the RobotJobBuilderFactory class."""
         self.fetched_items = {}
+        self.identity_map = identity_map or IdentityMap()
+        # Robot moves of the planned fetches against planning them one by one
+        self.planning = {"naive_moves": 0, "planned_moves": 0, "saved_moves": 0}
+
+    def prefetch(self, batch_request: BatchRequest) -> None:
+        """Load the items and barcodes used by the batch in a few queries."""
+        barcode_data: set[str] = set()
+        uuids: set[str] = set()
+        for job_request in batch_request:
+            if job_request.uid:
+                barcode_data.add(job_request.uid)
+            if job_request.destination_uuid:
+                # Either an item uuid or the uid of an item fetched in the batch
+                uuids.add(job_request.destination_uuid)
+                barcode_data.add(job_request.destination_uuid)
+            try:
+                job_type = get_job_type(job_request.vendor, job_request.job_type)
+            except ValueError:
+                # Raised again in order when the job is built
+                continue
+            if job_type.item_uuid:
+                uuids.add(job_type.item_uuid)
+
+        # Barcodes seen in earlier batches only need their item to be loaded
+        cached = barcode_cache.get_many(barcode_data)
+        self.identity_map.add_barcodes(
+            {data: barcode_doc for data, (_, barcode_doc) in cached.items()}
+        )
+        uuids |= {item_uuid for item_uuid, _ in cached.values()}
+
+        self.identity_map.load(barcode_data - cached.keys(), uuids)
+
+    def build_batch_jobs(self, batch_request: BatchRequest) -> list[RobotJob]:
+        """Build the jobs of a batch.
+
+        Consecutive fetch inventory requests are planned together, so items
+        stacked on several targets are only moved once.
+        """
+        jobs: list[RobotJob] = []
+        fetch_requests: list[tuple[JobRequest, JobType]] = []
+        for job_request in batch_request:
+            job_type = get_job_type(job_request.vendor, job_request.job_type)
+            if job_type.generic_type == "FETCH_INVENTORY":
+                fetch_requests.append((job_request, job_type))
+                continue
+
+            jobs.extend(self.plan_fetches(fetch_requests))
+            fetch_requests = []
+            jobs.extend(self.build_jobs(job_request))
+
+        jobs.extend(self.plan_fetches(fetch_requests))
+        return jobs
 
     def build_jobs(self, job_request: JobRequest) -> list[RobotJob]:
         """Build jobs to accomplish job_request."""
         job_type = get_job_type(job_request.vendor, job_request.job_type)
-        job_builder = self.get_robot_job_builder(job_request, job_type)
-        jobs = job_builder.build_jobs()
-
         if job_type.generic_type == "FETCH_INVENTORY":
-            self.fetched_items[job_request.uid] = job_request.destination_uuid
+            return self.plan_fetches([(job_request, job_type)])
+
+        job_builder = self.get_robot_job_builder(job_request, job_type)
+        return job_builder.build_jobs()
+
+    def plan_fetches(
+        self, fetch_requests: list[tuple[JobRequest, JobType]]
+    ) -> list[RobotJob]:
+        """Plan fetch inventory requests together.
+
+        The requests are split in consecutive groups, so the unstacked items
+        held until a group is fetched fit on the robot with the targets of the
+        earlier groups. A request which does not fit alone is planned alone.
+        The load of a group grows with each request, only the accepted groups
+        are planned.
+        """
+        jobs: list[RobotJob] = []
+        planner = FetchPlanner([])
+        carried = 0
+        for job_request, job_type in fetch_requests:
+            builder = FetchInventoryRobotJobBuilder(
+                job_request, job_type, self.fetched_items, self.identity_map
+            )
+            target_item = builder.get_item_from_barcode(builder.request.uid)
+            reached: set[str] | None = planner.reach(builder, target_item)
+            if planner.builders and carried + len(reached) > settings.ROBOT_CAPACITY:
+                jobs.extend(self.accept_plan(planner))
+                carried += len(planner.targets)
+                planner = FetchPlanner([])
+                reached = None
+
+            planner.add(builder, target_item, reached)
+
+        if planner.builders:
+            jobs.extend(self.accept_plan(planner))
+        return jobs
 
+    def accept_plan(self, planner: FetchPlanner) -> list[RobotJob]:
+        """Plan the jobs of a group, count its moves and mark it as fetched."""
+        jobs = planner.build_jobs()
+        for key in self.planning:
+            self.planning[key] += planner.stats[key]
+
+        for builder in planner.builders:
+            self.fetched_items[builder.request.uid] = builder.request.destination_uuid
+
+        logger.info(
+            "Planned {} fetch requests in {} moves instead of {}",
+            len(planner.builders),
+            planner.stats["planned_moves"],
+            planner.stats["naive_moves"],
+        )
         return jobs
 
     def get_robot_job_builder(
@@ -64,22 +153,22 @@ class RobotJobFactory:
         """Get robot job builder based on job type."""
         if job_type.generic_type == "FETCH_INVENTORY":
             return FetchInventoryRobotJobBuilder(
-                job_request, job_type, self.fetched_items
+                job_request, job_type, self.fetched_items, self.identity_map
             )
 
         if job_type.generic_type == "STORE_INVENTORY":
             return StoreInventoryRobotJobBuilder(
-                job_request, job_type, self.fetched_items
+                job_request, job_type, self.fetched_items, self.identity_map
             )
 
         if job_type.generic_type == "STORE_DESIGNATED":
             return StoreDesignatedRobotJobBuilder(
-                job_request, job_type, self.fetched_items
+                job_request, job_type, self.fetched_items, self.identity_map
             )
 
         if job_type.generic_type == "FETCH_DESIGNATED":
             return FetchDesignatedRobotJobBuilder(
-                job_request, job_type, self.fetched_items
+                job_request, job_type, self.fetched_items, self.identity_map
             )
 
         raise ValueError(f"Job type {job_type.generic_type} is not supported")
@@ -15,6 +15,7 @@ from src.services.robot_responses import (
 
 if TYPE_CHECKING:
     from src.models.db import RobotJob
+    from src.services.persistence import WritePlan
     from src.services.robot_responses.base_robot_response import RobotResponseABC
 
 
@@ -22,17 +23,17 @@ class RobotResponseFactory:
     """Implements factory design for robot responses."""
 
     @staticmethod
-    def get_robot_response_service(job: RobotJob) -> RobotResponseABC:
-        """Get robot response handler based on task type."""
+    def get_robot_response_service(job: RobotJob, plan: WritePlan) -> RobotResponseABC:
+        """Get robot response handler based on task type, writing to the plan."""
         match job.job_type:
             case "FETCH_INVENTORY":
-                return FetchInventoryRobotResponse()
+                return FetchInventoryRobotResponse(plan)
             case "STORE_INVENTORY":
-                return StoreInventoryRobotResponse()
+                return StoreInventoryRobotResponse(plan)
             case "FETCH_DESIGNATED":
-                return FetchDesignatedRobotResponse()
+                return FetchDesignatedRobotResponse(plan)
             case "STORE_DESIGNATED":
-                return StoreDesignatedRobotResponse()
+                return StoreDesignatedRobotResponse(plan)
             case _:
                 raise NotImplementedError(
                     f"Response with job type {job.job_type} is not supported"
@@ -2,20 +2,23 @@
 
 """Job processing handler."""
 
+from typing import Any
+
 from faststream.rabbit.annotations import Logger
-from loguru import logger
 
+from config import settings
 from db.mongodb import (
     robot_batch_collection,
     robot_job_collection,
 )
 from src.models import (
     BatchRequest,
+    CompactRobotJob,
     RobotBatchRequest,
-    RobotJob,
 )
 from src.services.factories import RobotJobFactory
 from src.services.handlers import Handler
+from src.services.robot_requests import JobSequencer
 
 
 class ProcessBatchRequest(Handler):
@@ -24,7 +27,7 @@ class ProcessBatchRequest(Handler):
     async def run(self, body: BatchRequest, logger: Logger) -> RobotBatchRequest:
         """Handle batch request from client."""
         self.logger = logger
-        self.logger.info("Received batch request with body {}", body)
+        self.logger.info("Received batch request with {} jobs", len(body))
 
         # TODO: Validate the batch
 
@@ -32,24 +35,35 @@ class ProcessBatchRequest(Handler):
 
     def process_batch_request(self, batch_request: BatchRequest) -> RobotBatchRequest:
         """Process batch request."""
-        logger.info("Processing batch request {}.", batch_request)
-
         # Convert batch into list of robot jobs
-        robot_jobs: list[RobotJob] = []
         robot_job_factory = RobotJobFactory()
-        for job_request in batch_request:
-            jobs = robot_job_factory.build_jobs(job_request)
-            robot_jobs.extend(jobs)
+        robot_job_factory.prefetch(batch_request)
+        robot_jobs = robot_job_factory.build_batch_jobs(batch_request)
+        planning = dict(robot_job_factory.planning)
+
+        if settings.JOB_SEQUENCING:
+            job_sequencer = JobSequencer(
+                settings.ROBOT_CAPACITY, settings.AISLE_CHANGE_DISTANCE
+            )
+            robot_jobs = job_sequencer.sequence(robot_jobs)
+            planning |= job_sequencer.stats
 
         robot_batch_request = RobotBatchRequest(jobs=robot_jobs)
-        self.log_robot_batch_request(robot_batch_request)
+        self.log_robot_batch_request(robot_batch_request, planning)
+
+        if settings.COMPACT_ROBOT_JOBS:
+            # The full jobs are stored, the robot only gets what it needs
+            jobs = [CompactRobotJob.from_job(job) for job in robot_batch_request.jobs]
+            robot_batch_request = robot_batch_request.model_copy(update={"jobs": jobs})
         return robot_batch_request
 
-    def log_robot_batch_request(self, robot_batch_request: RobotBatchRequest) -> None:
+    def log_robot_batch_request(
+        self, robot_batch_request: RobotBatchRequest, planning: dict[str, Any]
+    ) -> None:
         """Send next RobotBatchRequest to robot."""
-        # Insert robot request into db
+        # Insert robot request into db, with the savings of the fetch planning
         robot_batch_collection.insert_one(
-            robot_batch_request.model_dump(exclude_none=True)
+            {**robot_batch_request.model_dump(exclude_none=True), "planning": planning}
         )
         # Insert each job into db as well
         for robot_job in robot_batch_request.jobs:
@@ -2,21 +2,42 @@
 
 """Batch response handler."""
 
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import Any
+
 from faststream.rabbit.annotations import Logger
 from loguru import logger
+from pymongo import UpdateOne
 
+from config import settings
 from db.mongodb import robot_batch_collection
 from src.models import ItemUpdate, RobotBatchResponse
 from src.services.factories import RobotResponseFactory
 from src.services.handlers import Handler
+from src.services.persistence import (
+    ConcurrentModificationError,
+    IdentityMap,
+    PartialCommitError,
+    WritePlan,
+    job_ledger,
+)
+from src.services.robot_requests.barcode_cache import barcode_cache
+from src.services.robot_responses import partition_jobs, rehydrate_jobs
 
 
 class ProcessBatchResponse(Handler):
     """Batch response handler."""
 
+    def __init__(
+        self,
+        publish_updates: Callable[[list[ItemUpdate]], Awaitable[Any]] | None = None,
+    ):
+        """Initialize the handler, with how to publish updates before a failure."""
+        self.publish_updates = publish_updates
+
     async def run(self, body: RobotBatchResponse, logger: Logger) -> list[ItemUpdate]:
         """Handle robot response."""
-        logger.info("Received batch response with body {}", body)
         response = body
 
         # TODO: Validate the response
@@ -37,24 +58,193 @@ class ProcessBatchResponse(Handler):
                     job.error_message,
                 )
 
-        return self.process_response(response)
+        return await self.process_response(response, self.publish_updates)
 
     @staticmethod
-    def process_response(response: RobotBatchResponse) -> list[ItemUpdate]:
-        """Process response."""
-        updates = []
-        # Update the db
-        robot_batch_collection.replace_one(
-            {"batch_id": response.batch_id}, response.model_dump()
+    def prefetch(response: RobotBatchResponse) -> IdentityMap:
+        """Load the items touched by the jobs of the response in a few queries."""
+        identity_map = IdentityMap()
+        uuids = {job.item.uuid for job in response.jobs}
+        uuids |= {job.destination.uuid for job in response.jobs if job.destination}
+        identity_map.load_items(uuids, stacks=False)
+        # Fetched items are removed from the stacks they are part of
+        identity_map.load_supported_items(
+            job.item.uuid
+            for job in response.jobs
+            if job.job_type == "FETCH_INVENTORY" and job.success
         )
+        return identity_map
 
-        for job in response.jobs:
-            response_service = RobotResponseFactory.get_robot_response_service(job)
-            response_service.process(job)
-            updates.extend(response_service.updates)
+    @staticmethod
+    async def process_response(
+        response: RobotBatchResponse,
+        publish_updates: Callable[[list[ItemUpdate]], Awaitable[Any]] | None = None,
+    ) -> list[ItemUpdate]:
+        """Process response.
+
+        Jobs already processed by an earlier delivery of the response are
+        skipped. The others are split into partitions which touch disjoint
+        parts of the inventory. Partitions are processed concurrently, each in
+        order, and each commits its own writes. Compact jobs are rebuilt
+        from the jobs sent to the robot first.
+
+        If a partition fails, the updates of the jobs committed anyway are
+        published with publish_updates before the failure is raised, since
+        a redelivery skips these jobs.
+        """
+        response = rehydrate_jobs(response)
+        processed = job_ledger.get_processed(
+            response.batch_id, (job.job_id for job in response.jobs)
+        )
+        if processed:
+            logger.info(
+                "Skipping {} already processed jobs of batch {}",
+                len(processed),
+                response.batch_id,
+            )
+            if len(processed) == len({job.job_id for job in response.jobs}):
+                return []
+
+        plan = WritePlan()
+        plan.add(
+            robot_batch_collection,
+            # Keeps the planning stored when the batch was sent
+            UpdateOne({"batch_id": response.batch_id}, {"$set": response.model_dump()}),
+        )
+        response = response.model_copy(
+            update={
+                "jobs": [job for job in response.jobs if job.job_id not in processed]
+            }
+        )
+        identity_map = ProcessBatchResponse.prefetch(response)
+
+        partitions = partition_jobs(response.jobs)
+        job_updates: dict[int, list[ItemUpdate]] = {}
+        semaphore = asyncio.Semaphore(max(settings.BATCH_RESPONSE_CONCURRENCY, 1))
+
+        async def run_partition(indexes: list[int]) -> None:
+            async with semaphore:
+                # Each thread gets its own map, lookups and retries write to it
+                await asyncio.to_thread(
+                    ProcessBatchResponse.process_partition,
+                    response,
+                    indexes,
+                    identity_map.copy(),
+                    job_updates,
+                )
+
+        results = await asyncio.gather(
+            *map(run_partition, partitions), return_exceptions=True
+        )
+
+        updates = [
+            update for index in sorted(job_updates) for update in job_updates[index]
+        ]
+        try:
+            plan.commit()
+        finally:
+            barcode_cache.invalidate_updates(updates)
+        job_ledger.remember(
+            response.batch_id, (response.jobs[index].job_id for index in job_updates)
+        )
+
+        for result in results:
+            if isinstance(result, BaseException):
+                if updates and publish_updates is not None:
+                    logger.warning(
+                        "Publishing updates of {} committed jobs of failed batch {}",
+                        len(job_updates),
+                        response.batch_id,
+                    )
+                    await publish_updates(updates)
+                raise result
 
         logger.info(
-            "Processed batch {} with {} jobs", response.batch_id, len(response.jobs)
+            "Processed batch {} with {} jobs in {} partitions",
+            response.batch_id,
+            len(response.jobs),
+            len(partitions),
         )
 
         return updates
+
+    @staticmethod
+    def process_partition(
+        response: RobotBatchResponse,
+        indexes: list[int],
+        identity_map: IdentityMap,
+        job_updates: dict[int, list[ItemUpdate]],
+    ) -> None:
+        """Process the jobs of a partition and commit their writes.
+
+        If another consumer changed an item in the meantime, nothing is
+        written and the jobs are processed again from fresh reads. Without
+        transactions, an item changed while the writes are committed is only
+        raised, and the jobs committed before it are kept.
+        """
+        retries = settings.CONCURRENT_MODIFICATION_RETRIES
+        for attempt in range(retries + 1):
+            plan = WritePlan(identity_map)
+            partition_updates: dict[int, list[ItemUpdate]] = {}
+            error = None
+            try:
+                ProcessBatchResponse.process_jobs(
+                    response, indexes, plan, partition_updates
+                )
+            except Exception as e:  # noqa: BLE001
+                # Jobs processed before a failure are still saved, the
+                # writes staged by the failed job are dropped
+                error = e
+
+            try:
+                plan.commit()
+            except ConcurrentModificationError as conflict:
+                # Each job is committed with its ledger entry without transactions
+                job_updates.update(
+                    (index, partition_updates[index])
+                    for index in indexes[: plan.committed_units]
+                )
+                if attempt == retries or isinstance(conflict, PartialCommitError):
+                    raise
+                logger.warning(
+                    "Items changed while processing batch {}, retrying {} jobs",
+                    response.batch_id,
+                    len(indexes),
+                )
+                identity_map = ProcessBatchResponse.prefetch(
+                    response.model_copy(
+                        update={"jobs": [response.jobs[index] for index in indexes]}
+                    )
+                )
+                continue
+
+            job_updates.update(partition_updates)
+            if error is not None:
+                raise error
+            return
+
+    @staticmethod
+    def process_jobs(
+        response: RobotBatchResponse,
+        indexes: list[int],
+        plan: WritePlan,
+        job_updates: dict[int, list[ItemUpdate]],
+    ) -> None:
+        """Process jobs in order, stopping at the first failure.
+
+        Each job stages its writes in its own plan, merged into the plan of
+        the partition only once the job succeeded. The updates of each
+        processed job are stored by the index of the job, and the job is
+        marked as processed with the writes of the batch.
+        """
+        for index in indexes:
+            # Jobs are processed again on retries, so they are not modified
+            job = response.jobs[index].model_copy(deep=True)
+            job_plan = plan.child()
+            response_service = RobotResponseFactory.get_robot_response_service(
+                job, job_plan
+            )
+            response_service.process(job)
+            job_ledger.stage(job_plan, response.batch_id, job.job_id)
+            plan.merge(job_plan)
+            job_updates[index] = response_service.updates
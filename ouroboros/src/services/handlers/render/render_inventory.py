@@ -2,16 +2,16 @@
 
 """Render inventory handler."""
 
+from __future__ import annotations
+
+import asyncio
 import base64
 import io
 import math
 import time
+from typing import TYPE_CHECKING, Any, ClassVar, NamedTuple
 
-import numpy as np
-from azure.storage.blob import BlobServiceClient
-from faststream.annotations import Logger
 from loguru import logger
-from PIL import Image
 
 from config import settings
 from db.mongodb import (
@@ -20,6 +20,7 @@ from db.mongodb import (
     renders_collection,
     scan_image_collection,
 )
+from src.metrics import timed
 from src.models import (
     Item,
     ItemAbsolute,
@@ -33,92 +34,294 @@ from src.models import (
     RenderScanRequest,
     ScanImage,
 )
+from src.services.factories import LazyBlobStore
 from src.services.handlers import Handler
 from src.services.model.item import ItemService
-from src.utils import validate_many_docs
+from src.services.model.scan_image import ScanImageService
+from src.utils import aggregate_by_side_and_type, validate_many_docs
+
+if TYPE_CHECKING:
+    from faststream.annotations import Logger
+    from PIL import Image
+
+
+class PendingRender(NamedTuple):
+    """A render of a scope which has not read the inventory yet."""
+
+    task: asyncio.Task[None]
+    # Users whose requests joined the render
+    user_ids: list[str]
 
 
 class RenderInventory(Handler):
     """RenderInventory outputs and stores the render of the current inventory."""
 
     scan_images_blob_container = "scan-images"
-    blob_service_client = BlobServiceClient.from_connection_string(
-        settings.AZUR_BLOB_CONN  # pyright: ignore[reportArgumentType]
-    )
-    container_client = blob_service_client.get_container_client(
-        scan_images_blob_container
-    )
+    # Items are queried by position, so widen the x range by up to half an item
+    x_range_margin = 2.0
+    # Only the fields needed to build the traces are read from mongodb
+    item_projection: ClassVar[dict[str, Any]] = {
+        "_id": 0,
+        "uuid": 1,
+        "meta": 1,
+        "relative": 1,
+        "absolute": 1,
+        "barcodes": 1,
+    }
+    partial_item_projection: ClassVar[dict[str, Any]] = {
+        "_id": 0,
+        "meta": 1,
+        "relative": 1,
+        "absolute": 1,
+    }
+    blob_store = LazyBlobStore()
 
     # service
     item_service = ItemService()
 
+    # Renders still waiting out the debounce window, keyed by scope
+    pending: ClassVar[dict[str, PendingRender]] = {}
+    # Renders which already read the inventory, keyed by scope
+    running: ClassVar[dict[str, asyncio.Task[None]]] = {}
+
     async def run(self, body: RenderScanRequest, logger: Logger) -> None:
-        """Function callback when request has been received."""
+        """Function callback when request has been received.
+
+        Requests for a scope join its render while it waits out the debounce
+        window. Once the render read the inventory, the next request schedules
+        one follow-up render of the scope, which later requests join.
+        """
+        scope = self.get_scope(body)
+        pending = self.pending.get(scope)
+        if pending is not None:
+            logger.info("Joining pending render for scope {}", scope)
+            pending.user_ids.append(body.user_id)
+        else:
+            user_ids = [body.user_id]
+            task = asyncio.create_task(
+                self.debounced_render(
+                    scope, body, user_ids, self.running.get(scope), logger
+                )
+            )
+            pending = PendingRender(task, user_ids)
+            self.pending[scope] = pending
+            task.add_done_callback(lambda done: self.forget(scope, done))
+
+        # Shield so a cancelled caller does not cancel a render others joined
+        await asyncio.shield(pending.task)
+
+    @staticmethod
+    def get_scope(body: RenderScanRequest) -> str:
+        """Key identifying requests which produce the same render."""
+        return body.model_dump_json(exclude={"vendor", "user_id"})
+
+    @classmethod
+    def forget(cls, scope: str, task: asyncio.Task[None]) -> None:
+        """Drop the finished render of a scope, unless a later one replaced it."""
+        if scope in cls.pending and cls.pending[scope].task is task:
+            del cls.pending[scope]
+        if cls.running.get(scope) is task:
+            del cls.running[scope]
+
+    async def debounced_render(
+        self,
+        scope: str,
+        body: RenderScanRequest,
+        user_ids: list[str],
+        previous: asyncio.Task[None] | None,
+        logger: Logger,
+    ) -> None:
+        """Wait for the debounce window and the previous render of the scope.
+
+        Then render off the event loop.
+        """
+        if settings.RENDER_DEBOUNCE_SECONDS > 0:
+            await asyncio.sleep(settings.RENDER_DEBOUNCE_SECONDS)
+        if previous is not None:
+            # A failed previous render is reported to its own callers
+            await asyncio.wait([previous])
+
+        # The inventory is read from here on, later requests need a new render
+        self.running[scope] = self.pending.pop(scope).task
+        await asyncio.to_thread(self.render, body, logger, user_ids)
+
+    def render(
+        self,
+        body: RenderScanRequest,
+        logger: Logger,
+        user_ids: list[str] | None = None,
+    ) -> None:
+        """Render and store the inventory for the scope of the request.
+
+        The users whose requests joined the render are stored with it, they
+        default to the user of the request.
+        """
+        if user_ids is None:
+            user_ids = [body.user_id]
         to_render_types = ["empty", "box"]
-        to_render_sides = ["left", "right"]
+        to_render_sides = ["left", "right"] if body.side is None else [body.side]
+        x_range = self.get_x_range(body)
+
+        if body.scan_id is not None:
+            scan_ids = [body.scan_id]
+        else:
+            # filter out for empty string
+            scan_ids = inventory_items.distinct(
+                "meta.scan_id", {"meta.scan_id": {"$ne": ""}}
+            )
 
-        # filter out for empty string
-        scan_ids = inventory_items.distinct(
-            "meta.scan_id", {"meta.scan_id": {"$ne": ""}}
-        )
+        # Inventory items do not depend on the scan, so share them across scans
+        item_traces: dict[int, dict[str, list[RenderItemData]]] = {}
 
         for scan_id in scan_ids:
-            for side in to_render_sides:
-                aisles_indexes = scan_image_collection.distinct(
-                    "aisle_index", {"scan_id": scan_id}
-                )
-                for aisle_index in aisles_indexes:
-                    scan_images_docs = scan_image_collection.find(
-                        {
-                            "side": side,
-                            "scan_id": scan_id,
-                            "aisle_index": aisle_index,
-                        }
+            aisle_query: dict[str, Any] = {"scan_id": scan_id}
+            if body.aisle_index is not None:
+                aisle_query["aisle_index"] = body.aisle_index
+
+            aisles_indexes = scan_image_collection.distinct("aisle_index", aisle_query)
+            for aisle_index in aisles_indexes:
+                # draw rectangles, one query for all sides and types of the aisle
+                if body.debug:
+                    traces_by_side = self.render_trace_debug(
+                        to_render_sides, to_render_types, scan_id, aisle_index, x_range
                     )
-                    scan_images = validate_many_docs(scan_images_docs, ScanImage)
-                    render_image_meta = None
-                    if scan_images:
-                        logger.info(
-                            "Found {} scan images for side {}", len(scan_images), side
+                else:
+                    if aisle_index not in item_traces:
+                        item_traces[aisle_index] = self.render_item_trace(
+                            to_render_sides, to_render_types, aisle_index, x_range
                         )
-                        render_image_meta = self.render_image(scan_images)
-
-                    traces: list[RenderItemData] = []
-
-                    for item_type in to_render_types:
-                        # draw rectangles
-                        if not body.debug:
-                            traces += self.render_item_trace(
-                                side, item_type, aisle_index
-                            )
-                        else:
-                            traces += self.render_trace_debug(
-                                side, item_type, scan_id, aisle_index
-                            )
-
-                    logger.info(
-                        "Added render trace with {} data entries for {} side.",
-                        len(traces),
-                        side,
+                    traces_by_side = item_traces[aisle_index]
+
+                for side in to_render_sides:
+                    meta = RenderMeta(
+                        side=side,
+                        aisle_index=aisle_index,
+                        x_min=body.x_min,
+                        x_max=body.x_max,
                     )
-
-                    render = Render(
-                        request=body,
-                        meta=RenderMeta(side=side, aisle_index=aisle_index),
-                        data=traces,
-                        img_meta=render_image_meta,
+                    scan_images_query: dict[str, Any] = {
+                        "side": side,
+                        "scan_id": scan_id,
+                        "aisle_index": aisle_index,
+                    }
+                    if x_range is not None:
+                        scan_images_query |= self.scan_image_x_range_query(*x_range)
+                    self.render_side(
+                        body,
+                        meta,
+                        scan_images_query,
+                        traces_by_side[side],
+                        user_ids,
+                        logger,
                     )
 
-                    # save to mongodb
-                    renders_collection.delete_many(
-                        {"meta.side": side, "meta.aisle_index": aisle_index}
-                    )
-                    renders_collection.insert_one(render.model_dump())
-                    logger.info("Saved {} side render to mongodb", side)
+    def render_side(
+        self,
+        body: RenderScanRequest,
+        meta: RenderMeta,
+        scan_images_query: dict[str, Any],
+        traces: list[RenderItemData],
+        user_ids: list[str],
+        logger: Logger,
+    ) -> None:
+        """Render the scan images of one side of an aisle and store the render."""
+        side = meta.side
+        scan_images_docs = scan_image_collection.find(scan_images_query)
+        scan_images = validate_many_docs(scan_images_docs, ScanImage)
+        render_image_meta = None
+        if scan_images:
+            logger.info("Found {} scan images for side {}", len(scan_images), side)
+            render_image_meta = self.render_image(scan_images)
+
+        logger.info(
+            "Added render trace with {} data entries for {} side.",
+            len(traces),
+            side,
+        )
+
+        render = Render(
+            request=body,
+            user_ids=user_ids,
+            meta=meta,
+            data=traces,
+            img_meta=render_image_meta,
+        )
+
+        # save to mongodb, replacing the previous render of the side. A scoped
+        # render replaces the scoped renders of any x range, so they do not pile up
+        replaced_query: dict[str, Any] = {
+            "meta.side": side,
+            "meta.aisle_index": meta.aisle_index,
+        }
+        if meta.x_min is None and meta.x_max is None:
+            replaced_query |= {"meta.x_min": None, "meta.x_max": None}
+        else:
+            replaced_query["$or"] = [
+                {"meta.x_min": {"$ne": None}},
+                {"meta.x_max": {"$ne": None}},
+            ]
+        renders_collection.delete_many(replaced_query)
+        renders_collection.insert_one(render.model_dump())
+        logger.info("Saved {} side render to mongodb", side)
+
+    @staticmethod
+    def get_x_range(body: RenderScanRequest) -> tuple[float, float] | None:
+        """Get the requested x range, or None if the whole aisle is rendered."""
+        if body.x_min is None and body.x_max is None:
+            return None
+
+        x_min = -math.inf if body.x_min is None else body.x_min
+        x_max = math.inf if body.x_max is None else body.x_max
+        return x_min, x_max
+
+    @staticmethod
+    def scan_image_x_range_query(x_min: float, x_max: float) -> dict[str, Any]:
+        """Query for scan images overlapping the x range.
+
+        Images can be inverted, so either corner can hold the lower x.
+        """
+        return {
+            "$or": [
+                {
+                    "image_bottom_left.x": {"$lte": x_max},
+                    "image_top_right.x": {"$gte": x_min},
+                },
+                {
+                    "image_top_right.x": {"$lte": x_max},
+                    "image_bottom_left.x": {"$gte": x_min},
+                },
+            ]
+        }
+
+    @classmethod
+    def item_x_range_query(cls, x_min: float, x_max: float) -> dict[str, Any]:
+        """Query for items which may overlap the x range."""
+        return {
+            "absolute.position.x": {
+                "$gte": x_min - cls.x_range_margin,
+                "$lte": x_max + cls.x_range_margin,
+            }
+        }
+
+    @staticmethod
+    def overlaps_x_range(
+        model: Item | PartialItem, x_range: tuple[float, float] | None
+    ) -> bool:
+        """Check if the bounding box of the model overlaps the x range."""
+        if x_range is None:
+            return True
+
+        x_min, x_max = x_range
+        bounding_box = model.bounding_box
+        return bounding_box.top_right.x >= x_min and bounding_box.bottom_left.x <= x_max
 
     @classmethod
+    @timed("image_stitch")
     def render_image(cls, scan_image_models: list[ScanImage]) -> RenderImageMeta:
         """Render image for a given side and scan id."""
+        # Imported here, PIL and numpy are only needed to render
+        from PIL import Image  # noqa: PLC0415
+
         logger.info("Rendering inventory requested for image. Generating image...")
         min_x, max_x, min_y, max_y = math.inf, -math.inf, math.inf, -math.inf
 
@@ -126,15 +329,10 @@ class RenderInventory(Handler):
         coordinates = []
 
         for scan_image_model in scan_image_models:
-            img_str = scan_image_model.image
-            if not img_str:
+            img = cls.open_scan_image(scan_image_model)
+            if img is None:
                 continue
 
-            jpg_bytes = bytes(img_str, "utf-8")
-            jpg_byte_b64 = base64.b64decode(jpg_bytes)
-            jpg_bytes_io = io.BytesIO(jpg_byte_b64)
-            img = Image.open(jpg_bytes_io)
-
             # check if the image is inverted
             is_inverted = (
                 scan_image_model.image_bottom_left.x
@@ -165,16 +363,21 @@ class RenderInventory(Handler):
                 )
             )
 
-        render = cls.stack_images(images, coordinates, (min_x, min_y, max_x, max_y))
+        render = cls.stack_images(
+            images,
+            coordinates,
+            (min_x, min_y, max_x, max_y),
+            settings.RENDER_PIXELS_PER_METER,
+        )
         buf = io.BytesIO()
         render.save(buf, format="JPEG", quality=80)
         logger.info("Render image saved to buffer")
 
-        # save to Azure
+        # save to the blob store
         blob_name = f"inventory_render_{time.time()}.jpg"
-        cls.container_client.upload_blob(name=blob_name, data=buf.getvalue())
+        cls.blob_store.upload(cls.scan_images_blob_container, blob_name, buf.getvalue())
         logger.info(
-            "Uploaded render image to Azure with filename "
+            "Uploaded render image to blob store with filename "
             f"{blob_name} ({buf.getbuffer().nbytes} bytes)"
         )
 
@@ -190,6 +393,42 @@ class RenderInventory(Handler):
             blob_name=blob_name,
         )
 
+    @classmethod
+    def open_scan_image(cls, scan_image_model: ScanImage) -> Image.Image | None:
+        """Open the image of a scan, or None if the scan has no image.
+
+        Prefers the thumbnail precomputed at the render resolution.
+        """
+        thumbnail = ScanImageService.get_thumbnail(
+            scan_image_model, settings.RENDER_PIXELS_PER_METER
+        )
+        if thumbnail is not None:
+            return cls.open_blob(thumbnail.container_name, thumbnail.blob_name)
+
+        if scan_image_model.blob_name and scan_image_model.container_name:
+            return cls.open_blob(
+                scan_image_model.container_name, scan_image_model.blob_name
+            )
+
+        # Legacy scan images stored as base64 in mongodb
+        if scan_image_model.image:
+            from PIL import Image  # noqa: PLC0415
+
+            return Image.open(io.BytesIO(base64.b64decode(scan_image_model.image)))
+
+        return None
+
+    @classmethod
+    def open_blob(cls, container_name: str, blob_name: str) -> Image.Image:
+        """Open an image from the blob store."""
+        from PIL import Image  # noqa: PLC0415
+
+        with cls.blob_store.open(container_name, blob_name) as blob:
+            img = Image.open(blob)
+            # Decode now, the blob is closed when leaving the context
+            img.load()
+            return img
+
     @staticmethod
     def stack_images(
         images: list[Image.Image],
@@ -198,6 +437,9 @@ class RenderInventory(Handler):
         pixels_per_meter: int = 400,
     ) -> Image.Image:
         """Stack images into a single image with given coordinates and bounds."""
+        import numpy as np  # noqa: PLC0415
+        from PIL import Image  # noqa: PLC0415
+
         min_x, min_y, max_x, max_y = bounds
         canvas_width = math.ceil((max_x - min_x) * pixels_per_meter)
         canvas_height = math.ceil((max_y - min_y) * pixels_per_meter)
@@ -219,8 +461,12 @@ class RenderInventory(Handler):
             patch_im = im.resize((width, height), resample=Image.Resampling.BILINEAR)
             mask_im = im.resize((width, height), resample=Image.Resampling.NEAREST)
 
-            patch = np.array(patch_im)[:, :, 0]
-            mask = np.array(mask_im)[:, :, 3].astype(bool)
+            # Images without alpha, such as RGB frames, are pasted whole
+            patch = np.array(patch_im.getchannel(0))
+            if "A" in mask_im.getbands():
+                mask = np.array(mask_im.getchannel("A")).astype(bool)
+            else:
+                mask = np.ones((height, width), dtype=bool)
 
             canvas[_y0:_y1, _x0:_x1] = np.where(mask, patch, canvas[_y0:_y1, _x0:_x1])
 
@@ -228,73 +474,117 @@ class RenderInventory(Handler):
 
     @classmethod
     def render_item_trace(
-        cls, side: str, item_type: str, aisle_index: int
-    ) -> list[RenderItemData]:
-        """Render trace for a given side and item type."""
-        items_doc = inventory_items.find(
-            {
-                "relative.side": side,
-                "meta.item_type": item_type,
-                "meta.location": "inventory",
-                "meta.available": True,
-                "meta.aisle_index": aisle_index,
-            }
+        cls,
+        sides: list[str],
+        item_types: list[str],
+        aisle_index: int,
+        x_range: tuple[float, float] | None = None,
+    ) -> dict[str, list[RenderItemData]]:
+        """Render traces of an aisle for the given sides and item types.
+
+        Traces are returned per side, ordered by item type.
+        """
+        query: dict[str, Any] = {
+            "relative.side": {"$in": sides},
+            "meta.item_type": {"$in": item_types},
+            "meta.location": "inventory",
+            "meta.available": True,
+            "meta.aisle_index": aisle_index,
+        }
+        if x_range is not None:
+            query |= cls.item_x_range_query(*x_range)
+        groups = aggregate_by_side_and_type(
+            inventory_items, query, projection=cls.item_projection
         )
-        items = validate_many_docs(items_doc, Item)
-
-        # To reduce time for adding shapes:
-        # https://stackoverflow.com/questions/70276242/adding-500-circles-in-a-plotly-graph-using-add-shape-function-takes-45-seconds
-        logger.info(f"Creating {len(items)} shape traces for items of type {item_type}")
-        return [
-            RenderItemData(
-                item=item,
-                x0=item.bounding_box.bottom_left.x,
-                y0=item.bounding_box.bottom_left.y,
-                x1=item.bounding_box.top_right.x,
-                y1=item.bounding_box.top_right.y,
-            )
-            for item in items
-        ]
 
-    @staticmethod
+        traces: dict[str, list[RenderItemData]] = {side: [] for side in sides}
+        for side in sides:
+            for item_type in item_types:
+                items = [
+                    item
+                    for item in validate_many_docs(
+                        groups.get((side, item_type), []), Item
+                    )
+                    if cls.overlaps_x_range(item, x_range)
+                ]
+
+                # To reduce time for adding shapes:
+                # https://stackoverflow.com/questions/70276242/adding-500-circles-in-a-plotly-graph-using-add-shape-function-takes-45-seconds
+                logger.info(
+                    f"Creating {len(items)} shape traces for {side} side items "
+                    f"of type {item_type}"
+                )
+                traces[side] += [
+                    RenderItemData(
+                        item=item,
+                        x0=item.bounding_box.bottom_left.x,
+                        y0=item.bounding_box.bottom_left.y,
+                        x1=item.bounding_box.top_right.x,
+                        y1=item.bounding_box.top_right.y,
+                    )
+                    for item in items
+                ]
+
+        return traces
+
+    @classmethod
     def render_trace_debug(
-        side: str, item_type: str, scan_id: str, aisle_index: int
-    ) -> list[RenderItemData]:
-        """Render trace debug for a given side and item type."""
-        partial_items_doc = partial_item_collection.find(
-            {
-                "meta.item_type": item_type,
-                "meta.scan_id": scan_id,
-                "meta.confidence": {"$gte": 0.15},
-                "relative.side": side,
-                "absolute.dimension.x": {"$gte": 0.08},
-                "meta.aisle_index": aisle_index,
-            }
+        cls,
+        sides: list[str],
+        item_types: list[str],
+        scan_id: str,
+        aisle_index: int,
+        x_range: tuple[float, float] | None = None,
+    ) -> dict[str, list[RenderItemData]]:
+        """Render debug traces of an aisle for the given sides and item types."""
+        query: dict[str, Any] = {
+            "meta.item_type": {"$in": item_types},
+            "meta.scan_id": scan_id,
+            "meta.confidence": {"$gte": 0.15},
+            "relative.side": {"$in": sides},
+            "absolute.dimension.x": {"$gte": 0.08},
+            "meta.aisle_index": aisle_index,
+        }
+        if x_range is not None:
+            query |= cls.item_x_range_query(*x_range)
+        groups = aggregate_by_side_and_type(
+            partial_item_collection, query, projection=cls.partial_item_projection
         )
-        partial_items = validate_many_docs(partial_items_doc, PartialItem)
-
-        return [
-            RenderItemData(
-                item=Item(
-                    meta=ItemMeta(
-                        item_type="DEBUG",
-                        stack=[],
-                        location="inventory",
-                        destination=None,
-                        available=False,
-                    ),
-                    relative=ItemRelative.model_validate(
-                        partial_item.relative.model_dump()
-                    ),
-                    absolute=ItemAbsolute.model_validate(
-                        partial_item.absolute.model_dump()
-                    ),
-                    barcodes=[],
-                ),
-                x0=partial_item.bounding_box.bottom_left.x,
-                y0=partial_item.bounding_box.bottom_left.y,
-                x1=partial_item.bounding_box.top_right.x,
-                y1=partial_item.bounding_box.top_right.y,
-            )
-            for partial_item in partial_items
-        ]
+
+        traces: dict[str, list[RenderItemData]] = {side: [] for side in sides}
+        for side in sides:
+            for item_type in item_types:
+                partial_items = [
+                    partial_item
+                    for partial_item in validate_many_docs(
+                        groups.get((side, item_type), []), PartialItem
+                    )
+                    if cls.overlaps_x_range(partial_item, x_range)
+                ]
+                traces[side] += [
+                    RenderItemData(
+                        item=Item(
+                            meta=ItemMeta(
+                                item_type="DEBUG",
+                                stack=[],
+                                location="inventory",
+                                destination=None,
+                                available=False,
+                            ),
+                            relative=ItemRelative.model_validate(
+                                partial_item.relative.model_dump()
+                            ),
+                            absolute=ItemAbsolute.model_validate(
+                                partial_item.absolute.model_dump()
+                            ),
+                            barcodes=[],
+                        ),
+                        x0=partial_item.bounding_box.bottom_left.x,
+                        y0=partial_item.bounding_box.bottom_left.y,
+                        x1=partial_item.bounding_box.top_right.x,
+                        y1=partial_item.bounding_box.top_right.y,
+                    )
+                    for partial_item in partial_items
+                ]
+
+        return traces
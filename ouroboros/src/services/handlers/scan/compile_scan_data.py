@@ -16,7 +16,8 @@ from src.services.handlers import Handler
 from src.services.model.barcode import BarcodeService
 from src.services.model.item import ItemService
 from src.services.model.partial_item import PartialItemService
-from src.utils import validate_many_docs
+from src.services.robot_requests.barcode_cache import barcode_cache
+from src.utils import aggregate_by_side_and_type, validate_many_docs
 
 
 class CompileScanData(Handler):
@@ -75,6 +76,8 @@ class CompileScanData(Handler):
                 barcode_collection.insert_one(barcode_doc)
 
         logger.info("Inserted barcode-item combinations into database")
+        # Barcodes may now belong to other items
+        barcode_cache.clear()
 
     def compile_partial_items(self) -> list[Item]:
         """Compile partial items."""
@@ -90,6 +93,23 @@ class CompileScanData(Handler):
 
         all_new_completed_items: list[Item] = []
         for to_compile_aisle_index in self.to_compile_aisle_indexes:
+            # One query per aisle, all sides and types are grouped from it
+            query = {
+                "meta.item_type": {"$in": self.to_compile_types},
+                "meta.scan_id": self.request.scan_id,
+                "meta.aisle_index": to_compile_aisle_index,
+                "meta.confidence": {"$gte": self.request.confidence_threshold},
+                "relative.side": {"$in": self.to_compile_sides},
+                "absolute.dimension.x": {"$gte": 0.08},
+            }
+            partial_items_docs = aggregate_by_side_and_type(
+                partial_item_collection,
+                query,
+                projection={"_id": 0, "meta": 1, "relative": 1, "absolute": 1},
+                # Needs to be with aligned axis : TODO
+                sort={"absolute.position.x": 1},
+            )
+
             for to_compile_side in self.to_compile_sides:
                 items: dict[str, list[Item]] = {}
                 for to_compile_type in self.to_compile_types:
@@ -97,24 +117,16 @@ class CompileScanData(Handler):
                         f"Compiling type {to_compile_type} "
                         f"for the {to_compile_side} side"
                     )
-                    query = {
-                        "meta.item_type": to_compile_type,
-                        "meta.scan_id": self.request.scan_id,
-                        "meta.aisle_index": to_compile_aisle_index,
-                        "meta.confidence": {"$gte": self.request.confidence_threshold},
-                        "relative.side": to_compile_side,
-                        "absolute.dimension.x": {"$gte": 0.08},
-                    }
-                    partial_items_doc = partial_item_collection.find(
-                        query
-                        # Needs to be with aligned axis : TODO
-                    ).sort([("absolute.position.x", 1)])
+                    partial_items_doc = partial_items_docs.get(
+                        (to_compile_side, to_compile_type)
+                    )
 
                     if not partial_items_doc:
                         logger.warning(
                             f"No partial items found for request "
                             f"{self.request.model_dump_json()} QUERY: "
-                            f"{query}. [SKIPPING]"
+                            f"{query}, side {to_compile_side}, "
+                            f"type {to_compile_type}. [SKIPPING]"
                         )
                         continue
 
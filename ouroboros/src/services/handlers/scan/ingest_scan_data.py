@@ -2,11 +2,16 @@
 
 """ScanData handler."""
 
+import asyncio
 import base64
 import io
+import time
+from functools import partial
+from typing import Any, ClassVar
 
-from azure.storage.blob import BlobServiceClient
+from bson import ObjectId
 from faststream.rabbit.annotations import Logger
+from loguru import logger
 
 from config import settings
 from db.mongodb import (
@@ -14,15 +19,33 @@ from db.mongodb import (
     partial_item_collection,
     scan_image_collection,
 )
-from src.models import ScanData
+from src.models import ScanData, ScanImageThumbnail
+from src.services.blob_stores import BlobUpload, blob_upload_queue
+from src.services.factories import LazyBlobStore
 from src.services.handlers import Handler
+from src.services.model.scan_image import ScanImageService
 
 
 class IngestScanData(Handler):
     """ScanData handler."""
 
-    async def run(self, body: ScanData, logger: Logger) -> None:  # noqa: PLR6301
-        """Ingest ScanData message."""
+    scan_images_blob_container = "scan-images-raw"
+    thumbnails_blob_container = "scan-images-thumbnails"
+    blob_store = LazyBlobStore()
+
+    # Thumbnails being created, referenced so they are not garbage collected
+    background_tasks: ClassVar[set[asyncio.Task[None]]] = set()
+    # Periodic retry of the failed scan image uploads
+    sweep_task: ClassVar[asyncio.Task[None] | None] = None
+
+    async def run(self, body: ScanData, logger: Logger) -> None:
+        """Ingest ScanData message.
+
+        The image is uploaded after the message is acknowledged, so until then
+        it only lives in the memory of this instance and is lost if it stops.
+        The scan image keeps its pending blob name and upload lease meanwhile,
+        so an image lost this way is reported by the upload sweep.
+        """
         result = body
 
         logger.info(
@@ -33,9 +56,34 @@ class IngestScanData(Handler):
             result.scan_id,
         )
 
+        # Store the image once as binary, mongodb only keeps the blob key
+        image_id = ObjectId()
+        image_bytes = result.image
+        blob_name = None
+        pending: dict[str, Any] = {}
+        if image_bytes:
+            blob_name = f"{result.image_filename or image_id}_{result.scan_id}.webp"
+            pending = {
+                "pending_blob_name": blob_name,
+                "retrying_until": time.time() + settings.SCAN_UPLOAD_LEASE_SECONDS,
+            }
         inserted_img = scan_image_collection.insert_one(
-            result.model_dump(exclude={"partial_items", "barcodes"})
+            result.model_dump(exclude={"partial_items", "barcodes", "image"})
+            | {"_id": image_id, "container_name": None, "blob_name": None}
+            | pending
         )
+
+        if blob_name:
+            # Uploaded after the message is acknowledged. The blob key is only
+            # stored once uploaded, so the render never opens a missing blob.
+            # The name is unique to the image, so redelivered data may overwrite
+            await blob_upload_queue.submit(
+                self.blob_upload(image_id, blob_name, image_bytes)
+            )
+            logger.info(
+                "Queued scan image upload to blob store ({} b)", len(image_bytes)
+            )
+
         for item in result.partial_items:
             item.meta.image_id = inserted_img.inserted_id
             item.meta.scan_id = result.scan_id
@@ -52,23 +100,191 @@ class IngestScanData(Handler):
             len(result.barcodes),
         )
 
-        img_str = result.image
-        webp_bytes = bytes(img_str, "utf-8")
-        webp_byte_b64 = base64.b64decode(webp_bytes)
-        webp_bytes_io = io.BytesIO(webp_byte_b64)
-        webp_byte_size = webp_bytes_io.getbuffer().nbytes
-
-        if webp_byte_size > 0 and result.image_filename:
-            container = "scan-images-raw"
-            blob_name = result.image_filename + f"_{result.scan_id}.webp"
-            blob_service_client = BlobServiceClient.from_connection_string(
-                settings.AZUR_BLOB_CONN  # pyright: ignore[reportArgumentType]
+        if settings.SCAN_THUMBNAILS and blob_name:
+            size = ScanImageService.get_pixel_size(
+                result.image_bottom_left.x,
+                result.image_bottom_left.y,
+                result.image_top_right.x,
+                result.image_top_right.y,
+                settings.RENDER_PIXELS_PER_METER,
+            )
+            task = asyncio.create_task(
+                asyncio.to_thread(
+                    self.store_thumbnail, image_id, blob_name, image_bytes, size
+                )
+            )
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
+
+    @classmethod
+    def blob_upload(
+        cls, image_id: ObjectId, blob_name: str, image_bytes: bytes
+    ) -> BlobUpload:
+        """Upload of a scan image, kept in mongodb if it fails."""
+        return BlobUpload(
+            cls.blob_store,
+            cls.scan_images_blob_container,
+            blob_name,
+            image_bytes,
+            overwrite=True,
+            on_uploaded=partial(cls.set_blob_name, image_id, blob_name),
+            on_failed=partial(cls.keep_image, image_id, blob_name, image_bytes),
+        )
+
+    @classmethod
+    def set_blob_name(cls, image_id: ObjectId, blob_name: str) -> None:
+        """Store the blob key of an uploaded scan image."""
+        scan_image_collection.update_one(
+            {"_id": image_id},
+            {
+                "$set": {
+                    "container_name": cls.scan_images_blob_container,
+                    "blob_name": blob_name,
+                },
+                "$unset": {"image": "", "pending_blob_name": "", "retrying_until": ""},
+            },
+        )
+
+    @staticmethod
+    def keep_image(image_id: ObjectId, blob_name: str, image_bytes: bytes) -> None:
+        """Keep a scan image whose upload failed in mongodb, until it is retried.
+
+        The render reads it like a legacy base64 image in the meantime.
+        """
+        scan_image_collection.update_one(
+            {"_id": image_id},
+            {
+                "$set": {
+                    "image": base64.b64encode(image_bytes).decode(),
+                    "pending_blob_name": blob_name,
+                },
+                # Released, so the next sweep retries it
+                "$unset": {"retrying_until": ""},
+            },
+        )
+
+    @staticmethod
+    def unleased_query(now: float) -> dict[str, Any]:
+        """Query the pending scan image uploads no instance holds a lease on."""
+        return {
+            "pending_blob_name": {"$exists": True},
+            "$or": [
+                {"retrying_until": {"$exists": False}},
+                {"retrying_until": {"$lte": now}},
+            ],
+        }
+
+    @classmethod
+    def claim_failed_upload(cls) -> dict[str, Any] | None:
+        """Lease a scan image kept after a failed upload, None if there is none.
+
+        The lease is taken atomically, so a single instance queues the image.
+        """
+        now = time.time()
+        return scan_image_collection.find_one_and_update(
+            cls.unleased_query(now) | {"image": {"$exists": True}},
+            {"$set": {"retrying_until": now + settings.SCAN_UPLOAD_LEASE_SECONDS}},
+            projection={"image": 1, "pending_blob_name": 1},
+        )
+
+    @classmethod
+    async def retry_failed_uploads(cls) -> int:
+        """Queue the upload of the scan images kept after failed uploads.
+
+        Images are claimed one at a time, so queued images are not swept again
+        until their lease expires, and only one image is loaded at a time. At
+        most SCAN_UPLOAD_SWEEP_LIMIT images are queued per sweep. Images lost
+        before their upload are reported. Returns the number of queued uploads.
+        """
+        queued = 0
+        while queued < settings.SCAN_UPLOAD_SWEEP_LIMIT:
+            doc = await asyncio.to_thread(cls.claim_failed_upload)
+            if doc is None:
+                break
+            await blob_upload_queue.submit(
+                cls.blob_upload(
+                    doc["_id"], doc["pending_blob_name"], base64.b64decode(doc["image"])
+                )
+            )
+            queued += 1
+
+        if queued:
+            logger.info("Retrying the upload of {} scan images", queued)
+
+        # Pending without a kept image once the lease expired, the upload was lost
+        lost = await asyncio.to_thread(
+            scan_image_collection.count_documents,
+            cls.unleased_query(time.time()) | {"image": {"$exists": False}},
+        )
+        if lost:
+            logger.warning("{} scan images were lost before their upload", lost)
+        return queued
+
+    @classmethod
+    async def sweep_failed_uploads(cls, interval: float) -> None:
+        """Retry the failed scan image uploads every interval seconds."""
+        while True:
+            try:
+                await cls.retry_failed_uploads()
+            except Exception:  # noqa: BLE001
+                logger.exception("Failed to retry the failed scan image uploads")
+            await asyncio.sleep(interval)
+
+    @classmethod
+    def start_upload_sweep(cls, interval: float) -> None:
+        """Start retrying the failed scan image uploads in the background."""
+        if cls.sweep_task is None or cls.sweep_task.done():
+            cls.sweep_task = asyncio.create_task(cls.sweep_failed_uploads(interval))
+
+    @classmethod
+    async def stop_upload_sweep(cls) -> None:
+        """Stop retrying the failed scan image uploads."""
+        if cls.sweep_task is not None:
+            cls.sweep_task.cancel()
+            await asyncio.gather(cls.sweep_task, return_exceptions=True)
+            cls.sweep_task = None
+
+    @classmethod
+    def store_thumbnail(
+        cls,
+        image_id: ObjectId,
+        blob_name: str,
+        image_bytes: bytes,
+        size: tuple[int, int],
+    ) -> None:
+        """Create the render resolution thumbnail of a scan image and store it."""
+        width, height = size
+        if width <= 0 or height <= 0:
+            return
+
+        # Imported here, only needed when creating thumbnails
+        from PIL import Image  # noqa: PLC0415
+
+        try:
+            thumbnail = ScanImageService.create_thumbnail(
+                Image.open(io.BytesIO(image_bytes)), size
+            )
+            buf = io.BytesIO()
+            thumbnail.save(buf, format="PNG")
+
+            thumbnail_meta = ScanImageThumbnail(
+                pixels_per_meter=settings.RENDER_PIXELS_PER_METER,
+                container_name=cls.thumbnails_blob_container,
+                blob_name=f"{blob_name}_{settings.RENDER_PIXELS_PER_METER}.png",
             )
-            container_client = blob_service_client.get_container_client(
-                container=container
+            cls.blob_store.upload(
+                thumbnail_meta.container_name,
+                thumbnail_meta.blob_name,
+                buf.getvalue(),
+                overwrite=True,
             )
-            container_client.upload_blob(
-                name=blob_name, data=webp_bytes_io, overwrite=False
+            scan_image_collection.update_one(
+                {"_id": image_id},
+                {"$push": {"thumbnails": thumbnail_meta.model_dump()}},
             )
+        except Exception:  # noqa: BLE001
+            # The render falls back to the full resolution image
+            logger.exception("Failed to create thumbnail for scan image {}", image_id)
+            return
 
-            logger.info("Uploaded scan image to Azure ({} b)", webp_byte_size)
+        logger.info("Stored {} thumbnail for scan image {}", size, image_id)
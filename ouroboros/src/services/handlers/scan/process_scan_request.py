@@ -15,7 +15,7 @@ class ProcessScanRequest(Handler):
         """Process ScanRequest message."""
         request = body
 
-        logger.info("Received scan request {}", request)
+        logger.info("Received scan request {}", request.scan_id)
 
         if request.overwrite_scan_id:
             request.scan_id = request.overwrite_scan_id
@@ -25,6 +25,6 @@ class ProcessScanRequest(Handler):
             exclude_none=True,
         )
         robot_request = RobotScanRequest.model_validate(scan_request_data)
-        logger.info("Sending scan request to robot. {}", robot_request)
+        logger.info("Sending scan request {} to robot", robot_request.scan_id)
 
         return robot_request
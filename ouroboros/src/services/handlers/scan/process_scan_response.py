@@ -13,4 +13,6 @@ class ProcessRobotScanResponse(Handler):
 
     async def run(self, body: RobotScanResponse, logger: Logger) -> None:  # noqa: PLR6301
         """Process RobotScanResponse message."""
-        logger.info("Received scan completion callback with body {}", body)
+        logger.info(
+            "Received scan completion callback, success {}", body.header.success
+        )
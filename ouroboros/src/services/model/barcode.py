@@ -8,9 +8,9 @@ import math
 import time
 from collections import defaultdict
 
-import numpy as np
 from loguru import logger
 
+from src.metrics import timed
 from src.models.db import (
     Barcode,
     BarcodeAbsolute,
@@ -26,6 +26,7 @@ class BarcodeService:
 
     # TODO: This needs to be split
     @classmethod
+    @timed("merge_barcodes")
     def merge(cls, barcodes: list[Barcode]) -> list[Barcode]:  # noqa: C901
         """Method to merge partial barcodes into completed ones. Completes in O(nm)."""
         logger.info("Merge barcodes from {} partial barcodes", len(barcodes))
@@ -91,8 +92,8 @@ class BarcodeService:
             _barcodes: list[Barcode] = [barcodes[idx] for idx in lookup_table[node]]
             _barcodes.append(barcodes[node])
 
-            min_bottom_left_x, min_bottom_left_y = np.inf, np.inf
-            max_top_right_x, max_top_right_y = -np.inf, -np.inf
+            min_bottom_left_x, min_bottom_left_y = math.inf, math.inf
+            max_top_right_x, max_top_right_y = -math.inf, -math.inf
             for _barcode in _barcodes:
                 rect = _barcode.bounding_box
                 min_bottom_left_x = min(min_bottom_left_x, rect.bottom_left.x)
@@ -4,11 +4,11 @@
 
 from __future__ import annotations
 
+import math
 from collections import defaultdict
 from typing import TYPE_CHECKING
 
-import numpy as np
-
+from src.metrics import timed
 from src.models import (
     Barcode,
     Item,
@@ -107,8 +107,8 @@ class ItemService:
             side=_ideal_partial_item.relative.side,
         )
 
-        min_bottom_left_x, min_bottom_left_y = np.inf, np.inf
-        max_top_right_x, max_top_right_y = -np.inf, -np.inf
+        min_bottom_left_x, min_bottom_left_y = math.inf, math.inf
+        max_top_right_x, max_top_right_y = -math.inf, -math.inf
         for p_item in partial_items:
             rect = p_item.bounding_box
             min_bottom_left_x = min(min_bottom_left_x, rect.bottom_left.x)
@@ -149,6 +149,7 @@ class ItemService:
         return Item(meta=item_meta, absolute=item_absolute, relative=item_relative)
 
     @classmethod
+    @timed("generate_item_stack")
     def generate_item_stack(cls, items: list[Item]) -> dict[str, list[str]]:
         """Method to generate stack map for all the items."""
         stack_graph: dict[str, set[str]] = defaultdict(set)
@@ -166,6 +167,7 @@ class ItemService:
         return {key: list(val) for key, val in stack_graph.items()}
 
     @classmethod
+    @timed("combine_barcodes")
     def combine_barcodes(cls, items: list[Item], barcodes: list[Barcode]) -> list[Item]:
         """Method to combine barcodes with item.."""
         # Currently bruce forcing (very expensive) TODO use Rtrees
@@ -0,0 +1,94 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Snapshot of the items near an empty, for edge lookups."""
+
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from src.models.db import Item
+
+
+class Neighbourhood:
+    """Items around an empty, sorted by their left and right edges.
+
+    Lookups bisect the sorted edges to the candidates near the empty, then
+    apply the exact conditions. Matches are returned in the original order of
+    the items, so ties resolve to the same item as a linear scan.
+    """
+
+    def __init__(self, items: list[Item]):
+        """Precompute the edges of the items."""
+        self.items = items
+        self.left = [item.bounding_box.bottom_left.x for item in items]
+        self.right = [item.bounding_box.top_right.x for item in items]
+        self.bottom = [item.absolute.position.y for item in items]
+        self.top = [item.bounding_box.top_right.y for item in items]
+
+        self.by_left = sorted(range(len(items)), key=self.left.__getitem__)
+        self.left_keys = [self.left[i] for i in self.by_left]
+        self.by_right = sorted(range(len(items)), key=self.right.__getitem__)
+        self.right_keys = [self.right[i] for i in self.by_right]
+
+    def overlapping(self, empty: Item) -> list[int]:
+        """Indexes of the items overlapping the empty horizontally."""
+        empty_left = empty.bounding_box.bottom_left.x
+        empty_right = empty.bounding_box.top_right.x
+        candidates = self.by_left[: bisect_left(self.left_keys, empty_right)]
+        return sorted(i for i in candidates if self.right[i] > empty_left)
+
+    def below(self, empty: Item, item_type: str, margin: float) -> list[Item]:
+        """Items of the type the empty is standing on."""
+        empty_bottom = empty.absolute.position.y
+        return [
+            self.items[i]
+            for i in self.overlapping(empty)
+            if abs(self.top[i] - empty_bottom) < margin
+            and self.items[i].meta.item_type == item_type
+        ]
+
+    def above(self, empty: Item, item_type: str, margin: float) -> list[Item]:
+        """Items of the type standing on the empty."""
+        empty_top = empty.bounding_box.top_right.y
+        return [
+            self.items[i]
+            for i in self.overlapping(empty)
+            if abs(self.bottom[i] - empty_top) < margin
+            and self.items[i].meta.item_type == item_type
+        ]
+
+    def left_edge(self, empty: Item, margin: float) -> Item | None:
+        """First item touching the left of the empty at the same height."""
+        empty_left = empty.bounding_box.bottom_left.x
+        empty_bottom = empty.absolute.position.y
+        candidates = self.by_right[
+            bisect_left(self.right_keys, empty_left - margin) : bisect_right(
+                self.right_keys, empty_left + margin
+            )
+        ]
+        matches = [
+            i
+            for i in candidates
+            if abs(self.bottom[i] - empty_bottom) < margin
+            and abs(self.right[i] - empty_left) < margin
+        ]
+        return self.items[min(matches)] if matches else None
+
+    def right_edge(self, empty: Item, margin: float) -> Item | None:
+        """First item touching the right of the empty at the same height."""
+        empty_right = empty.bounding_box.top_right.x
+        empty_bottom = empty.absolute.position.y
+        candidates = self.by_left[
+            bisect_left(self.left_keys, empty_right - margin) : bisect_right(
+                self.left_keys, empty_right + margin
+            )
+        ]
+        matches = [
+            i
+            for i in candidates
+            if abs(self.bottom[i] - empty_bottom) < margin
+            and abs(self.left[i] - empty_right) < margin
+        ]
+        return self.items[min(matches)] if matches else None
@@ -10,6 +10,7 @@ from typing import TYPE_CHECKING
 
 from loguru import logger
 
+from src.metrics import timed
 from src.services.model.item import ItemService
 from src.services.model.rectangle import RectangleService
 
@@ -22,6 +23,7 @@ class PartialItemService:
 
     # TODO: This needs to be split
     @classmethod
+    @timed("merge_partial_items")
     def merge(  # noqa: C901, PLR0912, PLR0915
         cls,
         partial_items: list[PartialItem],
@@ -0,0 +1,57 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Concrete implementation of the ScanImage model."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+    from src.models.db import ScanImage, ScanImageThumbnail
+
+
+class ScanImageService:
+    """ScanImage model."""
+
+    @staticmethod
+    def get_pixel_size(
+        bottom_left_x: float,
+        bottom_left_y: float,
+        top_right_x: float,
+        top_right_y: float,
+        pixels_per_meter: int,
+    ) -> tuple[int, int]:
+        """Returns the size in pixels of an image at the resolution."""
+        return (
+            round(abs(top_right_x - bottom_left_x) * pixels_per_meter),
+            round(abs(top_right_y - bottom_left_y) * pixels_per_meter),
+        )
+
+    @staticmethod
+    def create_thumbnail(img: Image.Image, size: tuple[int, int]) -> Image.Image:
+        """Downsample an image to a grayscale and alpha thumbnail.
+
+        Uses the same channels and resampling as the render, so compositing a
+        thumbnail gives the same result as the full resolution image.
+        """
+        from PIL import Image  # noqa: PLC0415
+
+        patch = img.resize(size, resample=Image.Resampling.BILINEAR).getchannel(0)
+        if "A" in img.getbands():
+            mask = img.resize(size, resample=Image.Resampling.NEAREST).getchannel("A")
+        else:
+            mask = Image.new("L", size, 255)
+
+        return Image.merge("LA", (patch, mask))
+
+    @staticmethod
+    def get_thumbnail(
+        scan_image: ScanImage, pixels_per_meter: int
+    ) -> ScanImageThumbnail | None:
+        """Returns the thumbnail of the scan image at the resolution, if any."""
+        for thumbnail in scan_image.thumbnails:
+            if thumbnail.pixels_per_meter == pixels_per_meter:
+                return thumbnail
+        return None
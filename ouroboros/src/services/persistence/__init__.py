@@ -0,0 +1,14 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+from .identity_map import IdentityMap
+from .job_ledger import JobLedger, job_ledger
+from .write_plan import ConcurrentModificationError, PartialCommitError, WritePlan
+
+__all__ = [
+    "ConcurrentModificationError",
+    "IdentityMap",
+    "JobLedger",
+    "PartialCommitError",
+    "WritePlan",
+    "job_ledger",
+]
@@ -0,0 +1,186 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Batch scoped cache of the inventory documents a batch touches."""
+
+from __future__ import annotations
+
+import copy
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+
+from db.mongodb import barcode_collection, inventory_items
+from src.utils import match_query, supports_query
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+PRIMARY_BARCODE_TYPES = ["GS1-128", "Code 128"]
+
+
+class IdentityMap:
+    """Loads the items, barcodes and stacks of a batch with `$in` queries.
+
+    Documents are prefetched with `load` and `load_supported_items`, then
+    served from memory. Lookups which were not prefetched fall back to a
+    single query and are cached as well.
+    """
+
+    def __init__(self):
+        """Initialize an empty map."""
+        # Item documents by uuid, None if not in the inventory
+        self.items: dict[str, dict[str, Any] | None] = {}
+        # Barcode documents by barcode data
+        self.barcodes: dict[str, list[dict[str, Any]]] = {}
+        # Primary barcode documents by item uuid
+        self.primary_barcodes: dict[str, dict[str, Any] | None] = {}
+        # Uuids of the items whose stack contains the item, by item uuid
+        self.supported_items: dict[str, list[str]] = {}
+
+    def copy(self) -> IdentityMap:
+        """Copy the map, so the copy caches its own lookups.
+
+        Documents are copied when served, so they are shared.
+        """
+        other = IdentityMap()
+        other.items = dict(self.items)
+        other.barcodes = dict(self.barcodes)
+        other.primary_barcodes = dict(self.primary_barcodes)
+        other.supported_items = dict(self.supported_items)
+        return other
+
+    def load(self, barcode_data: Iterable[str] = (), uuids: Iterable[str] = ()) -> None:
+        """Prefetch barcodes, their items, the stacks on them and primary barcodes."""
+        pending_data = {
+            data for data in barcode_data if data and data not in self.barcodes
+        }
+        item_uuids = {uuid for uuid in uuids if uuid}
+        if pending_data:
+            for data in pending_data:
+                self.barcodes[data] = []
+            for doc in barcode_collection.find({"meta.data": {"$in": [*pending_data]}}):
+                self.barcodes[doc["meta"]["data"]].append(doc)
+                if doc.get("item_uuid"):
+                    item_uuids.add(doc["item_uuid"])
+
+        stacked_uuids = self.load_items(item_uuids)
+        self.load_primary_barcodes(stacked_uuids)
+        logger.info(
+            "Prefetched {} barcodes, {} items and {} primary barcodes",
+            len(self.barcodes),
+            len(self.items),
+            len(self.primary_barcodes),
+        )
+
+    def add_barcodes(self, barcode_docs: dict[str, dict[str, Any]]) -> None:
+        """Add barcode documents already known, by barcode data."""
+        for data, doc in barcode_docs.items():
+            self.barcodes[data] = [doc]
+
+    def load_items(self, uuids: Iterable[str], *, stacks: bool = True) -> set[str]:
+        """Load items and, with stacks, the items stacked on them level by level.
+
+        Returns the uuids of the stacked items.
+        """
+        stacked_uuids: set[str] = set()
+        pending = {uuid for uuid in uuids if uuid and uuid not in self.items}
+        while pending:
+            for uuid in pending:
+                self.items[uuid] = None
+            for doc in inventory_items.find({"uuid": {"$in": [*pending]}}):
+                # Like find_one, the first document wins
+                if self.items[doc["uuid"]] is None:
+                    self.items[doc["uuid"]] = doc
+
+            if not stacks:
+                break
+
+            pending = {
+                stacked_uuid
+                for uuid in pending
+                if (doc := self.items[uuid]) is not None
+                for stacked_uuid in doc["meta"].get("stack") or []
+                if stacked_uuid not in self.items
+            }
+            stacked_uuids |= pending
+
+        return stacked_uuids
+
+    def load_primary_barcodes(self, item_uuids: Iterable[str]) -> None:
+        """Load the primary barcodes of items."""
+        pending = {uuid for uuid in item_uuids if uuid not in self.primary_barcodes}
+        if not pending:
+            return
+
+        for uuid in pending:
+            self.primary_barcodes[uuid] = None
+        query = {
+            "item_uuid": {"$in": [*pending]},
+            "meta.barcode_type": {"$in": PRIMARY_BARCODE_TYPES},
+        }
+        for doc in barcode_collection.find(query):
+            if self.primary_barcodes[doc["item_uuid"]] is None:
+                self.primary_barcodes[doc["item_uuid"]] = doc
+
+    def load_supported_items(self, uuids: Iterable[str]) -> None:
+        """Load the items whose stack contains any of the items."""
+        pending = {uuid for uuid in uuids if uuid not in self.supported_items}
+        if not pending:
+            return
+
+        for uuid in pending:
+            self.supported_items[uuid] = []
+        for doc in inventory_items.find({"meta.stack": {"$in": [*pending]}}):
+            self.items.setdefault(doc["uuid"], doc)
+            for stacked_uuid in doc["meta"]["stack"]:
+                if stacked_uuid in pending:
+                    self.supported_items[stacked_uuid].append(doc["uuid"])
+
+    def get_barcodes(self, barcode_data: str) -> list[dict[str, Any]]:
+        """Get the barcode documents with the data."""
+        if barcode_data not in self.barcodes:
+            self.barcodes[barcode_data] = list(
+                barcode_collection.find({"meta.data": barcode_data})
+            )
+        return copy.deepcopy(self.barcodes[barcode_data])
+
+    def get_item(self, uuid: str) -> dict[str, Any] | None:
+        """Get the item document with the uuid."""
+        if uuid not in self.items:
+            self.items[uuid] = inventory_items.find_one({"uuid": uuid})
+        return copy.deepcopy(self.items[uuid])
+
+    def get_primary_barcode(self, item_uuid: str) -> dict[str, Any] | None:
+        """Get the primary barcode document of an item."""
+        if item_uuid not in self.primary_barcodes:
+            self.primary_barcodes[item_uuid] = barcode_collection.find_one(
+                {
+                    "item_uuid": item_uuid,
+                    "meta.barcode_type": {"$in": PRIMARY_BARCODE_TYPES},
+                }
+            )
+        return copy.deepcopy(self.primary_barcodes[item_uuid])
+
+    def find_items(self, query: dict[str, Any]) -> list[dict[str, Any]] | None:
+        """Serve an inventory query from the map, or None if it cannot be."""
+        if not supports_query(query):
+            return None
+
+        uuid = query.get("uuid")
+        if isinstance(uuid, str):
+            doc = self.get_item(uuid)
+            return [doc] if doc is not None and match_query(doc, query) else []
+
+        stacked_uuid = query.get("meta.stack")
+        if (
+            query.keys() == {"meta.stack"}
+            and isinstance(stacked_uuid, str)
+            and stacked_uuid in self.supported_items
+        ):
+            return [
+                doc
+                for uuid in self.supported_items[stacked_uuid]
+                if (doc := self.get_item(uuid)) is not None
+            ]
+
+        return None
@@ -0,0 +1,85 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Ledger of the robot jobs whose responses were already processed."""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from datetime import UTC, datetime
+from typing import TYPE_CHECKING
+
+from pymongo import UpdateOne
+
+from config import settings
+from db.mongodb import processed_job_collection
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from src.services.persistence.write_plan import WritePlan
+
+
+class JobLedger:
+    """Remembers which jobs of which batch were processed.
+
+    Entries are written through the write plan of the batch, so a job is
+    only marked as processed together with its inventory writes. Recently
+    processed jobs are also kept in memory, so a redelivered response is
+    recognised without a query.
+    """
+
+    def __init__(self, max_size: int):
+        """Initialize an empty ledger keeping up to max_size recent jobs."""
+        self.max_size = max_size
+        self.recent: OrderedDict[tuple[str, str], None] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_processed(self, batch_id: str, job_ids: Iterable[str]) -> set[str]:
+        """Get the ids of the jobs of a batch which were already processed."""
+        job_ids = set(job_ids)
+        with self.lock:
+            processed = {
+                job_id for job_id in job_ids if (batch_id, job_id) in self.recent
+            }
+
+        pending = job_ids - processed
+        if pending:
+            docs = processed_job_collection.find(
+                {"batch_id": batch_id, "job_id": {"$in": [*pending]}},
+                {"job_id": 1},
+            )
+            found = {doc["job_id"] for doc in docs}
+            self.remember(batch_id, found)
+            processed |= found
+
+        return processed
+
+    @staticmethod
+    def stage(plan: WritePlan, batch_id: str, job_id: str) -> None:
+        """Stage marking a job as processed with the writes of the batch."""
+        plan.add(
+            processed_job_collection,
+            UpdateOne(
+                {"batch_id": batch_id, "job_id": job_id},
+                {"$setOnInsert": {"processed_at": datetime.now(UTC)}},
+                upsert=True,
+            ),
+        )
+
+    def remember(self, batch_id: str, job_ids: Iterable[str]) -> None:
+        """Keep processed jobs in memory, once they are committed."""
+        with self.lock:
+            for job_id in job_ids:
+                self.recent[batch_id, job_id] = None
+                self.recent.move_to_end((batch_id, job_id))
+            while len(self.recent) > self.max_size:
+                self.recent.popitem(last=False)
+
+    def clear(self) -> None:
+        """Forget the recently processed jobs."""
+        with self.lock:
+            self.recent.clear()
+
+
+job_ledger = JobLedger(settings.PROCESSED_JOBS_CACHE_SIZE)
@@ -0,0 +1,336 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Write operations staged in memory and committed in bulk."""
+
+from __future__ import annotations
+
+import copy
+from functools import partial
+from typing import TYPE_CHECKING, Any, TypeAlias
+
+from loguru import logger
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+
+from config import settings
+from db.mongodb import inventory_items, mongo_client
+from src.metrics import timed
+from src.services.persistence.identity_map import IdentityMap
+from src.utils import apply_update, match_query, supports_query, supports_update
+
+if TYPE_CHECKING:
+    from pymongo.client_session import ClientSession
+    from pymongo.collection import Collection
+
+WriteOperation: TypeAlias = (
+    InsertOne | UpdateOne | UpdateMany | ReplaceOne | DeleteOne | DeleteMany
+)
+
+
+class ConcurrentModificationError(Exception):
+    """Raised when an item changed since it was read by the plan."""
+
+
+class PartialCommitError(ConcurrentModificationError):
+    """Raised when an item changed while a commit without transaction wrote it.
+
+    The merged plans before the conflicting one are committed, the
+    conflicting one is partially written.
+    """
+
+
+def version_filter(uuid: str, version: int) -> dict[str, Any]:
+    """Match an item by uuid if it still has the version it was read with."""
+    if version == 0:
+        # Items written before versioning have no version
+        return {"uuid": uuid, "version": {"$in": [0, None]}}
+    return {"uuid": uuid, "version": version}
+
+
+def versioned_update(update: dict[str, Any]) -> dict[str, Any]:
+    """Increment the version of the item with the update."""
+    versioned = {
+        update_operator: {
+            path: value for path, value in fields.items() if path != "version"
+        }
+        for update_operator, fields in update.items()
+    }
+    versioned.setdefault("$inc", {})["version"] = 1
+    return versioned
+
+
+class WritePlan:
+    """Stages writes across the jobs of a batch and commits them together.
+
+    Inventory items are read through an overlay keyed by uuid, so a job sees
+    the writes staged by the jobs before it, as if they were already
+    committed. Other collections are written blindly with `add`. Items are
+    read from the identity map of the batch when it can serve the query.
+
+    Item writes are compare-and-swap on the version the item was read with,
+    and increment it. If another consumer changed an item in the meantime,
+    the commit raises ConcurrentModificationError and nothing is written.
+    Without transactions, the versions are checked before writing, and each
+    merged plan is written on its own, so the writes of a job are committed
+    together with its ledger entry. An item changed between the check and the
+    write raises PartialCommitError instead.
+    """
+
+    def __init__(self, identity_map: IdentityMap | None = None):
+        """Initialize an empty plan."""
+        self.identity_map = identity_map or IdentityMap()
+        self.collections: dict[str, Collection] = {}
+        self.operations: dict[str, list[WriteOperation]] = {}
+        # Staged state of inventory items, None when deleted
+        self.items: dict[str, dict[str, Any] | None] = {}
+        # Results the staged item writes must have, else an item was changed
+        self.expected = {"matched": 0, "upserted": 0, "deleted": 0}
+        # Versions of the written items when they were read from the database
+        self.read_versions: dict[str, int] = {}
+        # Merged plans, committed one by one without transactions
+        self.units: list[WritePlan] = []
+        # Merged plans committed before a conflict
+        self.committed_units = 0
+
+    def add(self, collection: Collection, operation: WriteOperation) -> None:
+        """Stage a write operation on a collection."""
+        self.collections.setdefault(collection.name, collection)
+        self.operations.setdefault(collection.name, []).append(operation)
+
+    def child(self) -> WritePlan:
+        """Create an empty plan which reads through the staged writes of this one."""
+        child = WritePlan(self.identity_map)
+        child.items = dict(self.items)
+        return child
+
+    def merge(self, other: WritePlan) -> None:
+        """Append the staged writes of another plan, after the merged ones.
+
+        Writes staged directly on this plan are committed after the merged
+        plans.
+        """
+        self.units.extend(other.units)
+        if other.operations:
+            self.units.append(other)
+        self.items.update(other.items)
+        for uuid, version in other.read_versions.items():
+            self.read_versions.setdefault(uuid, version)
+
+    def read(self, doc: dict[str, Any]) -> None:
+        """Remember the version of an item about to be written, if it is not staged."""
+        if doc["uuid"] not in self.items:
+            self.read_versions[doc["uuid"]] = doc.get("version") or 0
+
+    def find_items(self, query: dict[str, Any]) -> list[dict[str, Any]]:
+        """Find inventory items, including the staged writes.
+
+        Queries the staged writes cannot be matched against are read from the
+        database, and rejected once items are staged.
+        """
+        if not supports_query(query):
+            if self.items:
+                raise ValueError(f"Query {query} is not supported on staged items")
+            return list(inventory_items.find(query))
+
+        docs = []
+        seen = set()
+        db_docs = self.identity_map.find_items(query)
+        if db_docs is None:
+            db_docs = inventory_items.find(query)
+
+        for db_doc in db_docs:
+            uuid = db_doc.get("uuid")
+            if uuid not in self.items:
+                docs.append(db_doc)
+                continue
+
+            seen.add(uuid)
+            doc = self.items[uuid]
+            if doc is not None and match_query(doc, query):
+                docs.append(copy.deepcopy(doc))
+
+        # Staged items which only match the query after the staged writes
+        docs.extend(
+            copy.deepcopy(doc)
+            for uuid, doc in self.items.items()
+            if uuid not in seen and doc is not None and match_query(doc, query)
+        )
+        return docs
+
+    def find_item(self, query: dict[str, Any]) -> dict[str, Any] | None:
+        """Find the first inventory item, including the staged writes."""
+        docs = self.find_items(query)
+        return docs[0] if docs else None
+
+    def insert_item(self, doc: dict[str, Any]) -> None:
+        """Stage the insertion of an inventory item."""
+        doc = {**copy.deepcopy(doc), "version": 0}
+        self.items[doc["uuid"]] = copy.deepcopy(doc)
+        self.add(inventory_items, InsertOne(doc))
+
+    def update_item(
+        self, query: dict[str, Any], update: dict[str, Any], *, upsert: bool = False
+    ) -> bool:
+        """Stage the update of the first matching inventory item.
+
+        Returns True if the item is inserted by the upsert.
+        """
+        if not supports_update(update):
+            raise ValueError(f"Update {update} is not supported on staged items")
+
+        doc = self.find_item(query)
+        update = versioned_update(update)
+        if doc is None:
+            if not upsert:
+                return False
+
+            # Like mongodb, the upserted item starts from the query equalities
+            doc = {}
+            apply_update(
+                doc,
+                {
+                    "$set": {
+                        key: value
+                        for key, value in query.items()
+                        if not key.startswith("$") and not isinstance(value, dict)
+                    }
+                },
+            )
+            apply_update(doc, update)
+            self.items[doc["uuid"]] = doc
+            self.add(inventory_items, UpdateOne(query, update, upsert=True))
+            self.expected["upserted"] += 1
+            return True
+
+        self.read(doc)
+        version_query = version_filter(doc["uuid"], doc.get("version", 0))
+        apply_update(doc, update)
+        self.items[doc["uuid"]] = doc
+        self.add(inventory_items, UpdateOne(version_query, update))
+        self.expected["matched"] += 1
+        return False
+
+    def delete_item(self, query: dict[str, Any]) -> int:
+        """Stage the deletion of the first matching inventory item.
+
+        Returns the number of deleted items.
+        """
+        doc = self.find_item(query)
+        if doc is None:
+            return 0
+
+        self.read(doc)
+        self.items[doc["uuid"]] = None
+        self.add(
+            inventory_items,
+            DeleteOne(version_filter(doc["uuid"], doc.get("version", 0))),
+        )
+        self.expected["deleted"] += 1
+        return 1
+
+    def delete_items(self, query: dict[str, Any]) -> int:
+        """Stage the deletion of all matching inventory items in one operation.
+
+        Returns the number of deleted items.
+        """
+        docs = self.find_items(query)
+        if not docs:
+            return 0
+
+        for doc in docs:
+            self.read(doc)
+            self.items[doc["uuid"]] = None
+        self.add(
+            inventory_items,
+            DeleteMany(
+                {
+                    "$or": [
+                        version_filter(doc["uuid"], doc.get("version", 0))
+                        for doc in docs
+                    ]
+                }
+            ),
+        )
+        self.expected["deleted"] += len(docs)
+        return len(docs)
+
+    @timed("db_write")
+    def commit(self, session: ClientSession | None = None) -> None:
+        """Commit the staged operations.
+
+        In a transaction, one ordered bulk write is done per collection.
+        Without, the versions of the items are checked first and the merged
+        plans are written one after the other.
+        """
+        units = [*self.units, self] if self.operations else self.units
+        if session is None and settings.MONGO_TRANSACTIONS:
+            with mongo_client.start_session() as transaction_session:
+                transaction_session.with_transaction(partial(self.write, units))
+        elif session is not None:
+            self.write(units, session)
+        else:
+            self.check_versions()
+            for unit in units:
+                try:
+                    self.write([unit], None)
+                except ConcurrentModificationError as e:
+                    raise PartialCommitError(*e.args) from e
+                self.committed_units += 1
+
+        self.operations = {}
+        self.expected = {"matched": 0, "upserted": 0, "deleted": 0}
+        self.read_versions = {}
+        self.units = []
+        self.committed_units = 0
+
+    def check_versions(self) -> None:
+        """Raise ConcurrentModificationError if a read item changed since."""
+        if not self.read_versions:
+            return
+
+        docs = inventory_items.find(
+            {"uuid": {"$in": [*self.read_versions]}}, {"uuid": 1, "version": 1}
+        )
+        versions = {doc["uuid"]: doc.get("version") or 0 for doc in docs}
+        changed = [
+            uuid
+            for uuid, version in self.read_versions.items()
+            if versions.get(uuid) != version
+        ]
+        if changed:
+            raise ConcurrentModificationError(
+                f"Inventory items changed while processing the batch: {changed}"
+            )
+
+    @staticmethod
+    def write(units: list[WritePlan], session: ClientSession | None) -> None:
+        """Write the staged operations of plans, inventory items first."""
+        collections: dict[str, Collection] = {}
+        operations: dict[str, list[WriteOperation]] = {inventory_items.name: []}
+        expected = {"matched": 0, "upserted": 0, "deleted": 0}
+        for unit in units:
+            collections.update(unit.collections)
+            for name, unit_operations in unit.operations.items():
+                operations.setdefault(name, []).extend(unit_operations)
+            for key, count in unit.expected.items():
+                expected[key] += count
+
+        for name, name_operations in operations.items():
+            if not name_operations:
+                continue
+            result = collections[name].bulk_write(
+                name_operations, ordered=True, session=session
+            )
+            logger.info("Committed {} operations to {}", len(name_operations), name)
+            if name != inventory_items.name:
+                continue
+
+            written = {
+                "matched": result.matched_count,
+                "upserted": result.upserted_count,
+                "deleted": result.deleted_count,
+            }
+            if written != expected:
+                raise ConcurrentModificationError(
+                    f"Inventory items changed while processing the batch, "
+                    f"expected {expected} but wrote {written}"
+                )
@@ -2,12 +2,16 @@
 
 from .fetch_designated import FetchDesignatedRobotJobBuilder
 from .fetch_inventory import FetchInventoryRobotJobBuilder
+from .fetch_planner import FetchPlanner
+from .job_sequencer import JobSequencer
 from .store_designated import StoreDesignatedRobotJobBuilder
 from .store_inventory import StoreInventoryRobotJobBuilder
 
 __all__ = [
     "FetchDesignatedRobotJobBuilder",
     "FetchInventoryRobotJobBuilder",
+    "FetchPlanner",
+    "JobSequencer",
     "StoreDesignatedRobotJobBuilder",
     "StoreInventoryRobotJobBuilder",
 ]
@@ -0,0 +1,171 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Bounded LRU cache of barcode data to item uuid and barcode."""
+
+from __future__ import annotations
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any
+
+from config import settings
+from db.change_stream import ChangeStreamWatcher
+from db.mongodb import barcode_collection
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from src.models import ItemUpdate
+
+
+class BarcodeCache:
+    """Caches which item a barcode belongs to.
+
+    The mapping rarely changes, so it is kept across batches. Entries are
+    invalidated by the item updates of our own responses and, when enabled,
+    by a change stream on the barcode collection for other instances.
+    """
+
+    def __init__(self, max_size: int):
+        """Initialize an empty cache holding up to max_size barcodes."""
+        self.max_size = max_size
+        self.entries: OrderedDict[str, tuple[str, dict[str, Any]]] = OrderedDict()
+        # Cached barcode data by item uuid and by document id, to invalidate
+        self.item_barcodes: dict[str, set[str]] = {}
+        self.doc_barcodes: dict[Any, str] = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lookup_seconds = 0.0
+
+        self.watcher = ChangeStreamWatcher(
+            barcode_collection, self.on_change, self.clear
+        )
+
+    def get_many(
+        self, barcode_data: Iterable[str]
+    ) -> dict[str, tuple[str, dict[str, Any]]]:
+        """Get the cached item uuid and barcode document for each barcode."""
+        start = time.perf_counter()
+        found = {}
+        with self.lock:
+            for data in barcode_data:
+                entry = self.entries.get(data)
+                if entry is None:
+                    self.misses += 1
+                    continue
+                self.entries.move_to_end(data)
+                self.hits += 1
+                found[data] = (entry[0], copy.deepcopy(entry[1]))
+            self.lookup_seconds += time.perf_counter() - start
+        return found
+
+    def put(
+        self, barcode_data: str, item_uuid: str, barcode_doc: dict[str, Any]
+    ) -> None:
+        """Cache the item and barcode document of a barcode."""
+        with self.lock:
+            self.remove(barcode_data)
+            self.entries[barcode_data] = (item_uuid, copy.deepcopy(barcode_doc))
+            self.item_barcodes.setdefault(item_uuid, set()).add(barcode_data)
+            if "_id" in barcode_doc:
+                self.doc_barcodes[barcode_doc["_id"]] = barcode_data
+            while len(self.entries) > self.max_size:
+                oldest = next(iter(self.entries))
+                self.remove(oldest)
+                self.evictions += 1
+
+    def remove(self, barcode_data: str) -> bool:
+        """Remove a barcode, the lock must be held."""
+        entry = self.entries.pop(barcode_data, None)
+        if entry is None:
+            return False
+
+        item_uuid, barcode_doc = entry
+        self.doc_barcodes.pop(barcode_doc.get("_id"), None)
+        item_barcodes = self.item_barcodes.get(item_uuid)
+        if item_barcodes is not None:
+            item_barcodes.discard(barcode_data)
+            if not item_barcodes:
+                del self.item_barcodes[item_uuid]
+        return True
+
+    def invalidate(
+        self,
+        item_uuids: Iterable[str] = (),
+        barcode_data: Iterable[str] = (),
+        doc_ids: Iterable[Any] = (),
+    ) -> None:
+        """Invalidate the barcodes of items, given barcodes and documents."""
+        with self.lock:
+            to_remove = set(barcode_data)
+            for item_uuid in item_uuids:
+                to_remove |= self.item_barcodes.get(item_uuid, set())
+            for doc_id in doc_ids:
+                if doc_id in self.doc_barcodes:
+                    to_remove.add(self.doc_barcodes[doc_id])
+            for data in to_remove:
+                self.invalidations += self.remove(data)
+
+    def invalidate_updates(self, updates: Iterable[ItemUpdate]) -> None:
+        """Invalidate the barcodes of updated items."""
+        item_uuids = set()
+        barcode_data = set()
+        for update in updates:
+            item_uuids.add(update.item.uuid)
+            barcode_data |= {barcode.meta.data for barcode in update.item.barcodes}
+        self.invalidate(item_uuids, barcode_data)
+
+    def clear(self) -> None:
+        """Invalidate all barcodes."""
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.item_barcodes.clear()
+            self.doc_barcodes.clear()
+
+    def stats(self) -> dict[str, float]:
+        """Cache statistics."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "lookup_seconds": self.lookup_seconds,
+            }
+
+    def start_watching(self) -> None:
+        """Invalidate on barcode changes made by other instances."""
+        self.watcher.start()
+
+    def stop(self) -> None:
+        """Stop watching barcode changes."""
+        self.watcher.stop()
+
+    def on_change(self, change: dict[str, Any]) -> None:
+        """Invalidate the cache for a barcode change event."""
+        doc = change.get("fullDocument")
+        doc_id = change.get("documentKey", {}).get("_id")
+        if change["operationType"] in {"insert", "update", "replace"} and doc:
+            self.invalidate(
+                [doc["item_uuid"]] if doc.get("item_uuid") else [],
+                [doc["meta"]["data"]],
+                [doc_id],
+            )
+        elif change["operationType"] == "delete":
+            self.invalidate(doc_ids=[doc_id])
+        else:
+            # Drops and invalidations of the whole collection
+            self.clear()
+
+
+barcode_cache = BarcodeCache(settings.BARCODE_CACHE_SIZE)
@@ -7,37 +7,44 @@ from __future__ import annotations
 from abc import ABC, abstractmethod
 from typing import TYPE_CHECKING
 
-from db.mongodb import barcode_collection, inventory_items
 from src.models import Barcode, Item, ItemMeta
+from src.services.robot_requests.barcode_cache import barcode_cache
 from src.utils import validate_many_docs
 
 if TYPE_CHECKING:
     from src.models import JobRequest, JobType, RobotJob
+    from src.services.persistence import IdentityMap
 
 
 class RobotJobBuilderABC(ABC):
     """Abstract class for robot requests."""
 
     def __init__(
-        self, request: JobRequest, job_type: JobType, fetched_items: dict[str, str]
+        self,
+        request: JobRequest,
+        job_type: JobType,
+        fetched_items: dict[str, str],
+        identity_map: IdentityMap,
     ):
-        """Initialize the RobotRequest class."""
+        """Initialize the RobotRequest class.
+
+        Items and barcodes are read from the identity map of the batch.
+        """
         self.request = request
         self.job_type = job_type
         self.fetched_items = fetched_items
+        self.identity_map = identity_map
 
     @abstractmethod
     def build_jobs(self) -> list[RobotJob]:
         """Abstract method to be implemented by concrete builders."""
 
-    @staticmethod
-    def get_item_from_barcode(barcode_uid: str | None) -> Item:
+    def get_item_from_barcode(self, barcode_uid: str | None) -> Item:
         """Get the item from barcode."""
         if barcode_uid is None:
             raise ValueError("Barcode uid not specified")
 
-        query = {"meta.data": barcode_uid}
-        barcode_docs = barcode_collection.find(query)
+        barcode_docs = self.identity_map.get_barcodes(barcode_uid)
         barcodes = validate_many_docs(barcode_docs, Barcode)
         if not barcodes:
             raise ValueError(
@@ -51,7 +58,7 @@ class RobotJobBuilderABC(ABC):
         barcode = barcodes[0]
 
         item_uuid = barcode.item_uuid
-        item_doc = inventory_items.find_one({"uuid": item_uuid})
+        item_doc = self.identity_map.get_item(item_uuid) if item_uuid else None
         if item_doc is None:
             raise ValueError(
                 f"Failed to find item with uid {barcode_uid} from inventory collection."
@@ -59,13 +66,13 @@ class RobotJobBuilderABC(ABC):
             )
         item = Item.model_validate(item_doc)
         item.primary_barcode = barcode
+        barcode_cache.put(barcode_uid, item.uuid, barcode_docs[0])
 
         return item
 
-    @staticmethod
-    def get_item(uuid: str) -> Item:
+    def get_item(self, uuid: str) -> Item:
         """Get the item from uuid."""
-        item_doc = inventory_items.find_one({"uuid": uuid})
+        item_doc = self.identity_map.get_item(uuid)
         if item_doc is None:
             raise ValueError(
                 f"Failed to find item with uuid {uuid} "
@@ -74,18 +81,9 @@ class RobotJobBuilderABC(ABC):
             )
         return Item.model_validate(item_doc)
 
-    @staticmethod
-    def get_primary_barcode(item_uuid: str) -> Barcode:
+    def get_primary_barcode(self, item_uuid: str) -> Barcode:
         """Find primary barcode for item with specified uuid."""
-        primary_barcode_doc = barcode_collection.find_one(
-            {
-                "item_uuid": item_uuid,
-                "$or": [
-                    {"meta.barcode_type": "GS1-128"},
-                    {"meta.barcode_type": "Code 128"},
-                ],
-            }
-        )
+        primary_barcode_doc = self.identity_map.get_primary_barcode(item_uuid)
 
         if primary_barcode_doc is None:
             raise ValueError(
@@ -0,0 +1,284 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Module to plan the fetch inventory jobs of a batch together."""
+
+from __future__ import annotations
+
+import uuid
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+
+from src.models import RobotJob
+
+if TYPE_CHECKING:
+    from src.models import Item
+
+    from .fetch_inventory import FetchInventoryRobotJobBuilder
+
+
+class FetchPlanner:
+    """Plans fetch inventory requests over the stack graph.
+
+    Items stacked on a target are fetched first, recursively and highest
+    first. Items in the way of several targets are only unstacked once, and
+    are stored back after all targets are fetched, lowest first, each at the
+    new position of what it is stored on. Requested items found in the way
+    of another target are fetched as targets and not stored back.
+    """
+
+    def __init__(self, builders: list[FetchInventoryRobotJobBuilder]):
+        """Initialize the planner with a builder per fetch request."""
+        self.builders: list[FetchInventoryRobotJobBuilder] = []
+        # Target items with their builder, by uuid
+        self.targets: dict[str, tuple[FetchInventoryRobotJobBuilder, Item]] = {}
+        self.items: dict[str, Item | None] = {}
+        # Uuids of the targets and of the items in their way
+        self.reached: set[str] = set()
+        # Fetch jobs by uuid of the fetched item
+        self.fetched: dict[str, RobotJob] = {}
+        # Unstacked items in fetch order and the uuid of the item they were on
+        self.blockers: list[Item] = []
+        self.supports: dict[str, str] = {}
+        self.jobs: list[RobotJob] = []
+        self.stats: dict[str, Any] = {}
+
+        for builder in builders:
+            self.add(builder, builder.get_item_from_barcode(builder.request.uid))
+
+    def reach(
+        self, builder: FetchInventoryRobotJobBuilder, target_item: Item
+    ) -> set[str]:
+        """Get the uuids of the items fetched once a request is added.
+
+        All of them are fetched before the first store back, so their number
+        is the most items the robot carries. Only the new items are looked up.
+        """
+        return self.get_items_above(
+            builder, target_item, self.reached | {target_item.uuid}
+        )
+
+    def add(
+        self,
+        builder: FetchInventoryRobotJobBuilder,
+        target_item: Item,
+        reached: set[str] | None = None,
+    ) -> None:
+        """Add a fetch request, with the items reached once it is added."""
+        self.builders.append(builder)
+        self.targets.setdefault(target_item.uuid, (builder, target_item))
+        self.reached = self.reach(builder, target_item) if reached is None else reached
+
+    def build_jobs(self) -> list[RobotJob]:
+        """Build the fetch jobs of all requests, then the store back jobs."""
+        naive_moves = sum(
+            1 + 2 * len(self.get_items_above(builder, target_item, set()))
+            for builder, target_item in self.targets.values()
+        )
+
+        for target_uuid in self.targets:
+            self.fetch_target(target_uuid)
+        self.store_back()
+
+        self.stats = {
+            "requests": len(self.builders),
+            "naive_moves": naive_moves,
+            "planned_moves": len(self.jobs),
+            "saved_moves": naive_moves - len(self.jobs),
+            "max_load": self.get_max_load(),
+        }
+        logger.debug(
+            "Planned {} fetch requests in {} moves instead of {}",
+            len(self.builders),
+            len(self.jobs),
+            naive_moves,
+        )
+        return self.jobs
+
+    def get_max_load(self) -> int:
+        """Get the most items the robot carries at once during the jobs."""
+        load = max_load = 0
+        for job in self.jobs:
+            load += 1 if job.job_type == "FETCH_INVENTORY" else -1
+            max_load = max(max_load, load)
+        return max_load
+
+    def fetch_target(
+        self, target_uuid: str, path: frozenset[str] = frozenset()
+    ) -> None:
+        """Fetch a target after the items stacked on it."""
+        if target_uuid in self.fetched:
+            return
+
+        builder, target_item = self.targets[target_uuid]
+        self.unstack(builder, target_item, path | {target_uuid})
+        job = RobotJob(
+            job_type="FETCH_INVENTORY",
+            item=target_item,
+            future_uuid=builder.request.destination_uuid,
+        )
+        self.fetched[target_uuid] = job
+        self.jobs.append(job)
+
+    def unstack(
+        self,
+        builder: FetchInventoryRobotJobBuilder,
+        item: Item,
+        path: frozenset[str],
+    ) -> None:
+        """Fetch the items stacked on an item, highest first."""
+        for stacked_uuid in item.meta.stack:
+            if stacked_uuid in self.fetched:
+                continue
+            if stacked_uuid in path:
+                raise ValueError(
+                    f"Found a stack cycle at item with uuid {stacked_uuid}"
+                )
+            if stacked_uuid in self.targets:
+                self.fetch_target(stacked_uuid, path)
+                continue
+
+            item_above = self.get_blocker(builder, stacked_uuid)
+            if item_above is None:
+                continue
+
+            self.unstack(builder, item_above, path | {stacked_uuid})
+            job = RobotJob(job_type="FETCH_INVENTORY", item=item_above)
+            self.fetched[stacked_uuid] = job
+            self.supports[stacked_uuid] = item.uuid
+            self.blockers.append(item_above)
+            self.jobs.append(job)
+
+    def get_blocker(
+        self, builder: FetchInventoryRobotJobBuilder, stacked_uuid: str
+    ) -> Item | None:
+        """Get an item in the way, None if it does not need to be moved."""
+        if stacked_uuid not in self.items:
+            item_above = builder.get_item(stacked_uuid)
+            if item_above.meta.item_type == "empty":
+                logger.info("Item with uuid {} is empty. Skipping", stacked_uuid)
+                self.items[stacked_uuid] = None
+                return None
+
+            item_above.primary_barcode = builder.get_primary_barcode(stacked_uuid)
+            if item_above.primary_barcode.meta.data in builder.fetched_items:
+                # Already fetched by an earlier request of the batch
+                self.items[stacked_uuid] = None
+                return None
+
+            self.items[stacked_uuid] = item_above
+
+        return self.items[stacked_uuid]
+
+    def get_items_above(
+        self, builder: FetchInventoryRobotJobBuilder, item: Item, seen: set[str]
+    ) -> set[str]:
+        """Get the uuids of all items which have to be moved to reach an item."""
+        for stacked_uuid in item.meta.stack:
+            if stacked_uuid in seen:
+                continue
+            if stacked_uuid in self.targets:
+                item_above = self.targets[stacked_uuid][1]
+            else:
+                item_above = self.get_blocker(builder, stacked_uuid)
+                if item_above is None:
+                    continue
+
+            seen.add(stacked_uuid)
+            self.get_items_above(builder, item_above, seen)
+        return seen
+
+    def store_back(self) -> None:
+        """Store the unstacked items back, lowest first.
+
+        Items go to the future empty of the item they were on, or else to the
+        smallest future empty they fit in. A future empty can only be used
+        once. The future empty of a fetched target is where the target was,
+        and is only used if the item under it was not fetched or its future
+        empty is filled again. The future empty of a stored back item is on
+        top of it, once stored, so nothing is stored in the air.
+        """
+        # Uuid of the fetched item under each fetched item
+        fetched_supports: dict[str, str] = {}
+        for fetched_uuid, job in self.fetched.items():
+            for stacked_uuid in job.item.meta.stack:
+                if stacked_uuid in self.fetched:
+                    fetched_supports.setdefault(stacked_uuid, fetched_uuid)
+
+        blocker_uuids = {item.uuid for item in self.blockers}
+        filled: set[str] = set()
+        # Stored back items at their new position, by uuid
+        stored: dict[str, Item] = {}
+
+        def is_free(empty_uuid: str) -> bool:
+            if empty_uuid in filled:
+                return False
+            if empty_uuid in blocker_uuids:
+                return empty_uuid in stored
+            return (
+                empty_uuid not in fetched_supports
+                or fetched_supports[empty_uuid] in filled
+            )
+
+        for item in reversed(self.blockers):
+            destination_uuid = self.supports[item.uuid]
+            if not is_free(destination_uuid):
+                destination_uuid = self.find_free_empty(
+                    item,
+                    {
+                        empty_uuid: self.get_empty_place(empty_uuid, stored)
+                        for empty_uuid in self.fetched
+                        if is_free(empty_uuid)
+                    },
+                )
+
+            filled.add(destination_uuid)
+            destination_job = self.fetched[destination_uuid]
+            if destination_job.future_uuid is None:
+                destination_job.future_uuid = str(uuid.uuid4())
+
+            destination = self.builders[0].create_future_empty(
+                destination_job.future_uuid,
+                self.get_empty_place(destination_uuid, stored),
+            )
+            # The item is stored at the bottom of the empty
+            stored_item = item.model_copy(deep=True)
+            stored_item.absolute.position = destination.absolute.position.model_copy()
+            stored[item.uuid] = stored_item
+            self.jobs.append(
+                RobotJob(
+                    job_type="STORE_INVENTORY",
+                    item=stored_item,
+                    destination=destination,
+                )
+            )
+
+    def get_empty_place(self, fetched_uuid: str, stored: dict[str, Item]) -> Item:
+        """Get the place of the future empty of a fetched item, as an item.
+
+        It is where the item was, or on top of it once stored back.
+        """
+        if fetched_uuid not in stored:
+            return self.fetched[fetched_uuid].item
+
+        place = stored[fetched_uuid].model_copy(deep=True)
+        place.absolute.position.y += place.relative.dimension.y
+        return place
+
+    @staticmethod
+    def find_free_empty(item: Item, places: dict[str, Item]) -> str:
+        """Find the smallest future empty the item fits in, by its place."""
+        candidates = [
+            empty_uuid
+            for empty_uuid, place in places.items()
+            if place.relative.dimension.x >= item.relative.dimension.x
+            and place.relative.dimension.y >= item.relative.dimension.y
+        ]
+        if not candidates:
+            raise ValueError(f"No empty found to store back item with uuid {item.uuid}")
+
+        return min(
+            candidates,
+            key=lambda empty_uuid: places[empty_uuid].relative.dimension.x
+            * places[empty_uuid].relative.dimension.y,
+        )
@@ -0,0 +1,204 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Module to order the jobs of a robot batch for shorter travel."""
+
+from __future__ import annotations
+
+import itertools
+import math
+from typing import TYPE_CHECKING, Any
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from src.models import Item, RobotJob
+
+Position = tuple[int | None, float, float]
+
+# Change in the number of items carried by the robot after each job type
+LOAD_CHANGES = {
+    "FETCH_INVENTORY": 1,
+    "FETCH_DESIGNATED": 1,
+    "STORE_INVENTORY": -1,
+    "STORE_DESIGNATED": -1,
+}
+
+
+def get_position(item: Item) -> Position:
+    """Get the aisle, position along the aisle and height of an item."""
+    position = item.absolute.position
+    along = getattr(position, item.absolute.aligned_axis or "x")
+    return item.meta.aisle_index, along, position.y
+
+
+def get_job_position(job: RobotJob) -> Position:
+    """Get where the robot has to go for a job."""
+    if job.destination is not None and job.job_type.startswith("STORE"):
+        return get_position(job.destination)
+    return get_position(job.item)
+
+
+def get_job_keys(job: RobotJob) -> set[str]:
+    """Uuids of the items a job depends on or changes."""
+    keys = {job.item.uuid, *job.item.meta.stack}
+    if job.destination is not None:
+        keys |= {job.destination.uuid, *job.destination.meta.stack}
+    if job.future_uuid:
+        keys.add(job.future_uuid)
+    keys.discard(None)
+    return keys
+
+
+class JobSequencer:
+    """Reorders independent jobs to shorten the travel of the robot.
+
+    Jobs touching the same items, their stacks or future empties keep their
+    order. The order is built greedily by going to the nearest job which is
+    ready, then improved with 2-opt moves. The robot never carries more
+    items than its capacity, or than the original order needs. The original
+    order is kept if it is not longer.
+    """
+
+    def __init__(self, capacity: int, aisle_change_distance: float):
+        """Initialize the sequencer."""
+        self.capacity = capacity
+        self.aisle_change_distance = aisle_change_distance
+        self.stats: dict[str, Any] = {}
+
+    def distance(self, a: Position, b: Position) -> float:
+        """Estimate the travel distance between two positions."""
+        if a[0] == b[0]:
+            return math.hypot(a[1] - b[1], a[2] - b[2])
+        # Leave the aisle at its start and enter the other one
+        return abs(a[1]) + abs(b[1]) + abs(a[2] - b[2]) + self.aisle_change_distance
+
+    def path_distance(self, order: list[int], positions: list[Position]) -> float:
+        """Travel distance of the jobs in the given order."""
+        return sum(
+            self.distance(positions[a], positions[b])
+            for a, b in itertools.pairwise(order)
+        )
+
+    def sequence(self, jobs: list[RobotJob]) -> list[RobotJob]:
+        """Get the jobs in a shorter order."""
+        positions = [get_job_position(job) for job in jobs]
+        self.predecessors = self.get_predecessors(jobs)
+        self.load_changes = [LOAD_CHANGES.get(job.job_type, 0) for job in jobs]
+
+        original = list(range(len(jobs)))
+        loads = self.get_loads(original)
+        # Items already on the robot and the most the original order carries
+        self.initial_load = max(0, -min(loads, default=0))
+        self.max_load = max(self.capacity, self.initial_load + max(loads, default=0))
+
+        order = self.improve(self.nearest_ready(positions), positions)
+        before = self.path_distance(original, positions)
+        after = self.path_distance(order, positions)
+        if after >= before:
+            order, after = original, before
+
+        self.stats = {
+            "travel_distance_before": before,
+            "travel_distance_after": after,
+            "travel_distance_saved": before - after,
+        }
+        logger.info(
+            "Sequenced {} jobs, travel distance {:.2f} instead of {:.2f}",
+            len(jobs),
+            after,
+            before,
+        )
+        return [jobs[index] for index in order]
+
+    @staticmethod
+    def get_predecessors(jobs: list[RobotJob]) -> list[set[int]]:
+        """Get the earlier jobs each job has to stay after."""
+        predecessors: list[set[int]] = []
+        last_jobs: dict[str, int] = {}
+        for index, job in enumerate(jobs):
+            keys = get_job_keys(job)
+            predecessors.append({last_jobs[key] for key in keys if key in last_jobs})
+            for key in keys:
+                last_jobs[key] = index
+        return predecessors
+
+    def get_loads(self, order: list[int]) -> list[int]:
+        """Get the change in carried items after each job."""
+        loads = []
+        load = 0
+        for index in order:
+            load += self.load_changes[index]
+            loads.append(load)
+        return loads
+
+    def is_ready(self, index: int, done: set[int], load: int) -> bool:
+        """Check if a job can be done next."""
+        return self.predecessors[index] <= done and (
+            0 <= load + self.load_changes[index] <= self.max_load
+        )
+
+    def is_feasible(self, order: list[int]) -> bool:
+        """Check the dependencies and the capacity of an order."""
+        done: set[int] = set()
+        load = self.initial_load
+        for index in order:
+            if not self.is_ready(index, done, load):
+                return False
+            done.add(index)
+            load += self.load_changes[index]
+        return True
+
+    def nearest_ready(self, positions: list[Position]) -> list[int]:
+        """Build an order by going to the nearest ready job."""
+        order: list[int] = []
+        done: set[int] = set()
+        pending = list(range(len(positions)))
+        load = self.initial_load
+        current = positions[0] if positions else None
+        while pending:
+            ready = [
+                index for index in pending if self.is_ready(index, done, load)
+            ] or pending[:1]
+            index = min(ready, key=lambda x: self.distance(current, positions[x]))
+            order.append(index)
+            done.add(index)
+            pending.remove(index)
+            load += self.load_changes[index]
+            current = positions[index]
+
+        return order if self.is_feasible(order) else list(range(len(positions)))
+
+    def improve(self, order: list[int], positions: list[Position]) -> list[int]:
+        """Reverse segments of the order while it gets shorter."""
+        improved = True
+        while improved:
+            improved = False
+            for start in range(len(order) - 1):
+                for end in range(start + 1, len(order)):
+                    before = after = 0.0
+                    if start > 0:
+                        before += self.distance(
+                            positions[order[start - 1]], positions[order[start]]
+                        )
+                        after += self.distance(
+                            positions[order[start - 1]], positions[order[end]]
+                        )
+                    if end + 1 < len(order):
+                        before += self.distance(
+                            positions[order[end]], positions[order[end + 1]]
+                        )
+                        after += self.distance(
+                            positions[order[start]], positions[order[end + 1]]
+                        )
+                    if after >= before - 1e-9:
+                        continue
+
+                    candidate = [
+                        *order[:start],
+                        *reversed(order[start : end + 1]),
+                        *order[end + 1 :],
+                    ]
+                    if self.is_feasible(candidate):
+                        order = candidate
+                        improved = True
+        return order
@@ -16,6 +16,7 @@ from src.models import (
     Vector2,
     Vector3,
 )
+from src.services.model.neighbourhood import Neighbourhood
 from src.services.model.rectangle import RectangleService
 from src.utils import validate_many_docs
 
@@ -171,30 +172,21 @@ class StoreInventoryRobotJobBuilder(RobotJobBuilderABC):
             },
         }
         nearby_items = inventory_items.find(query)
-        nearby_items = validate_many_docs(nearby_items, Item)
+        neighbourhood = Neighbourhood(validate_many_docs(nearby_items, Item))
 
-        items_below = [
-            item
-            for item in nearby_items
-            if abs(item.bounding_box.top_right.y - empty.absolute.position.y)
-            < alignment_margin
-            and item.bounding_box.top_right.x > empty.bounding_box.bottom_left.x
-            and item.bounding_box.bottom_left.x < empty.bounding_box.top_right.x
-            and item.meta.item_type == "box"
-        ]
-
-        if items_below:
+        if neighbourhood.below(empty, "box", alignment_margin):
             # If stacked store then just store in middle
             return None
 
-        return self.find_nearest_box(empty, nearby_items)
+        return self.find_nearest_box(empty, neighbourhood, alignment_margin)
 
+    @staticmethod
     def find_nearest_box(
-        self, empty: Item, nearby_items: list[Item]
+        empty: Item, neighbourhood: Neighbourhood, alignment_margin: float = 0.1
     ) -> Literal["left", "right"] | None:
         """Find nearest_box."""
-        left_edge = self.get_left_edge(empty, nearby_items)
-        right_edge = self.get_right_edge(empty, nearby_items)
+        left_edge = neighbourhood.left_edge(empty, alignment_margin)
+        right_edge = neighbourhood.right_edge(empty, alignment_margin)
 
         if left_edge is not None and left_edge.meta.item_type == "box":
             left_distance = abs(
@@ -218,42 +210,6 @@ class StoreInventoryRobotJobBuilder(RobotJobBuilderABC):
 
         return "right"
 
-    @staticmethod
-    def get_left_edge(
-        empty: Item, nearby_items: list[Item], alignment_margin: float = 0.1
-    ) -> Item | None:
-        """Get left limit of empty."""
-        left = [
-            item
-            for item in nearby_items
-            if abs(item.absolute.position.y - empty.absolute.position.y)
-            < alignment_margin
-            and abs(item.bounding_box.top_right.x - empty.bounding_box.bottom_left.x)
-            < alignment_margin
-        ]
-
-        if left:
-            return left[0]
-        return None
-
-    @staticmethod
-    def get_right_edge(
-        empty: Item, nearby_items: list[Item], alignment_margin: float = 0.1
-    ) -> Item | None:
-        """Get right limit of empty."""
-        right = [
-            item
-            for item in nearby_items
-            if abs(item.absolute.position.y - empty.absolute.position.y)
-            < alignment_margin
-            and abs(item.bounding_box.bottom_left.x - empty.bounding_box.top_right.x)
-            < alignment_margin
-        ]
-
-        if right:
-            return right[0]
-        return None
-
 
 def overlap(item_a: Item, item_b: Item) -> float:
     """Calculate horizontal overlap between items."""
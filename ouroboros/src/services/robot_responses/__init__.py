@@ -1,7 +1,9 @@
 # Copyright 2024 The Rubic. All Rights Reserved.
 
+from .compact_jobs import rehydrate_jobs
 from .fetch_designated import FetchDesignatedRobotResponse
 from .fetch_inventory import FetchInventoryRobotResponse
+from .job_partitions import partition_jobs
 from .store_designated import StoreDesignatedRobotResponse
 from .store_inventory import StoreInventoryRobotResponse
 
@@ -10,4 +12,6 @@ __all__ = [
     "FetchInventoryRobotResponse",
     "StoreDesignatedRobotResponse",
     "StoreInventoryRobotResponse",
+    "partition_jobs",
+    "rehydrate_jobs",
 ]
@@ -5,9 +5,11 @@
 from abc import ABC, abstractmethod
 
 from loguru import logger
+from pymongo import ReplaceOne
 
 from db.mongodb import robot_job_collection
 from src.models import ItemUpdate, RobotJob
+from src.services.persistence import WritePlan
 
 
 class RobotResponseABC(ABC):
@@ -15,8 +17,12 @@ class RobotResponseABC(ABC):
 
     job_type: str
 
-    def __init__(self):
-        """Initialize the RobotResponse class."""
+    def __init__(self, plan: WritePlan):
+        """Initialize the RobotResponse class.
+
+        Writes are staged in the plan, which is committed by the caller.
+        """
+        self.plan = plan
         self.updates: list[ItemUpdate] = []
 
     def process(self, job: RobotJob) -> None:
@@ -32,7 +38,10 @@ class RobotResponseABC(ABC):
             )
 
             # Get the job from the database and update it
-            robot_job_collection.replace_one({"job_id": job.job_id}, job.model_dump())
+            self.plan.add(
+                robot_job_collection,
+                ReplaceOne({"job_id": job.job_id}, job.model_dump()),
+            )
 
             self.update_inventory(job)
 
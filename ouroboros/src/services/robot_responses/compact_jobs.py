@@ -0,0 +1,36 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Rebuild the compact jobs of batch responses from the sent jobs."""
+
+from db.mongodb import robot_job_collection
+from src.models import CompactRobotJob, RobotBatchResponse, RobotJob
+from src.utils import validate_many_docs
+
+
+def rehydrate_jobs(response: RobotBatchResponse) -> RobotBatchResponse:
+    """Replace the compact jobs of a response by full jobs.
+
+    The items of the jobs are loaded from the jobs stored when the batch was
+    sent, in a single query, with the pose reported by the robot.
+    """
+    job_ids = [job.job_id for job in response.jobs if isinstance(job, CompactRobotJob)]
+    if not job_ids:
+        return response
+
+    stored_jobs = {
+        job.job_id: job
+        for job in validate_many_docs(
+            robot_job_collection.find({"job_id": {"$in": job_ids}}), RobotJob
+        )
+    }
+    missing = set(job_ids) - stored_jobs.keys()
+    if missing:
+        raise ValueError(
+            f"No jobs with job_id in {sorted(missing)} found in robot_job_collection"
+        )
+
+    jobs = [
+        job.to_job(stored_jobs[job.job_id]) if isinstance(job, CompactRobotJob) else job
+        for job in response.jobs
+    ]
+    return response.model_copy(update={"jobs": jobs})
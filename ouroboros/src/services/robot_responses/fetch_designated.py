@@ -5,8 +5,9 @@
 import uuid
 
 from loguru import logger
+from pymongo import InsertOne
 
-from db.mongodb import barcode_collection, inventory_items
+from db.mongodb import barcode_collection
 from src.models import Barcode, ItemUpdate, RobotJob
 from src.utils import validate_many_docs
 
@@ -57,11 +58,11 @@ class FetchDesignatedRobotResponse(RobotResponseABC):
             # The barcode from the item is not in the inventory
             # So make the item
             item_uuid = item.uuid
-            inventory_items.insert_one(item.model_dump())
+            self.plan.insert_item(item.model_dump())
             # insert all the barcodes
             for barcode in barcodes:
                 barcode.item_uuid = item_uuid
-                barcode_collection.insert_one(barcode.model_dump())
+                self.plan.add(barcode_collection, InsertOne(barcode.model_dump()))
 
             logger.info("Created new item with uuid: {}", item.uuid)
             self.updates.append(ItemUpdate(change="UPDATED", item=item))
@@ -4,7 +4,6 @@
 
 from loguru import logger
 
-from db.mongodb import inventory_items
 from src.models import (
     Item,
     ItemAbsolute,
@@ -16,6 +15,7 @@ from src.models import (
     Vector2,
     Vector3,
 )
+from src.services.model.neighbourhood import Neighbourhood
 from src.services.model.rectangle import RectangleService
 from src.utils import validate_doc, validate_many_docs
 
@@ -41,7 +41,7 @@ class FetchInventoryRobotResponse(RobotResponseABC):
             "uuid": uuid,
             "meta.location": "inventory",
         }
-        doc = inventory_items.find_one(query)
+        doc = self.plan.find_item(query)
         if doc is None:
             raise ValueError(
                 f'No item with uuid="{item.uuid}" and '
@@ -56,8 +56,7 @@ class FetchInventoryRobotResponse(RobotResponseABC):
 
         item_doc = item.model_dump()
         new_values = {"$set": item_doc}
-        update_result = inventory_items.update_one(query, new_values, upsert=True)
-        is_upserted = update_result.upserted_id is None
+        is_upserted = self.plan.update_item(query, new_values, upsert=True)
         logger.info(
             "Updated inventory item with uuid: {}. Upserted: {}", uuid, is_upserted
         )
@@ -80,13 +79,13 @@ class FetchInventoryRobotResponse(RobotResponseABC):
         else:
             empty_item = self.merge_empty(empty_item)
 
-        inventory_items.insert_one(empty_item.model_dump())
+        self.plan.insert_item(empty_item.model_dump())
         logger.info("Created new empty item with uuid: {}", empty_item.uuid)
         self.updates.append(ItemUpdate(change="CREATED", item=empty_item))
 
         # Update all items that contains picked item as stack
         query = {"meta.stack": item.uuid}
-        affected_items = inventory_items.find(query)
+        affected_items = self.plan.find_items(query)
         affected_items = validate_many_docs(affected_items, Item)
 
         for affected_item in affected_items:
@@ -94,14 +93,17 @@ class FetchInventoryRobotResponse(RobotResponseABC):
             affected_item.meta.stack.remove(item.uuid)
             # Update affected item
             affected_item_doc = affected_item.model_dump()
-            inventory_items.update_one(
+            self.plan.update_item(
                 {"uuid": affected_item.uuid}, {"$set": affected_item_doc}
             )
             logger.info("Updated meta stack for item with uuid {}", affected_item.uuid)
             self.updates.append(ItemUpdate(change="UPDATED", item=affected_item))
 
     def merge_empty(self, empty: Item, margin: float = 0.1) -> Item:
-        """Try merge empty with nearby empties."""
+        """Try merge empty with nearby empties.
+
+        The merged empties are deleted together once the empty is built.
+        """
         query = {
             "meta.aisle_index": empty.meta.aisle_index,
             "meta.location": "inventory",
@@ -115,37 +117,36 @@ class FetchInventoryRobotResponse(RobotResponseABC):
                 "$lt": empty.absolute.position.y + 1.0,
             },
         }
-        nearby_items = inventory_items.find(query)
-        nearby_items = validate_many_docs(nearby_items, Item)
-
-        items_below = [
-            item
-            for item in nearby_items
-            if abs(item.bounding_box.top_right.y - empty.absolute.position.y) < margin
-            and item.bounding_box.top_right.x > empty.bounding_box.bottom_left.x
-            and item.bounding_box.bottom_left.x < empty.bounding_box.top_right.x
-            and item.meta.item_type == "box"
-        ]
+        nearby_items = self.plan.find_items(query)
+        neighbourhood = Neighbourhood(validate_many_docs(nearby_items, Item))
+        merged_empties: list[Item] = []
 
+        items_below = neighbourhood.below(empty, "box", margin)
         if items_below:
-            empty = self.expand_empty_on_item(empty, items_below, nearby_items)
+            empty = self.expand_empty_on_item(empty, items_below, neighbourhood)
         else:
-            empty = self.expand_empty(empty, nearby_items)
+            empty = self.expand_empty(empty, neighbourhood, merged_empties)
+
+        empty = self.merge_empty_above(empty, neighbourhood, merged_empties, margin)
 
-        return self.merge_empty_above(empty, nearby_items)
+        if merged_empties:
+            self.plan.delete_items(
+                {
+                    "uuid": {"$in": [merged.uuid for merged in merged_empties]},
+                    "meta.item_type": "empty",
+                }
+            )
+        return empty
 
     def merge_empty_above(
-        self, empty: Item, nearby_items: list[Item], margin: float = 0.1
+        self,
+        empty: Item,
+        neighbourhood: Neighbourhood,
+        merged_empties: list[Item],
+        margin: float = 0.1,
     ) -> Item:
         """Merge empty with the empty above it."""
-        items_above = [
-            item
-            for item in nearby_items
-            if abs(item.absolute.position.y - empty.bounding_box.top_right.y) < margin
-            and item.bounding_box.top_right.x > empty.bounding_box.bottom_left.x
-            and item.bounding_box.bottom_left.x < empty.bounding_box.top_right.x
-            and item.meta.item_type == "empty"
-        ]
+        items_above = neighbourhood.above(empty, "empty", margin)
 
         if not items_above:
             return empty
@@ -156,27 +157,27 @@ class FetchInventoryRobotResponse(RobotResponseABC):
         )
         empty.relative.dimension.y += additional_height
 
-        inventory_items.delete_one({"uuid": above.uuid, "meta.item_type": "empty"})
+        merged_empties.append(above)
         self.updates.append(ItemUpdate(change="DELETED", item=above))
 
         return empty
 
     @classmethod
     def expand_empty_on_item(
-        cls, empty: Item, items_below: list[Item], nearby_items: list[Item]
+        cls, empty: Item, items_below: list[Item], neighbourhood: Neighbourhood
     ) -> Item:
         """Maximize empty on item."""
         below = max(items_below, key=lambda x: overlap(x, empty))
 
         left_limit = below.bounding_box.bottom_left.x
-        left_edge = cls.get_left_edge(empty, nearby_items)
+        left_edge = neighbourhood.left_edge(empty, 0.1)
         if left_edge is not None and left_edge.meta.item_type == "box":
             left_limit = max(
                 left_edge.bounding_box.top_right.x, below.bounding_box.bottom_left.x
             )
 
         right_limit = below.bounding_box.top_right.x
-        right_edge = cls.get_right_edge(empty, nearby_items)
+        right_edge = neighbourhood.right_edge(empty, 0.1)
         if right_edge is not None and right_edge.meta.item_type == "box":
             right_limit = min(
                 right_edge.bounding_box.bottom_left.x, below.bounding_box.top_right.x
@@ -184,9 +185,11 @@ class FetchInventoryRobotResponse(RobotResponseABC):
 
         return cls.construct_empty(empty, left_limit, right_limit)
 
-    def expand_empty(self, empty: Item, nearby_items: list[Item]) -> Item:
+    def expand_empty(
+        self, empty: Item, neighbourhood: Neighbourhood, merged_empties: list[Item]
+    ) -> Item:
         """Maximize empty."""
-        left_edge = self.get_left_edge(empty, nearby_items)
+        left_edge = neighbourhood.left_edge(empty, 0.1)
         if left_edge is not None:
             if left_edge.meta.item_type == "box":
                 empty = self.construct_empty(
@@ -195,9 +198,9 @@ class FetchInventoryRobotResponse(RobotResponseABC):
                     empty.bounding_box.top_right.x,
                 )
             elif left_edge.meta.item_type == "empty":
-                empty = self.merge_empty_side(empty, left_edge)
+                empty = self.merge_empty_side(empty, left_edge, merged_empties)
 
-        right_edge = self.get_right_edge(empty, nearby_items)
+        right_edge = neighbourhood.right_edge(empty, 0.1)
         if right_edge is not None:
             if right_edge.meta.item_type == "box":
                 empty = self.construct_empty(
@@ -206,11 +209,13 @@ class FetchInventoryRobotResponse(RobotResponseABC):
                     right_edge.bounding_box.bottom_left.x,
                 )
             elif right_edge.meta.item_type == "empty":
-                empty = self.merge_empty_side(empty, right_edge)
+                empty = self.merge_empty_side(empty, right_edge, merged_empties)
 
         return empty
 
-    def merge_empty_side(self, empty: Item, side_empty: Item) -> Item:
+    def merge_empty_side(
+        self, empty: Item, side_empty: Item, merged_empties: list[Item]
+    ) -> Item:
         """Merge empty with its neighbor."""
         left_limit = min(
             empty.bounding_box.bottom_left.x, side_empty.bounding_box.bottom_left.x
@@ -220,45 +225,11 @@ class FetchInventoryRobotResponse(RobotResponseABC):
         )
         empty = self.construct_empty(empty, left_limit, right_limit)
 
-        inventory_items.delete_one({"uuid": side_empty.uuid, "meta.item_type": "empty"})
+        merged_empties.append(side_empty)
         self.updates.append(ItemUpdate(change="DELETED", item=side_empty))
 
         return empty
 
-    @staticmethod
-    def get_left_edge(
-        empty: Item, nearby_items: list[Item], margin: float = 0.1
-    ) -> Item | None:
-        """Get left limit of empty."""
-        left = [
-            item
-            for item in nearby_items
-            if abs(item.absolute.position.y - empty.absolute.position.y) < margin
-            and abs(item.bounding_box.top_right.x - empty.bounding_box.bottom_left.x)
-            < margin
-        ]
-
-        if left:
-            return left[0]
-        return None
-
-    @staticmethod
-    def get_right_edge(
-        empty: Item, nearby_items: list[Item], margin: float = 0.1
-    ) -> Item | None:
-        """Get right limit of empty."""
-        right = [
-            item
-            for item in nearby_items
-            if abs(item.absolute.position.y - empty.absolute.position.y) < margin
-            and abs(item.bounding_box.bottom_left.x - empty.bounding_box.top_right.x)
-            < margin
-        ]
-
-        if right:
-            return right[0]
-        return None
-
     @staticmethod
     def construct_empty(empty: Item, left_limit: float, right_limit: float) -> Item:
         """Construct an expandend empty item."""
@@ -0,0 +1,60 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Partition the jobs of a batch into independent groups."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Hashable
+
+    from src.models import Item, RobotJob
+
+
+def item_keys(item: Item) -> set[Hashable]:
+    """Keys of the inventory state an item touches."""
+    keys: set[Hashable] = {("side", item.meta.aisle_index, item.relative.side)}
+    keys |= {("uuid", uuid) for uuid in [item.uuid, *item.meta.stack] if uuid}
+    return keys
+
+
+def job_keys(job: RobotJob) -> set[Hashable]:
+    """Keys of the inventory state a job touches."""
+    keys = item_keys(job.item)
+    if job.destination is not None:
+        keys |= item_keys(job.destination)
+    if job.future_uuid:
+        keys.add(("uuid", job.future_uuid))
+    return keys
+
+
+def partition_jobs(jobs: list[RobotJob]) -> list[list[int]]:
+    """Group jobs which touch the same aisle side or linked items.
+
+    Jobs are linked through the (aisle, side) of their item and destination,
+    and through the uuids of the item, its stack, the destination and the
+    future empty. Jobs in different partitions never read or write the same
+    items, so partitions can be processed concurrently. Returns the indexes
+    of the jobs of each partition, in the order of the jobs.
+    """
+    parents = list(range(len(jobs)))
+
+    def find(index: int) -> int:
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    owners: dict[Hashable, int] = {}
+    for index, job in enumerate(jobs):
+        for key in job_keys(job):
+            if key in owners:
+                parents[find(index)] = find(owners[key])
+            else:
+                owners[key] = index
+
+    partitions: dict[int, list[int]] = {}
+    for index in range(len(jobs)):
+        partitions.setdefault(find(index), []).append(index)
+    return list(partitions.values())
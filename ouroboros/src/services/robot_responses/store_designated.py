@@ -3,8 +3,9 @@
 """Implements concrete store designated response processing."""
 
 from loguru import logger
+from pymongo import DeleteMany
 
-from db.mongodb import barcode_collection, inventory_items
+from db.mongodb import barcode_collection
 from src.models import ItemUpdate, RobotJob
 
 from .base_robot_response import RobotResponseABC
@@ -20,13 +21,13 @@ class StoreDesignatedRobotResponse(RobotResponseABC):
         item = job.item
         # Delete the item
         query = {"uuid": item.uuid}
-        delete_result = inventory_items.delete_one(query)
-        if delete_result.deleted_count == 0:
+        deleted_count = self.plan.delete_item(query)
+        if deleted_count == 0:
             raise ValueError(
                 f'No item with uuid="{item.uuid}" found in inventory_items'
             )
 
         # Delete the barcodes
-        barcode_collection.delete_many({"item_uuid": item.uuid})
+        self.plan.add(barcode_collection, DeleteMany({"item_uuid": item.uuid}))
         logger.info("Deleted item and associated barcodes with uuid: {}", item.uuid)
         self.updates.append(ItemUpdate(change="DELETED", item=item))
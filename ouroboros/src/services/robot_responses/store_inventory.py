@@ -4,7 +4,6 @@
 
 from loguru import logger
 
-from db.mongodb import inventory_items
 from src.models import Item, ItemAbsolute, ItemRelative, ItemUpdate, RobotJob, Vector3
 from src.services.model.item import ItemService
 from src.services.model.rectangle import RectangleService
@@ -29,7 +28,7 @@ class StoreInventoryRobotResponse(RobotResponseABC):
         if job.destination is None:
             raise ValueError("Received store inventory job without destination")
 
-        destination_doc = inventory_items.find_one({"uuid": job.destination.uuid})
+        destination_doc = self.plan.find_item({"uuid": job.destination.uuid})
         destination = Item.model_validate(destination_doc)
 
         query = {"uuid": item.uuid}
@@ -50,7 +49,7 @@ class StoreInventoryRobotResponse(RobotResponseABC):
                 "barcodes": [barcode.model_dump() for barcode in item.barcodes],
             },
         }
-        inventory_items.find_one_and_update(query, update, upsert=True)
+        self.plan.update_item(query, update, upsert=True)
         logger.info("Updated inventory item with uuid: {}", item.uuid)
         self.updates.append(ItemUpdate(change="UPDATED", item=item))
 
@@ -92,12 +91,10 @@ class StoreInventoryRobotResponse(RobotResponseABC):
                     waypoint=destination.absolute.waypoint,
                 ),
             )
-            inventory_items.insert_one(new_empty.model_dump())
+            self.plan.insert_item(new_empty.model_dump())
             self.updates.append(ItemUpdate(change="CREATED", item=new_empty))
 
-        inventory_items.delete_one(
-            {"uuid": destination.uuid, "meta.item_type": "empty"}
-        )
+        self.plan.delete_item({"uuid": destination.uuid, "meta.item_type": "empty"})
         self.updates.append(ItemUpdate(change="DELETED", item=destination))
 
         # Query for nearby boxes underneath
@@ -117,7 +114,7 @@ class StoreInventoryRobotResponse(RobotResponseABC):
                 "$lte": item_position.y + 1,
             },
         }
-        nearby_boxes_doc = inventory_items.find(query)
+        nearby_boxes_doc = self.plan.find_items(query)
         nearby_boxes = validate_many_docs(nearby_boxes_doc, Item)
         item_stack = ItemService.generate_item_stack(nearby_boxes)
 
@@ -135,7 +132,7 @@ class StoreInventoryRobotResponse(RobotResponseABC):
             nearby_box.meta.stack = list(set(nearby_box.meta.stack))
 
             # Update the inventory
-            inventory_items.update_one(
+            self.plan.update_item(
                 {"uuid": nearby_box.uuid},
                 {"$set": {"meta.stack": nearby_box.meta.stack}},
             )
@@ -1,5 +1,17 @@
 # Copyright 2024 The Rubic. All Rights Reserved.
 
+from .grouped_query import aggregate_by_side_and_type
+from .hash_ring import HashRing
 from .model_parse import validate_doc, validate_many_docs
+from .mongo_query import apply_update, match_query, supports_query, supports_update
 
-__all__ = ["validate_doc", "validate_many_docs"]
+__all__ = [
+    "HashRing",
+    "aggregate_by_side_and_type",
+    "apply_update",
+    "match_query",
+    "supports_query",
+    "supports_update",
+    "validate_doc",
+    "validate_many_docs",
+]
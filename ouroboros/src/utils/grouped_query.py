@@ -0,0 +1,34 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Queries grouped by side and item type."""
+
+from collections import defaultdict
+from typing import Any
+
+from pymongo.collection import Collection
+
+
+def aggregate_by_side_and_type(
+    collection: Collection,
+    query: dict[str, Any],
+    projection: dict[str, Any] | None = None,
+    sort: dict[str, int] | None = None,
+) -> dict[tuple[str, str], list[dict[str, Any]]]:
+    """Run one aggregation and group the documents by side and item type.
+
+    Works for any collection shaped like items (``relative.side`` and
+    ``meta.item_type``). The grouping is done while reading the cursor rather
+    than with ``$group`` so large aisles do not hit the document size limit.
+    Documents keep the requested sort order within each group.
+    """
+    pipeline: list[dict[str, Any]] = [{"$match": query}]
+    if projection is not None:
+        pipeline.append({"$project": projection})
+    if sort is not None:
+        pipeline.append({"$sort": sort})
+
+    groups: dict[tuple[str, str], list[dict[str, Any]]] = defaultdict(list)
+    for doc in collection.aggregate(pipeline, allowDiskUse=True):
+        groups[doc["relative"]["side"], doc["meta"]["item_type"]].append(doc)
+
+    return dict(groups)
@@ -0,0 +1,43 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Consistent hash ring to assign keys to nodes."""
+
+from __future__ import annotations
+
+import hashlib
+from bisect import bisect
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+
+def hash_key(key: str) -> int:
+    """Stable hash of a key, the same in every process."""
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Assigns keys to nodes with consistent hashing.
+
+    Each node is placed on the ring many times, so keys are spread evenly.
+    Adding or removing a node only moves the keys of that node.
+    """
+
+    def __init__(self, nodes: Iterable[str], replicas: int = 100):
+        """Place the nodes on the ring."""
+        points = sorted(
+            (hash_key(f"{node}:{replica}"), node)
+            for node in set(nodes)
+            for replica in range(replicas)
+        )
+        if not points:
+            raise ValueError("Hash ring needs at least one node")
+
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def get_node(self, key: str) -> str:
+        """Get the node owning a key."""
+        index = bisect(self.hashes, hash_key(key)) % len(self.hashes)
+        return self.nodes[index]
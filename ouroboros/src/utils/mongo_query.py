@@ -0,0 +1,145 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Evaluate mongodb queries and updates on in-memory documents."""
+
+import operator
+from collections.abc import Callable
+from typing import Any
+
+MISSING = object()
+
+COMPARISONS: dict[str, Callable[[Any, Any], bool]] = {
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le,
+}
+QUERY_OPERATORS = {*COMPARISONS, "$in", "$nin", "$ne", "$exists"}
+UPDATE_OPERATORS = {"$set", "$inc", "$unset", "$push"}
+
+
+def get_path(doc: dict[str, Any], path: str) -> Any:
+    """Get the value at a dotted path, or MISSING."""
+    value: Any = doc
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return MISSING
+        value = value[key]
+    return value
+
+
+def equals(value: Any, operand: Any) -> bool:
+    """Mongodb equality, arrays match if any element is equal."""
+    if value is MISSING:
+        return operand is None
+    if isinstance(value, list) and not isinstance(operand, list):
+        return operand in value
+    return value == operand
+
+
+def match_operator(value: Any, query_operator: str, operand: Any) -> bool:
+    """Evaluate a single query operator on a value."""
+    if query_operator in COMPARISONS:
+        if value is MISSING or value is None:
+            return False
+        try:
+            return COMPARISONS[query_operator](value, operand)
+        except TypeError:
+            return False
+    if query_operator in {"$in", "$nin"}:
+        found = any(equals(value, candidate) for candidate in operand)
+        return found == (query_operator == "$in")
+    if query_operator == "$ne":
+        return not equals(value, operand)
+    if query_operator == "$exists":
+        return (value is not MISSING) == bool(operand)
+    raise NotImplementedError(f"Query operator {query_operator} is not supported")
+
+
+def is_operator(condition: Any) -> bool:
+    """Check if a query condition holds operators rather than a value."""
+    return isinstance(condition, dict) and any(
+        name.startswith("$") for name in condition
+    )
+
+
+def supports_query(query: dict[str, Any]) -> bool:
+    """Check if match_query can evaluate a query."""
+    for key, condition in query.items():
+        if key in {"$or", "$and"}:
+            if not all(supports_query(sub_query) for sub_query in condition):
+                return False
+        elif key.startswith("$") or (
+            is_operator(condition) and not condition.keys() <= QUERY_OPERATORS
+        ):
+            return False
+    return True
+
+
+def supports_update(update: dict[str, Any]) -> bool:
+    """Check if apply_update can apply an update."""
+    if not update.keys() <= UPDATE_OPERATORS:
+        return False
+    # Modifiers such as $each are not supported
+    return not any(is_operator(value) for value in update.get("$push", {}).values())
+
+
+def match_query(doc: dict[str, Any], query: dict[str, Any]) -> bool:
+    """Check if a document matches a mongodb query.
+
+    Supports equality on dotted paths, array membership, $gt, $gte, $lt,
+    $lte, $in, $nin, $ne, $exists, $and and $or, which covers the inventory
+    queries. Check other queries with supports_query first.
+    """
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(match_query(doc, sub_query) for sub_query in condition):
+                return False
+            continue
+        if key == "$and":
+            if not all(match_query(doc, sub_query) for sub_query in condition):
+                return False
+            continue
+
+        value = get_path(doc, key)
+        if is_operator(condition):
+            if not all(
+                match_operator(value, query_operator, operand)
+                for query_operator, operand in condition.items()
+            ):
+                return False
+        elif not equals(value, condition):
+            return False
+
+    return True
+
+
+def apply_update(doc: dict[str, Any], update: dict[str, Any]) -> None:
+    """Apply a mongodb update to a document in place.
+
+    Supports $set, $inc, $unset and $push of a single value. Check other
+    updates with supports_update first.
+    """
+    for update_operator, fields in update.items():
+        if update_operator not in UPDATE_OPERATORS:
+            raise NotImplementedError(
+                f"Update operator {update_operator} is not supported"
+            )
+
+        for path, value in fields.items():
+            *parents, key = path.split(".")
+            if update_operator == "$unset":
+                parent = get_path(doc, ".".join(parents)) if parents else doc
+                if isinstance(parent, dict):
+                    parent.pop(key, None)
+                continue
+
+            target = doc
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            if update_operator == "$inc":
+                target[key] = target.get(key, 0) + value
+            elif update_operator == "$push":
+                target.setdefault(key, []).append(value)
+            else:
+                target[key] = value
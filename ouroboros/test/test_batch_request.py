@@ -1,21 +1,50 @@
 # Copyright 2024 The Rubic. All Rights Reserved.
 
-from unittest.mock import patch
+import gzip
+import json
+import os
+import tempfile
+import threading
+from unittest.mock import Mock, patch
 
 import pytest
-from faststream.rabbit import TestRabbitBroker
+from faststream.rabbit import RabbitBroker, RabbitRouter, TestRabbitBroker
 
 from .mock_database import MOCK_CLIENT
 
 with (
     patch("azure.keyvault.secrets.SecretClient"),
-    patch("azure.storage.blob.BlobServiceClient"),
+    patch.dict(
+        os.environ, {"BLOB_STORE": "local", "LOCAL_BLOB_DIR": tempfile.mkdtemp()}
+    ),
     patch("pymongo.MongoClient", return_value=MOCK_CLIENT),
     patch("config.settings.AMQP_CONN_STR", new=""),
 ):
+    from db.mongodb import (
+        barcode_collection,
+        inventory_items,
+        job_type_collection,
+        robot_job_collection,
+    )
     from server import broker
-    from src.models import JobRequest
+    from src.codecs import (
+        Compression,
+        JsonCodec,
+        decompressing_parser,
+        get_codec,
+        json_decoder,
+        json_publish_middleware,
+    )
+    from src.models import Item, ItemUpdate, JobRequest, RobotJob
     from src.routers.batch import batch_request_handler
+    from src.services.factories import RobotJobFactory
+    from src.services.factories.job_type_registry import job_type_registry
+    from src.services.factories.robot_job_factory import get_job_type
+    from src.services.robot_requests import (
+        FetchInventoryRobotJobBuilder,
+        JobSequencer,
+    )
+    from src.services.robot_requests.barcode_cache import barcode_cache
 
     from .mock_robot import mock_robot_batch_request_handler
 
@@ -47,6 +76,118 @@ async def test_fetch_inventory() -> None:
         assert job["item"]["uuid"] == "c4440f6a-7638-4872-91a2-7be10db915aa"
 
 
+@pytest.mark.asyncio
+async def test_compact_robot_jobs() -> None:
+    async with TestRabbitBroker(broker) as br:
+        message = [
+            JobRequest(
+                job_type="FETCH_INVENTORY",
+                vendor="RUBIC",
+                uid="00100897774117552794",
+            )
+        ]
+        with patch("config.settings.COMPACT_ROBOT_JOBS", new=True):
+            await br.publish(message=message, queue="batch/request")
+
+        # The robot only gets the pose, dimensions and primary barcode
+        (sent_message,), _ = mock_robot_batch_request_handler.mock.call_args
+        job = sent_message["jobs"][0]
+        assert set(job["item"]) == {"uuid", "absolute", "relative", "primary_barcode"}
+        assert job["item"]["primary_barcode"]["meta"]["data"] == message[0].uid
+
+    # The full job is kept to rebuild the response
+    doc = robot_job_collection.find_one({"job_id": job["job_id"]})
+    assert doc["item"]["barcodes"]
+
+
+@pytest.mark.asyncio
+async def test_message_codec() -> None:
+    codec = get_codec("auto")
+    spy = JsonCodec("spy", Mock(wraps=codec.loads), Mock(wraps=codec.dumps))
+    router = RabbitRouter(
+        prefix="codec/",
+        decoder=json_decoder(spy),
+        middlewares=[json_publish_middleware(spy)],
+    )
+
+    @router.subscriber("in")
+    @router.publisher("out")
+    async def echo_handler(body: list[JobRequest]) -> list[JobRequest]:  # noqa: RUF029
+        return body
+
+    @router.subscriber("out")
+    async def out_handler(body: list[JobRequest]) -> None: ...
+
+    test_broker = RabbitBroker()
+    test_broker.include_router(router)
+
+    message = [JobRequest(job_type="FETCH_INVENTORY", vendor="RUBIC", uid="1")]
+    async with TestRabbitBroker(test_broker) as br:
+        await br.publish(message=message, queue="codec/in")
+
+        # The reply is serialized once, and both messages parsed by the codec
+        out_handler.mock.assert_called_once_with([job.model_dump() for job in message])
+        assert spy.dumps.call_count == 1
+        assert spy.loads.call_count == 2
+
+    # Both codecs serialize models to the same JSON
+    assert json.loads(get_codec("orjson").dumps(message)) == json.loads(
+        get_codec("json").dumps(message)
+    )
+
+    with pytest.raises(ValueError, match="not available"):
+        get_codec("msgpack")
+
+
+@pytest.mark.asyncio
+async def test_message_compression() -> None:
+    codec = get_codec("json")
+    compression = Compression(
+        "gzip", Mock(wraps=gzip.compress), Mock(wraps=gzip.decompress)
+    )
+    router = RabbitRouter(
+        prefix="compression/",
+        parser=decompressing_parser,
+        decoder=json_decoder(codec),
+        middlewares=[json_publish_middleware(codec, compression)],
+    )
+
+    @router.subscriber("in")
+    @router.publisher("out")
+    async def echo_handler(body: list[JobRequest]) -> list[JobRequest]:  # noqa: RUF029
+        return body
+
+    @router.subscriber("out")
+    async def out_handler(body: list[JobRequest]) -> None: ...
+
+    test_broker = RabbitBroker()
+    test_broker.include_router(router)
+
+    message = [JobRequest(job_type="FETCH_INVENTORY", vendor="RUBIC", uid="1")]
+    body = json.dumps([job.model_dump() for job in message]).encode()
+    async with TestRabbitBroker(test_broker) as br:
+        # Small messages are sent as they are
+        with patch("config.settings.COMPRESSION_THRESHOLD_BYTES", new=len(body) + 1):
+            await br.publish(message=message, queue="compression/in")
+        compression.compress.assert_not_called()
+
+        # Large messages are compressed, and decompressed when received
+        with patch("config.settings.COMPRESSION_THRESHOLD_BYTES", new=1):
+            await br.publish(message=message, queue="compression/in")
+        compression.compress.assert_called_once()
+        out_handler.mock.assert_called_with([job.model_dump() for job in message])
+
+        # Compressed messages of other producers are accepted too
+        out_handler.mock.reset_mock()
+        await br.publish(
+            gzip.compress(body),
+            queue="compression/out",
+            content_type="application/json",
+            content_encoding="gzip",
+        )
+        out_handler.mock.assert_called_once_with([job.model_dump() for job in message])
+
+
 @pytest.mark.asyncio
 async def test_fetch_inventory_stacked() -> None:
     async with TestRabbitBroker(broker) as br:
@@ -165,3 +306,267 @@ async def test_store_designated() -> None:
         assert job["item"]["uuid"] == "c4440f6a-7638-4872-91a2-7be10db915aa"
         assert job["destination"]["uuid"] == "5537a696-6a91-4f66-ba54-6fc472aa9328"
         assert job["destination"]["meta"]["item_type"] == "conveyor"
+
+
+def test_fetch_inventory_stacked_prefetches_items() -> None:
+    batch_request = [
+        JobRequest(
+            job_type="FETCH_INVENTORY",
+            vendor="RUBIC",
+            uid="00100897774116019311",
+        )
+    ]
+    robot_job_factory = RobotJobFactory()
+    robot_job_factory.prefetch(batch_request)
+
+    # Items, stacks and primary barcodes are served from the identity map
+    with (
+        patch.object(inventory_items, "find_one") as items_find_one,
+        patch.object(barcode_collection, "find_one") as barcodes_find_one,
+        patch.object(barcode_collection, "find") as barcodes_find,
+    ):
+        jobs = robot_job_factory.build_jobs(batch_request[0])
+
+    items_find_one.assert_not_called()
+    barcodes_find_one.assert_not_called()
+    barcodes_find.assert_not_called()
+    assert [job.job_type for job in jobs] == [
+        "FETCH_INVENTORY",
+        "FETCH_INVENTORY",
+        "STORE_INVENTORY",
+    ]
+
+
+def test_fetch_inventory_shared_stack() -> None:
+    # 97f0fcd3 is stacked on 95db8d93, which is stacked on d6e5b607
+    batch_request = [
+        JobRequest(
+            job_type="FETCH_INVENTORY",
+            vendor="RUBIC",
+            uid="00100897774115791232",
+        ),
+        JobRequest(
+            job_type="FETCH_INVENTORY",
+            vendor="RUBIC",
+            uid="00100897774115791201",
+        ),
+    ]
+    robot_job_factory = RobotJobFactory()
+    robot_job_factory.prefetch(batch_request)
+    jobs = robot_job_factory.build_batch_jobs(batch_request)
+
+    # The requested item in the way is fetched once and not stored back
+    assert [(job.job_type, job.item.uuid[:8]) for job in jobs] == [
+        ("FETCH_INVENTORY", "97f0fcd3"),
+        ("FETCH_INVENTORY", "95db8d93"),
+        ("FETCH_INVENTORY", "d6e5b607"),
+        ("STORE_INVENTORY", "97f0fcd3"),
+    ]
+    # The empty left by 95db8d93 is in the air, so the bottom one is used
+    assert jobs[3].destination.uuid == jobs[2].future_uuid
+    assert robot_job_factory.planning == {
+        "naive_moves": 8,
+        "planned_moves": 4,
+        "saved_moves": 4,
+    }
+
+
+def test_fetch_inventory_three_level_stack() -> None:
+    # 97f0fcd3 is stacked on 95db8d93, which is stacked on d6e5b607
+    batch_request = [
+        JobRequest(
+            job_type="FETCH_INVENTORY",
+            vendor="RUBIC",
+            uid="00100897774115791232",
+        )
+    ]
+    robot_job_factory = RobotJobFactory()
+    robot_job_factory.prefetch(batch_request)
+    jobs = robot_job_factory.build_batch_jobs(batch_request)
+
+    assert [(job.job_type, job.item.uuid[:8]) for job in jobs] == [
+        ("FETCH_INVENTORY", "97f0fcd3"),
+        ("FETCH_INVENTORY", "95db8d93"),
+        ("FETCH_INVENTORY", "d6e5b607"),
+        ("STORE_INVENTORY", "95db8d93"),
+        ("STORE_INVENTORY", "97f0fcd3"),
+    ]
+    bottom, middle = jobs[2].item, jobs[1].item
+
+    # The middle item is stored where the target was
+    assert jobs[3].destination.uuid == jobs[2].future_uuid
+    assert jobs[3].item.absolute.position == bottom.absolute.position
+
+    # The top item is stored on the middle item, where it now is
+    assert jobs[4].destination.uuid == jobs[1].future_uuid
+    top_position = jobs[4].item.absolute.position
+    assert top_position.x == bottom.absolute.position.x
+    assert top_position.y == pytest.approx(
+        bottom.absolute.position.y + middle.relative.dimension.y
+    )
+    assert jobs[4].destination.absolute.position == top_position
+
+
+def test_fetch_inventory_respects_robot_capacity() -> None:
+    # 65ca88b8 is stacked on 4a926c60 and a9d80578 on 2d3c8de2
+    batch_request = [
+        JobRequest(
+            job_type="FETCH_INVENTORY",
+            vendor="RUBIC",
+            uid="00100897774115947516",
+        ),
+        JobRequest(
+            job_type="FETCH_INVENTORY",
+            vendor="RUBIC",
+            uid="00100897774116552245",
+        ),
+    ]
+    robot_job_factory = RobotJobFactory()
+    robot_job_factory.prefetch(batch_request)
+    jobs = robot_job_factory.build_batch_jobs(batch_request)
+
+    # Both stacks are unstacked before storing back, with 4 items carried
+    assert [(job.job_type, job.item.uuid[:8]) for job in jobs] == [
+        ("FETCH_INVENTORY", "65ca88b8"),
+        ("FETCH_INVENTORY", "4a926c60"),
+        ("FETCH_INVENTORY", "a9d80578"),
+        ("FETCH_INVENTORY", "2d3c8de2"),
+        ("STORE_INVENTORY", "a9d80578"),
+        ("STORE_INVENTORY", "65ca88b8"),
+    ]
+
+    # The first stack is stored back before the robot is full
+    robot_job_factory = RobotJobFactory()
+    robot_job_factory.prefetch(batch_request)
+    with patch("config.settings.ROBOT_CAPACITY", new=3):
+        jobs = robot_job_factory.build_batch_jobs(batch_request)
+
+    assert [(job.job_type, job.item.uuid[:8]) for job in jobs] == [
+        ("FETCH_INVENTORY", "65ca88b8"),
+        ("FETCH_INVENTORY", "4a926c60"),
+        ("STORE_INVENTORY", "65ca88b8"),
+        ("FETCH_INVENTORY", "a9d80578"),
+        ("FETCH_INVENTORY", "2d3c8de2"),
+        ("STORE_INVENTORY", "a9d80578"),
+    ]
+    assert robot_job_factory.planning["planned_moves"] == 6
+
+
+def test_job_sequencer() -> None:
+    items = [
+        Item.model_validate(doc)
+        for doc in inventory_items.find(
+            {"meta.item_type": "box", "meta.stack": [], "relative.side": "left"}
+        ).limit(8)
+    ]
+    # Zig-zag along the aisle
+    items.sort(key=lambda x: x.absolute.position.x)
+    items = items[::2] + items[1::2][::-1]
+    jobs = [RobotJob(job_type="FETCH_INVENTORY", item=item) for item in items]
+    store_job = RobotJob(
+        job_type="STORE_INVENTORY",
+        item=items[0],
+        destination=FetchInventoryRobotJobBuilder.create_future_empty("abc4", items[1]),
+    )
+    jobs.insert(2, store_job)
+
+    job_sequencer = JobSequencer(capacity=4, aisle_change_distance=5)
+    sequenced = job_sequencer.sequence(jobs)
+
+    assert sorted(job.job_id for job in sequenced) == sorted(job.job_id for job in jobs)
+    # The store of a fetched item stays after its fetch
+    job_ids = [job.job_id for job in sequenced]
+    assert job_ids.index(jobs[0].job_id) < job_ids.index(store_job.job_id)
+    # The robot never carries more than the original order needs
+    load = 0
+    for job in sequenced:
+        load += 1 if job.job_type == "FETCH_INVENTORY" else -1
+        assert load <= len(items) - 1
+    stats = job_sequencer.stats
+    assert stats["travel_distance_after"] < stats["travel_distance_before"]
+
+
+def test_barcode_cache() -> None:
+    batch_request = [
+        JobRequest(
+            job_type="FETCH_INVENTORY",
+            vendor="RUBIC",
+            uid="00100897774117552794",
+        )
+    ]
+    barcode_cache.clear()
+    RobotJobFactory().build_jobs(batch_request[0])
+    hits = barcode_cache.stats()["hits"]
+
+    # The barcode is resolved from the cache by later batches
+    robot_job_factory = RobotJobFactory()
+    with patch.object(barcode_collection, "find") as barcodes_find:
+        robot_job_factory.prefetch(batch_request)
+        jobs = robot_job_factory.build_jobs(batch_request[0])
+
+    barcodes_find.assert_not_called()
+    assert barcode_cache.stats()["hits"] == hits + 1
+
+    # Updates of the item invalidate its barcodes
+    item = Item.model_validate(inventory_items.find_one({"uuid": jobs[0].item.uuid}))
+    barcode_cache.invalidate_updates([ItemUpdate(change="DELETED", item=item)])
+    assert barcode_cache.get_many(["00100897774117552794"]) == {}
+
+
+def test_job_type_registry() -> None:
+    job_type_registry.load()
+    stats = job_type_registry.stats()
+
+    # Preloaded job types are served without a query
+    with patch.object(job_type_collection, "find_one") as job_type_find_one:
+        job_type = get_job_type("RUBIC", "FETCH_INVENTORY")
+    job_type_find_one.assert_not_called()
+    assert job_type.generic_type == "FETCH_INVENTORY"
+    assert job_type_registry.stats()["hits"] == stats["hits"] + 1
+
+    # Job types added since the last load are found and then cached
+    job_type_collection.insert_one(
+        {
+            "vendor": "RUBIC",
+            "job_type": "NEW_FETCH",
+            "generic_type": "FETCH_INVENTORY",
+            "predetermined": False,
+        }
+    )
+    assert get_job_type("RUBIC", "NEW_FETCH").generic_type == "FETCH_INVENTORY"
+    assert job_type_registry.stats()["misses"] == stats["misses"] + 1
+
+    # Expired job types are reloaded in the background
+    job_type_collection.update_one(
+        {"job_type": "NEW_FETCH"}, {"$set": {"generic_type": "STORE_INVENTORY"}}
+    )
+    job_type_registry.expire()
+    job_type_registry.reload_thread.join()
+    assert get_job_type("RUBIC", "NEW_FETCH").generic_type == "STORE_INVENTORY"
+
+    job_type_collection.delete_one({"job_type": "NEW_FETCH"})
+    job_type_registry.expire()
+    job_type_registry.reload_thread.join()
+    with pytest.raises(ValueError, match="Job type NEW_FETCH not found"):
+        get_job_type("RUBIC", "NEW_FETCH")
+
+
+def test_job_type_registry_reloads_once_in_background() -> None:
+    job_type_registry.load()
+    loading = threading.Event()
+
+    def slow_load() -> None:
+        loading.wait(1)
+
+    # Expired job types are served while a single reload runs
+    with (
+        patch.object(job_type_registry, "ttl_seconds", 1e-9),
+        patch.object(job_type_registry, "load", side_effect=slow_load) as load_mock,
+    ):
+        for _ in range(3):
+            job_type = get_job_type("RUBIC", "FETCH_INVENTORY")
+            assert job_type.generic_type == "FETCH_INVENTORY"
+        loading.set()
+        job_type_registry.reload_thread.join()
+
+    load_mock.assert_called_once()
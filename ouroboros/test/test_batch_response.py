@@ -1,27 +1,57 @@
 # Copyright 2024 The Rubic. All Rights Reserved.
 
+import os
+import tempfile
 from unittest.mock import Mock, patch
 
 import pytest
 from faststream.rabbit import TestRabbitBroker
 
-from src.models import Item, ResultHeader, RobotBatchResponse, RobotJob
+from src.models import (
+    CompactRobotJob,
+    Item,
+    ResultHeader,
+    RobotBatchResponse,
+    RobotJob,
+)
 
 from .mock_database import MOCK_CLIENT
 
 with (
     patch("azure.keyvault.secrets.SecretClient"),
-    patch("azure.storage.blob.BlobServiceClient"),
+    patch.dict(
+        os.environ, {"BLOB_STORE": "local", "LOCAL_BLOB_DIR": tempfile.mkdtemp()}
+    ),
     patch("pymongo.MongoClient", return_value=MOCK_CLIENT),
     patch("config.settings.AMQP_CONN_STR", new=""),
 ):
-    from db.mongodb import inventory_items, robot_batch_collection, robot_job_collection
+    from db.mongodb import (
+        create_indexes,
+        inventory_items,
+        processed_job_collection,
+        robot_batch_collection,
+        robot_job_collection,
+    )
     from server import broker
-    from src.routers.batch import batch_response_handler
-
+    from src.routers.batch import batch_response_handler, updates_publisher
+    from src.services.handlers.batch.process_batch_response import (
+        ProcessBatchResponse,
+    )
+    from src.services.persistence import (
+        ConcurrentModificationError,
+        IdentityMap,
+        PartialCommitError,
+        WritePlan,
+        job_ledger,
+    )
+    from src.services.robot_responses import partition_jobs
+    from src.utils import apply_update, match_query
+
+
+create_indexes()
 
 # Insert some fake data
-robot_batch_collection.insert_one({"batch_id": "xyz"})
+robot_batch_collection.insert_one({"batch_id": "xyz", "planning": {"saved_moves": 2}})
 for i in range(10):
     robot_job_collection.insert_one({"job_id": f"j{i}"})
 
@@ -44,6 +74,7 @@ async def test_empty_batch_response() -> None:
 
     doc = robot_batch_collection.find_one({"batch_id": "xyz"})
     assert doc["header"]["success"] is True
+    assert doc["planning"] == {"saved_moves": 2}
 
 
 @pytest.mark.asyncio
@@ -186,7 +217,7 @@ async def test_successful_store_designated_response_item_not_found() -> None:
             batch_id="xyz",
             jobs=[
                 RobotJob(
-                    job_id="j3", job_type="STORE_DESIGNATED", item=item, success=True
+                    job_id="j4", job_type="STORE_DESIGNATED", item=item, success=True
                 )
             ],
             header=ResultHeader(
@@ -202,3 +233,429 @@ async def test_successful_store_designated_response_item_not_found() -> None:
         # Validate received message
         handler_mock = batch_response_handler.mock
         handler_mock.assert_called_with(message.model_dump())
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_store_inventory_in_same_batch() -> None:
+    uuid = "2d4041ef-b2de-4c08-b7f0-707e6eeaea1f"
+    item = inventory_items.find_one({"uuid": uuid})
+    item = Item.model_validate(item)
+    item.primary_barcode = item.barcodes[0]
+
+    # The store destination only exists once the fetch of the same batch is done
+    fetch_job = RobotJob(
+        job_id="j5",
+        job_type="FETCH_INVENTORY",
+        item=item,
+        future_uuid="abc2",
+        success=True,
+    )
+    destination = Item.model_validate(
+        {**item.model_dump(), "uuid": "abc2", "barcodes": []}
+        | {"meta": {**item.meta.model_dump(), "item_type": "empty"}}
+    )
+    store_job = RobotJob(
+        job_id="j6",
+        job_type="STORE_INVENTORY",
+        item=item,
+        destination=destination,
+        success=True,
+    )
+    response = RobotBatchResponse(
+        batch_id="xyz",
+        jobs=[fetch_job, store_job],
+        header=ResultHeader(
+            success=True, error_code=0, error_message="", safe_to_continue=True
+        ),
+    )
+
+    updates = await ProcessBatchResponse.process_response(response)
+
+    assert [
+        (update.change, update.item.uuid)
+        for update in updates
+        if update.item.uuid in {uuid, "abc2"}
+    ] == [
+        ("UPDATED", uuid),
+        ("CREATED", "abc2"),
+        ("UPDATED", uuid),
+        ("DELETED", "abc2"),
+    ]
+    doc = inventory_items.find_one({"uuid": uuid})
+    assert doc["meta"]["location"] == "inventory"
+    assert doc["meta"]["available"] is True
+    assert inventory_items.find_one({"uuid": "abc2"}) is None
+
+
+def test_identity_map_copy() -> None:
+    uuid = "443214ff-c4ab-45bf-8d26-a8301facadf7"
+    identity_map = IdentityMap()
+    identity_map.load_items([uuid], stacks=False)
+
+    # Partitions read the prefetched items and cache their own lookups
+    partition_map = identity_map.copy()
+    assert partition_map.get_item(uuid) == identity_map.get_item(uuid)
+    partition_map.get_item("not-prefetched")
+    assert "not-prefetched" not in identity_map.items
+
+
+def test_partition_jobs() -> None:
+    items = [
+        Item.model_validate(doc)
+        for doc in inventory_items.find({"meta.item_type": "box"})
+    ]
+    item = items[0]
+    other_side = next(
+        other
+        for other in items
+        if (other.meta.aisle_index, other.relative.side)
+        != (item.meta.aisle_index, item.relative.side)
+        and item.uuid not in other.meta.stack
+        and other.uuid not in item.meta.stack
+    )
+    destination = Item.model_validate(
+        {**other_side.model_dump(), "uuid": "abc3", "barcodes": []}
+    )
+    jobs = [
+        RobotJob(job_type="FETCH_INVENTORY", item=item, future_uuid="abc3"),
+        RobotJob(job_type="FETCH_INVENTORY", item=other_side),
+        RobotJob(job_type="STORE_INVENTORY", item=item, destination=destination),
+    ]
+
+    # The store links both sides through the future empty of the first fetch
+    assert partition_jobs(jobs) == [[0, 1, 2]]
+    assert partition_jobs(jobs[:2]) == [[0], [1]]
+
+
+@pytest.mark.asyncio
+async def test_redelivered_batch_response() -> None:
+    uuid = "5cc79bce-1a13-44c4-a65a-d41561e0acce"
+    item = Item.model_validate(inventory_items.find_one({"uuid": uuid}))
+    item.primary_barcode = item.barcodes[0]
+    response = RobotBatchResponse(
+        batch_id="redelivered",
+        jobs=[
+            RobotJob(job_id="j7", job_type="STORE_DESIGNATED", item=item, success=True)
+        ],
+        header=ResultHeader(
+            success=True, error_code=0, error_message="", safe_to_continue=True
+        ),
+    )
+
+    updates = await ProcessBatchResponse.process_response(response)
+    assert [(update.change, update.item.uuid) for update in updates] == [
+        ("DELETED", uuid)
+    ]
+
+    # The deleted item is not deleted again, without reading the inventory
+    with patch.object(inventory_items, "find") as items_find:
+        assert await ProcessBatchResponse.process_response(response) == []
+    items_find.assert_not_called()
+
+    # The ledger is used once the recent jobs are forgotten
+    job_ledger.clear()
+    assert await ProcessBatchResponse.process_response(response) == []
+
+
+def test_concurrent_modification() -> None:
+    uuid = "bb7a3714-01ea-4d64-ba1b-baa0b072626e"
+    plan = WritePlan()
+    plan.update_item({"uuid": uuid}, {"$set": {"meta.available": False}})
+
+    # Another consumer writes the item after it was read
+    inventory_items.update_one(
+        {"uuid": uuid}, {"$set": {"meta.destination": "robot"}, "$inc": {"version": 1}}
+    )
+    with pytest.raises(ConcurrentModificationError):
+        plan.commit()
+
+    doc = inventory_items.find_one({"uuid": uuid})
+    assert doc["meta"]["available"] is True
+    assert doc["version"] == 1
+
+    plan = WritePlan()
+    plan.update_item({"uuid": uuid}, {"$set": {"meta.available": False}})
+    plan.commit()
+    doc = inventory_items.find_one({"uuid": uuid})
+    assert doc["meta"]["available"] is False
+    assert doc["version"] == 2
+
+
+def test_write_plan_query_support() -> None:
+    # $exists, $nin, $unset and $push are evaluated on the staged items
+    doc = {"uuid": "u", "meta": {"stack": ["a"]}}
+    assert match_query(doc, {"meta.stack": {"$nin": ["b"]}, "tags": {"$exists": 0}})
+    apply_update(doc, {"$unset": {"meta.stack": ""}, "$push": {"tags": "x"}})
+    assert doc == {"uuid": "u", "meta": {}, "tags": ["x"]}
+
+    # Other queries are read from mongodb, until items are staged
+    uuid = "bb7a3714-01ea-4d64-ba1b-baa0b072626e"
+    query = {"uuid": {"$regex": f"^{uuid[:8]}"}}
+    plan = WritePlan()
+    assert [doc["uuid"] for doc in plan.find_items(query)] == [uuid]
+
+    plan.update_item({"uuid": uuid}, {"$push": {"meta.stack": "a"}})
+    with pytest.raises(ValueError, match="not supported on staged items"):
+        plan.find_items(query)
+    with pytest.raises(ValueError, match="not supported on staged items"):
+        plan.update_item({"uuid": uuid}, {"$addToSet": {"meta.stack": "a"}})
+
+
+@pytest.mark.asyncio
+async def test_concurrent_modification_retry() -> None:
+    uuid = "aa9581a9-0462-4182-bb09-1be039e36204"
+    item = Item.model_validate(inventory_items.find_one({"uuid": uuid}))
+    item.primary_barcode = item.barcodes[0]
+    response = RobotBatchResponse(
+        batch_id="retried",
+        jobs=[
+            RobotJob(job_id="j8", job_type="STORE_DESIGNATED", item=item, success=True)
+        ],
+        header=ResultHeader(
+            success=True, error_code=0, error_message="", safe_to_continue=True
+        ),
+    )
+
+    # The first commit conflicts and is rolled back by the transaction
+    commit = WritePlan.commit
+    conflicts = []
+
+    def commit_once(plan: WritePlan, session: None = None) -> None:
+        if not conflicts:
+            conflicts.append(plan)
+            raise ConcurrentModificationError
+        with patch("config.settings.MONGO_TRANSACTIONS", new=False):
+            commit(plan, session)
+
+    with (
+        patch("config.settings.MONGO_TRANSACTIONS", new=True),
+        patch.object(WritePlan, "commit", commit_once),
+    ):
+        updates = await ProcessBatchResponse.process_response(response)
+
+    assert len(conflicts) == 1
+    assert [(update.change, update.item.uuid) for update in updates] == [
+        ("DELETED", uuid)
+    ]
+    assert inventory_items.find_one({"uuid": uuid}) is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_modification_without_transaction() -> None:
+    uuids = [
+        "c4440f6a-7638-4872-91a2-7be10db915aa",
+        "5b9477fe-f4c6-4f76-8797-a44e7fec3960",
+    ]
+    jobs = []
+    for index, uuid in enumerate(uuids):
+        item = Item.model_validate(inventory_items.find_one({"uuid": uuid}))
+        item.primary_barcode = item.barcodes[0]
+        jobs.append(
+            RobotJob(
+                job_id=f"conflict{index}",
+                job_type="STORE_DESIGNATED",
+                item=item,
+                success=True,
+            )
+        )
+    response = RobotBatchResponse(
+        batch_id="conflict",
+        jobs=jobs,
+        header=ResultHeader(
+            success=True, error_code=0, error_message="", safe_to_continue=True
+        ),
+    )
+
+    # Another consumer writes the last item after the jobs read it
+    process_jobs = ProcessBatchResponse.process_jobs
+    conflicts = []
+
+    def process_jobs_conflicting(
+        response: RobotBatchResponse, indexes: list[int], *args: object
+    ) -> None:
+        process_jobs(response, indexes, *args)
+        if 1 in indexes and len(conflicts) < 2:
+            conflicts.append(uuids[1])
+            inventory_items.update_one({"uuid": uuids[1]}, {"$inc": {"version": 1}})
+
+    with (
+        patch("config.settings.MONGO_TRANSACTIONS", new=False),
+        patch("config.settings.CONCURRENT_MODIFICATION_RETRIES", new=0),
+        patch.object(ProcessBatchResponse, "process_jobs", process_jobs_conflicting),
+        pytest.raises(ConcurrentModificationError),
+    ):
+        await ProcessBatchResponse.process_response(response)
+
+    # Nothing is written, so the redelivered response processes every job
+    assert len(conflicts) == 1
+    for uuid in uuids:
+        assert inventory_items.find_one({"uuid": uuid}) is not None
+    assert processed_job_collection.find_one({"batch_id": "conflict"}) is None
+
+    # The jobs are processed again from fresh reads
+    with (
+        patch("config.settings.MONGO_TRANSACTIONS", new=False),
+        patch.object(ProcessBatchResponse, "process_jobs", process_jobs_conflicting),
+    ):
+        updates = await ProcessBatchResponse.process_response(response)
+
+    assert len(conflicts) == 2
+    assert [(update.change, update.item.uuid) for update in updates] == [
+        ("DELETED", uuid) for uuid in uuids
+    ]
+    for uuid in uuids:
+        assert inventory_items.find_one({"uuid": uuid}) is None
+    assert {
+        doc["job_id"] for doc in processed_job_collection.find({"batch_id": "conflict"})
+    } == {"conflict0", "conflict1"}
+
+
+def test_partial_commit_without_transaction() -> None:
+    uuids = [
+        "06c0a07b-a924-4c04-885c-5dd27a183a68",
+        "cff14d45-0e80-41a2-9666-5bf90754f563",
+    ]
+    plan = WritePlan()
+    for index, uuid in enumerate(uuids):
+        job_plan = plan.child()
+        job_plan.update_item({"uuid": uuid}, {"$set": {"meta.available": False}})
+        job_ledger.stage(job_plan, "partial", f"partial{index}")
+        plan.merge(job_plan)
+
+    # Another consumer writes the last item between the check and the write
+    check_versions = plan.check_versions
+
+    def check_then_conflict() -> None:
+        check_versions()
+        inventory_items.update_one({"uuid": uuids[1]}, {"$inc": {"version": 1}})
+
+    with (
+        patch("config.settings.MONGO_TRANSACTIONS", new=False),
+        patch.object(plan, "check_versions", check_then_conflict),
+        pytest.raises(PartialCommitError),
+    ):
+        plan.commit()
+
+    # The first job is committed with its ledger entry, the second is not
+    assert plan.committed_units == 1
+    assert inventory_items.find_one({"uuid": uuids[0]})["meta"]["available"] is False
+    assert inventory_items.find_one({"uuid": uuids[1]})["meta"]["available"] is True
+    assert {
+        doc["job_id"] for doc in processed_job_collection.find({"batch_id": "partial"})
+    } == {"partial0"}
+
+
+@pytest.mark.asyncio
+async def test_failed_job_writes_are_dropped() -> None:
+    uuids = [
+        "eb4c5180-953d-4dc2-8ab4-d490479570a5",
+        "0494eb4d-c9be-469a-869b-2ae7f33bfd60",
+    ]
+    jobs = []
+    for index, uuid in enumerate(uuids):
+        item = Item.model_validate(inventory_items.find_one({"uuid": uuid}))
+        item.primary_barcode = item.barcodes[0]
+        jobs.append(
+            RobotJob(
+                job_id=f"failing{index}",
+                job_type="STORE_DESIGNATED",
+                item=item,
+                success=True,
+            )
+        )
+    response = RobotBatchResponse(
+        batch_id="failing",
+        jobs=jobs,
+        header=ResultHeader(
+            success=True, error_code=0, error_message="", safe_to_continue=True
+        ),
+    )
+
+    # The second job fails after staging the deletion of its item
+    stage = job_ledger.stage
+
+    def stage_first(plan: WritePlan, batch_id: str, job_id: str) -> None:
+        if job_id == "failing1":
+            raise RuntimeError("ledger unavailable")
+        stage(plan, batch_id, job_id)
+
+    async with TestRabbitBroker(broker) as br:
+        with (
+            patch.object(job_ledger, "stage", stage_first),
+            pytest.raises(RuntimeError, match="ledger unavailable"),
+        ):
+            await br.publish(message=response, queue="batch/response")
+
+        # Only the updates of the committed job are published
+        (published,), _ = updates_publisher.mock.call_args
+        assert [(update["change"], update["item"]["uuid"]) for update in published] == [
+            ("DELETED", uuids[0])
+        ]
+
+    assert inventory_items.find_one({"uuid": uuids[0]}) is None
+    assert inventory_items.find_one({"uuid": uuids[1]}) is not None
+    assert {
+        doc["job_id"] for doc in processed_job_collection.find({"batch_id": "failing"})
+    } == {"failing0"}
+
+
+@pytest.mark.asyncio
+async def test_failed_partition_publishes_committed_updates() -> None:
+    uuid = "443214ff-c4ab-45bf-8d26-a8301facadf7"
+    item = Item.model_validate(inventory_items.find_one({"uuid": uuid}))
+    item.primary_barcode = item.barcodes[0]
+    # On the other side of the aisle, so in another partition
+    missing = item.model_copy(deep=True)
+    missing.uuid = "missing"
+    missing.relative.side = "right"
+
+    message = RobotBatchResponse(
+        batch_id="partially-failed",
+        jobs=[
+            RobotJob(job_id="p0", job_type="STORE_DESIGNATED", item=item, success=True),
+            RobotJob(
+                job_id="p1", job_type="STORE_DESIGNATED", item=missing, success=True
+            ),
+        ],
+        header=ResultHeader(
+            success=True, error_code=0, error_message="", safe_to_continue=True
+        ),
+    )
+    async with TestRabbitBroker(broker) as br:
+        with pytest.raises(ValueError, match='No item with uuid="missing"'):
+            await br.publish(message=message, queue="batch/response")
+
+        # The committed job is skipped on redelivery, its updates are published
+        (published,), _ = updates_publisher.mock.call_args
+        assert [(update["change"], update["item"]["uuid"]) for update in published] == [
+            ("DELETED", uuid)
+        ]
+    assert inventory_items.find_one({"uuid": uuid}) is None
+
+
+@pytest.mark.asyncio
+async def test_compact_batch_response() -> None:
+    uuid = "72bffefb-7723-4cd9-8c2f-87719af35c96"
+    item = Item.model_validate(inventory_items.find_one({"uuid": uuid}))
+    item.primary_barcode = item.barcodes[0]
+    job = RobotJob(job_id="compact", job_type="STORE_DESIGNATED", item=item)
+    robot_job_collection.insert_one(job.model_dump(exclude_none=True))
+
+    # The robot echoes the compact job with its result
+    message = RobotBatchResponse(
+        batch_id="compact",
+        jobs=[CompactRobotJob.from_job(job).model_copy(update={"success": True})],
+        header=ResultHeader(
+            success=True, error_code=0, error_message="", safe_to_continue=True
+        ),
+    )
+    async with TestRabbitBroker(broker) as br:
+        await br.publish(message=message, queue="batch/response")
+
+        (body,), _ = batch_response_handler.mock.call_args
+        assert "barcodes" not in body["jobs"][0]["item"]
+
+    # The job is processed and stored again with its full item
+    assert inventory_items.find_one({"uuid": uuid}) is None
+    doc = robot_job_collection.find_one({"job_id": "compact", "success": True})
+    assert len(doc["item"]["barcodes"]) == len(item.barcodes)
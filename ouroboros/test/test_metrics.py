@@ -0,0 +1,168 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+import asyncio
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from faststream.rabbit import TestRabbitBroker
+
+from src.models import ResultHeader, RobotBatchResponse
+
+from .mock_database import MOCK_CLIENT
+
+with (
+    patch("azure.keyvault.secrets.SecretClient"),
+    patch.dict(
+        os.environ, {"BLOB_STORE": "local", "LOCAL_BLOB_DIR": tempfile.mkdtemp()}
+    ),
+    patch("pymongo.MongoClient", return_value=MOCK_CLIENT),
+    patch("config.settings.AMQP_CONN_STR", new=""),
+):
+    from db.command_monitor import CommandMonitor, get_shape
+    from server import broker, serve_metrics, stop_metrics
+    from src.metrics import MetricsRegistry, metrics, metrics_endpoint, timed
+    from tools.report_mongo_commands import parse_samples
+
+
+def get_sample(text: str, sample: str) -> float:
+    """Get the value of a sample in rendered metrics, 0 if missing."""
+    for line in text.splitlines():
+        if line.startswith(f"{sample} "):
+            return float(line.split()[-1])
+    return 0.0
+
+
+def test_metrics_registry() -> None:
+    registry = MetricsRegistry("test")
+    registry.counter("messages_total", "Messages").inc(queue="a")
+    registry.counter("messages_total", "Messages").inc(2, queue="a")
+    registry.gauge("in_flight", "In flight").set(3)
+    histogram = registry.histogram("seconds", "Durations", buckets=(0.1, 1))
+    histogram.observe(0.05, queue="a")
+    histogram.observe(0.5, queue="a")
+    histogram.observe(5, queue="a")
+    registry.collector("cache", "Cache statistics", lambda: {"hits": 4})
+    with pytest.raises(TypeError, match="is a counter"):
+        registry.gauge("messages_total", "Messages")
+
+    assert registry.render() == (
+        "# HELP test_messages_total Messages\n"
+        "# TYPE test_messages_total counter\n"
+        'test_messages_total{queue="a"} 3.0\n'
+        "# HELP test_in_flight In flight\n"
+        "# TYPE test_in_flight gauge\n"
+        "test_in_flight 3.0\n"
+        "# HELP test_seconds Durations\n"
+        "# TYPE test_seconds histogram\n"
+        'test_seconds_bucket{queue="a",le="0.1"} 1.0\n'
+        'test_seconds_bucket{queue="a",le="1.0"} 2.0\n'
+        'test_seconds_bucket{queue="a",le="+Inf"} 3.0\n'
+        'test_seconds_sum{queue="a"} 5.55\n'
+        'test_seconds_count{queue="a"} 3.0\n'
+        "# HELP test_cache Cache statistics\n"
+        "# TYPE test_cache gauge\n"
+        'test_cache{stat="hits"} 4.0\n'
+    )
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint() -> None:
+    message = RobotBatchResponse(
+        batch_id="metrics",
+        jobs=[],
+        header=ResultHeader(
+            success=True, error_code=0, error_message="", safe_to_continue=True
+        ),
+    )
+    handled = 'ouroboros_handler_seconds_count{queue="batch/response"}'
+    errors = 'ouroboros_handler_errors_total{queue="batch/response"}'
+    before = metrics.render()
+
+    async with TestRabbitBroker(broker) as br:
+        await br.publish(message=message, queue="batch/response")
+        with pytest.raises(ValueError, match="validation error"):
+            await br.publish(message="invalid", queue="batch/response")
+
+    with timed("render"):
+        pass
+
+    with patch("config.settings.METRICS_PORT", new=1):
+        with patch.object(metrics_endpoint, "start") as start:
+            await serve_metrics()
+        start.assert_called_once()
+
+    # Served on a free port
+    await metrics_endpoint.start("127.0.0.1", 0)
+    try:
+        reader, writer = await asyncio.open_connection(
+            "127.0.0.1", metrics_endpoint.port
+        )
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        await writer.drain()
+        response = (await reader.read()).decode()
+        writer.close()
+    finally:
+        await stop_metrics()
+
+    assert response.startswith("HTTP/1.1 200 OK")
+    assert get_sample(response, handled) == get_sample(before, handled) + 2
+    assert get_sample(response, errors) == get_sample(before, errors) + 1
+    assert 'ouroboros_handler_in_flight{queue="batch/response"} 0.0' in response
+    assert 'ouroboros_message_bytes_count{queue="batch/response"}' in response
+    assert 'ouroboros_stage_seconds_count{stage="render"} 1.0' in response
+    assert 'ouroboros_barcode_cache{stat="hits"}' in response
+
+
+def test_command_monitor() -> None:
+    monitor = CommandMonitor(slow_seconds=0.5)
+    command = {
+        "find": "inventory_items",
+        "filter": {"uuid": {"$in": ["a", "b"]}, "$or": [{"meta.stack": "c"}]},
+    }
+    shape = "{uuid: {$in: ?}, $or: [{meta.stack: ?}]}"
+    assert get_shape(command["filter"]) == shape
+
+    def run(request_id: int, duration_micros: int, batch: list[dict]) -> None:
+        ids = {"connection_id": ("localhost", 27017), "request_id": request_id}
+        monitor.started(SimpleNamespace(command=command, command_name="find", **ids))
+        monitor.succeeded(
+            SimpleNamespace(
+                reply={"cursor": {"firstBatch": batch}},
+                duration_micros=duration_micros,
+                **ids,
+            )
+        )
+
+    # Slow commands are logged with their shape, never their values
+    with patch("db.command_monitor.logger") as mock_logger:
+        run(1, 1000, [{}, {}])
+        mock_logger.warning.assert_not_called()
+        run(2, 900_000, [{}])
+        mock_logger.warning.assert_called_once()
+        assert mock_logger.warning.call_args.args[-1] == shape
+
+    # Pings have no collection and are skipped
+    monitor.started(
+        SimpleNamespace(
+            command={"ping": 1}, command_name="ping", connection_id=None, request_id=3
+        )
+    )
+    assert not monitor.running
+
+    report = monitor.report().splitlines()
+    line = next(line for line in report if shape in line)
+    assert line.split()[:4] == ["901.0", "2", "450.50", "1.5"]
+
+    # The report of a running instance is built from its metrics
+    assert parse_samples(metrics.render()) == [
+        sample
+        for name in (
+            "ouroboros_mongo_shape_calls_total",
+            "ouroboros_mongo_shape_seconds_total",
+            "ouroboros_mongo_shape_documents_total",
+        )
+        for sample in metrics.metrics[name].samples()
+    ]
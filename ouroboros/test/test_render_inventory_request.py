@@ -1,22 +1,32 @@
 # Copyright 2024 The Rubic. All Rights Reserved.
 
+import asyncio
+import os
+import tempfile
+import threading
+import time
 from unittest.mock import MagicMock, patch
 
 import pytest
 from faststream.log import logger
 from faststream.rabbit import TestRabbitBroker
+from PIL import Image
 
 from .mock_database import MOCK_CLIENT
 
 with (
     patch("azure.keyvault.secrets.SecretClient"),
-    patch("azure.storage.blob.BlobServiceClient"),
+    patch.dict(
+        os.environ, {"BLOB_STORE": "local", "LOCAL_BLOB_DIR": tempfile.mkdtemp()}
+    ),
     patch("pymongo.MongoClient", return_value=MOCK_CLIENT),
     patch("config.settings.AMQP_CONN_STR", new=""),
 ):
+    from db.mongodb import renders_collection
     from server import broker
     from src.models import RenderScanRequest
     from src.routers.inventory import render_request_handler
+    from src.services.handlers.render import RenderInventory
 
 
 @pytest.mark.asyncio
@@ -32,3 +42,120 @@ async def test_render_scan_request() -> None:
         mock.assert_called_with(message.model_dump())
 
         logger.info("Completed message")
+
+
+@pytest.mark.asyncio
+async def test_render_requests_are_coalesced() -> None:
+    """Concurrent requests for the same scope share a single render."""
+    same_scope = [
+        RenderScanRequest(vendor="NLS", user_id=user_id, side="left", aisle_index=35)
+        for user_id in ("a", "b", "c")
+    ]
+    other_scope = RenderScanRequest(
+        vendor="NLS", user_id="d", side="right", aisle_index=35
+    )
+
+    with patch.object(RenderInventory, "render") as render_mock:
+        await asyncio.gather(
+            *(RenderInventory().run(body, logger) for body in same_scope),
+            RenderInventory().run(other_scope, logger),
+        )
+
+    assert render_mock.call_count == 2
+    assert render_mock.call_args_list[0].args[2] == ["a", "b", "c"]
+    assert not RenderInventory.pending
+    assert not RenderInventory.running
+
+
+@pytest.mark.asyncio
+async def test_render_requests_after_start_get_follow_up() -> None:
+    """Requests arriving once a render read the inventory share one follow-up."""
+    first, *later = (
+        RenderScanRequest(vendor="NLS", user_id=user_id, side="left", aisle_index=36)
+        for user_id in ("a", "b", "c")
+    )
+    scope = RenderInventory.get_scope(first)
+
+    render_started = threading.Event()
+
+    def slow_render(*_: object) -> None:
+        render_started.set()
+        time.sleep(0.1)
+
+    with patch.object(
+        RenderInventory, "render", side_effect=slow_render
+    ) as render_mock:
+        started = asyncio.create_task(RenderInventory().run(first, logger))
+        await asyncio.to_thread(render_started.wait, 1)
+        assert scope in RenderInventory.running
+        await asyncio.gather(
+            started, *(RenderInventory().run(body, logger) for body in later)
+        )
+
+    assert [call.args[2] for call in render_mock.call_args_list] == [
+        ["a"],
+        ["b", "c"],
+    ]
+    assert not RenderInventory.pending
+    assert not RenderInventory.running
+
+
+def test_render_scoped_to_x_range() -> None:
+    """Scoped renders only contain the requested part of the aisle."""
+    body = RenderScanRequest(
+        vendor="NLS",
+        user_id="258af564-80be-43f3-9638-77e5deb61467",
+        side="left",
+        aisle_index=35,
+        scan_id="999f976a-1a1c-4d30-90e7-b6e770ce46a5",
+        x_min=50.0,
+        x_max=52.0,
+    )
+    RenderInventory().render(body, logger)
+
+    render = renders_collection.find_one(
+        {"meta.side": "left", "meta.aisle_index": 35, "meta.x_min": 50.0}
+    )
+    assert render is not None
+    assert render["meta"]["x_max"] == 52.0
+    assert render["data"]
+    for trace in render["data"]:
+        assert trace["x1"] >= 50.0
+        assert trace["x0"] <= 52.0
+
+    # The full aisle render is stored next to it, without an x range
+    RenderInventory().render(
+        body.model_copy(update={"x_min": None, "x_max": None}), logger
+    )
+    full_renders = list(
+        renders_collection.find(
+            {
+                "meta.side": "left",
+                "meta.aisle_index": 35,
+                "meta.x_min": {"$exists": False},
+                "meta.x_max": {"$exists": False},
+            }
+        )
+    )
+    assert len(full_renders) == 1
+    assert len(full_renders[0]["data"]) >= len(render["data"])
+
+    # Another x range replaces the scoped render, next to the full one
+    RenderInventory().render(body.model_copy(update={"x_min": 51.0}), logger)
+    renders = list(
+        renders_collection.find({"meta.side": "left", "meta.aisle_index": 35})
+    )
+    assert len(renders) == 2
+    assert {render["meta"].get("x_min") for render in renders} == {None, 51.0}
+
+
+def test_stack_images_masks_alpha() -> None:
+    """Only images with alpha are masked, others are pasted whole."""
+    transparent = Image.new("LA", (2, 2), (0, 0))
+    rgb = Image.new("RGB", (2, 2), (10, 20, 0))
+    canvas = RenderInventory.stack_images(
+        [transparent, rgb], [(0, 0, 1, 1), (1, 0, 2, 1)], (0, 0, 2, 1), 2
+    )
+
+    assert canvas.getpixel((0, 0)) == 255
+    assert canvas.getpixel((3, 1)) == 10
@@ -1,10 +1,19 @@
 # Copyright 2024 The Rubic. All Rights Reserved.
 
-from unittest.mock import patch
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+from unittest.mock import Mock, patch
 
 import pytest
 from bson.objectid import ObjectId
-from faststream.rabbit import TestRabbitBroker
+from faststream.log import logger
+from faststream.rabbit import RabbitBroker, RabbitRouter, TestRabbitBroker
 
 from src.models import (
     Barcode,
@@ -13,6 +22,7 @@ from src.models import (
     ResultHeader,
     RobotScanResponse,
     ScanData,
+    ScanImage,
     ScanRequest,
     Timestamp,
     Vector2,
@@ -22,7 +32,9 @@ from .mock_database import MOCK_CLIENT
 
 with (
     patch("azure.keyvault.secrets.SecretClient"),
-    patch("azure.storage.blob.BlobServiceClient"),
+    patch.dict(
+        os.environ, {"BLOB_STORE": "local", "LOCAL_BLOB_DIR": tempfile.mkdtemp()}
+    ),
     patch("pymongo.MongoClient", return_value=MOCK_CLIENT),
     patch("config.settings.AMQP_CONN_STR", new=""),
 ):
@@ -32,15 +44,53 @@ with (
         scan_image_collection,
     )
     from server import broker
+    from src.codecs import (
+        SCAN_DATA_CONTENT_TYPE,
+        JsonCodec,
+        decode_scan_data,
+        encode_scan_data,
+    )
+    from src.decorators import log
+    from src.decorators.logger import format_args, summarize
     from src.routers.scan import (
         compile_scan_data_handler,
         scan_data_handler,
         scan_request_handler,
         scan_response_handler,
     )
+    from src.routers.sharding import get_owned_shards, sharded_subscriber
+    from src.services.blob_stores import (
+        BlobUpload,
+        BlobUploadQueue,
+        LocalBlobStore,
+        blob_upload_queue,
+    )
+    from src.services.handlers.render.render_inventory import RenderInventory
+    from src.services.handlers.scan.ingest_scan_data import IngestScanData
 
     from .mock_robot import mock_robot_scan_request_handler
 
+# Scan image of the test data, with a legacy base64 image
+SCAN_IMAGE_ID = ObjectId("662fc8daa7d34986e9fc9a26")
+
+
+def make_scan_data(scan_id: str, **overrides: Any) -> ScanData:
+    """Scan data with the image of the test scan image, and no partial data."""
+    scan_image = scan_image_collection.find_one({"_id": SCAN_IMAGE_ID})
+    fields = {
+        "stamp": Timestamp(sec=0, nanosec=0),
+        "scan_id": scan_id,
+        "side": "left",
+        "image": scan_image["image"],
+        "aisle_index": 35,
+        "image_bottom_left": Vector2(x=0, y=0),
+        "image_top_right": Vector2(x=1, y=1),
+        "image_filename": "test",
+        "partial_items": [],
+        "barcodes": [],
+    }
+    return ScanData(**(fields | overrides))
+
 
 @pytest.mark.asyncio
 async def test_compile_scan_data() -> None:
@@ -117,25 +167,331 @@ async def test_ingest_scan_data() -> None:
     partial_item = partial_item_collection.find_one()
     partial_item = PartialItem.model_validate(partial_item)
 
-    scan_image = scan_image_collection.find_one(
-        {"_id": ObjectId("662fc8daa7d34986e9fc9a26")}
-    )
-
     async with TestRabbitBroker(broker) as br:
-        message = ScanData(
-            stamp=Timestamp(sec=0, nanosec=0),
-            scan_id="xyz",
-            side="left",
-            image=scan_image["image"],
-            aisle_index=35,
-            image_bottom_left=Vector2(x=0, y=0),
-            image_top_right=Vector2(x=1, y=1),
+        message = make_scan_data(
+            "xyz",
             image_filename="test.webp",
             partial_items=[partial_item],
             barcodes=[partial_barcode],
         )
         await br.publish(message=message, queue="scan/data")
+        await blob_upload_queue.stop()
 
         # Validate received message
         handler_mock = scan_data_handler.mock
         handler_mock.assert_called_with(message.model_dump())
+
+
+@pytest.mark.asyncio
+async def test_ingest_binary_scan_data() -> None:
+    partial_item = PartialItem.model_validate(partial_item_collection.find_one())
+    message = make_scan_data(
+        "binary-scan", image_filename="binary", partial_items=[partial_item]
+    )
+
+    # The image is sent in several chunks, as raw bytes
+    body = encode_scan_data(message, chunk_size=1000)
+    assert len(body) < len(message.model_dump_json())
+    decoded = ScanData.model_validate(decode_scan_data(body))
+    assert decoded.image == message.image
+    assert decoded.model_dump_json() == message.model_dump_json()
+    with pytest.raises(ValueError, match="Truncated"):
+        decode_scan_data(body[:-1])
+
+    # The header is parsed with the codec of the scan router
+    spy = JsonCodec("spy", Mock(wraps=json.loads), json.dumps)
+    with patch("src.codecs.scan_data.get_router_codec", return_value=spy):
+        decode_scan_data(body)
+    spy.loads.assert_called_once()
+
+    async with TestRabbitBroker(broker) as br:
+        await br.publish(body, queue="scan/data", content_type=SCAN_DATA_CONTENT_TYPE)
+        await blob_upload_queue.stop()
+
+        handler_mock = scan_data_handler.mock
+        assert handler_mock.call_args.args[0]["image"] == message.image
+
+    doc = scan_image_collection.find_one({"scan_id": "binary-scan"})
+    assert doc["blob_name"] == "binary_binary-scan.webp"
+    assert partial_item_collection.find_one({"meta.image_id": str(doc["_id"])})
+
+
+@pytest.mark.asyncio
+async def test_log_summary() -> None:
+    message = make_scan_data("logged-scan", image_filename="logged")
+
+    # Only the ids, counts and sizes are logged, never the image
+    assert summarize(message) == {
+        "type": "ScanData",
+        "scan_id": "logged-scan",
+        "image": f"{len(message.image)} bytes",
+        "aisle_index": 35,
+        "partial_items": "0 items",
+        "barcodes": "0 items",
+    }
+    assert "logged-scan" in format_args((message,), {"logger": logger})
+    with patch("config.settings.LOG_SUMMARY_MAX_LENGTH", new=10):
+        assert len(format_args((message,), {})) == 13
+    with patch("config.settings.LOG_PAYLOADS", new=True):
+        assert len(format_args((message,), {})) > len(message.image)
+
+    @log
+    async def handler(body: ScanData) -> None:  # noqa: RUF029
+        if body.partial_items:
+            raise ValueError("Failed")
+
+    # Unsampled calls are not logged, unless they fail
+    with (
+        patch("config.settings.LOG_SAMPLE_RATE", new=0),
+        patch("src.decorators.logger.logger") as mock_logger,
+    ):
+        await handler(message)
+        mock_logger.info.assert_not_called()
+
+        message.partial_items = [
+            PartialItem.model_validate(partial_item_collection.find_one())
+        ]
+        with pytest.raises(ValueError, match="Failed"):
+            await handler(message)
+        mock_logger.opt.return_value.error.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_ingest_scan_data_stores_image_in_blob_store(tmp_path: Path) -> None:
+    message = make_scan_data("blob-store-scan")
+
+    blob_store = LocalBlobStore(tmp_path)
+    with (
+        patch.object(IngestScanData, "blob_store", blob_store),
+        patch.object(RenderInventory, "blob_store", blob_store),
+    ):
+        await IngestScanData().run(message, logger)
+        await blob_upload_queue.stop()
+
+        # Only the metadata and the blob key are stored in mongodb
+        doc = scan_image_collection.find_one({"scan_id": "blob-store-scan"})
+        assert "image" not in doc
+        assert "pending_blob_name" not in doc
+        assert doc["container_name"] == "scan-images-raw"
+        assert doc["blob_name"] == "test_blob-store-scan.webp"
+        assert (tmp_path / "scan-images-raw" / doc["blob_name"]).exists()
+
+        # The render reads the image back from the blob store
+        stored = RenderInventory.open_scan_image(ScanImage.model_validate(doc))
+        scan_image = scan_image_collection.find_one({"_id": SCAN_IMAGE_ID})
+        legacy = RenderInventory.open_scan_image(ScanImage.model_validate(scan_image))
+        assert stored is not None
+        assert legacy is not None
+        assert stored.size == legacy.size
+
+
+@pytest.mark.asyncio
+async def test_blob_upload_queue_retries(tmp_path: Path) -> None:
+    blob_store = LocalBlobStore(tmp_path)
+    upload = blob_store.upload
+    attempts = []
+
+    def flaky_upload(*args: object, **kwargs: bool) -> None:
+        attempts.append(args)
+        if len(attempts) < 3:
+            raise ConnectionError("Blob store unavailable")
+        upload(*args, **kwargs)
+
+    uploaded = []
+    queue = BlobUploadQueue(max_size=1, workers=1, retries=2, retry_delay=0)
+    with patch.object(blob_store, "upload", flaky_upload):
+        await queue.submit(
+            BlobUpload(
+                blob_store,
+                "container",
+                "a",
+                b"a",
+                on_uploaded=lambda: uploaded.append("a"),
+            )
+        )
+        await queue.submit(BlobUpload(blob_store, "container", "b", b"b"))
+        await queue.stop()
+
+    # The first upload succeeds on its last retry, the second at once
+    assert len(attempts) == 4
+    assert queue.retried == 2
+    assert queue.uploaded == 2
+    assert queue.failed == 0
+    assert uploaded == ["a"]
+    assert (tmp_path / "container" / "b").read_bytes() == b"b"
+
+
+@pytest.mark.asyncio
+async def test_ingest_scan_data_keeps_failed_upload(tmp_path: Path) -> None:
+    message = make_scan_data("failed-upload-scan")
+
+    def failing_upload(*_args: object, **_kwargs: bool) -> None:
+        raise ConnectionError("Blob store unavailable")
+
+    blob_store = LocalBlobStore(tmp_path)
+    with (
+        patch.object(IngestScanData, "blob_store", blob_store),
+        patch.object(RenderInventory, "blob_store", blob_store),
+        patch.object(blob_upload_queue, "retry_delay", 0),
+    ):
+        with patch.object(blob_store, "upload", failing_upload):
+            await IngestScanData().run(message, logger)
+            await blob_upload_queue.stop()
+
+        # The image is kept in mongodb and still rendered
+        doc = scan_image_collection.find_one({"scan_id": "failed-upload-scan"})
+        assert doc["blob_name"] is None
+        assert doc["pending_blob_name"] == "test_failed-upload-scan.webp"
+        assert RenderInventory.open_scan_image(ScanImage.model_validate(doc))
+
+        assert "retrying_until" not in doc
+
+        # The retry uploads it and removes it from mongodb
+        assert await IngestScanData.retry_failed_uploads() >= 1
+        await blob_upload_queue.stop()
+
+    doc = scan_image_collection.find_one({"scan_id": "failed-upload-scan"})
+    assert "image" not in doc
+    assert "pending_blob_name" not in doc
+    assert doc["blob_name"] == "test_failed-upload-scan.webp"
+    assert (tmp_path / "scan-images-raw" / doc["blob_name"]).exists()
+
+
+@pytest.mark.asyncio
+async def test_retry_failed_uploads_claims_images() -> None:
+    now = time.time()
+    image = base64.b64encode(b"image").decode()
+    docs = {
+        "unleased": {"image": image},
+        "expired": {"image": image, "retrying_until": now - 1},
+        "leased": {"image": image, "retrying_until": now + 60},
+        "lost": {"retrying_until": now - 1},
+    }
+    ids = scan_image_collection.insert_many(
+        [
+            {"scan_id": f"{name}-upload-scan", "pending_blob_name": name} | doc
+            for name, doc in docs.items()
+        ]
+    ).inserted_ids
+
+    with (
+        patch.object(blob_upload_queue, "submit") as submit_mock,
+        patch("config.settings.SCAN_UPLOAD_SWEEP_LIMIT", 1),
+        patch("src.services.handlers.scan.ingest_scan_data.logger") as logger_mock,
+    ):
+        # One image per sweep, a queued image is not swept again
+        assert await IngestScanData.retry_failed_uploads() == 1
+        assert await IngestScanData.retry_failed_uploads() == 1
+        assert await IngestScanData.retry_failed_uploads() == 0
+
+    queued = [call.args[0].name for call in submit_mock.call_args_list]
+    assert sorted(queued) == ["expired", "unleased"]
+    logger_mock.warning.assert_called_with(
+        "{} scan images were lost before their upload", 1
+    )
+    scan_image_collection.delete_many({"_id": {"$in": ids}})
+
+
+def test_blob_upload_queue_cancels_workers_of_other_loop() -> None:
+    queue = BlobUploadQueue(max_size=1, workers=2, retries=0, retry_delay=0)
+
+    async def start() -> None:
+        queue.start()
+        # The workers wait for uploads
+        await asyncio.sleep(0)
+
+    first_loop = asyncio.new_event_loop()
+    second_loop = asyncio.new_event_loop()
+    try:
+        first_loop.run_until_complete(start())
+        first_workers = queue.worker_tasks
+
+        second_loop.run_until_complete(start())
+        assert queue.worker_tasks is not first_workers
+        first_loop.run_until_complete(asyncio.wait(first_workers, timeout=1))
+        assert all(task.cancelled() for task in first_workers)
+
+        second_loop.run_until_complete(queue.stop())
+    finally:
+        first_loop.close()
+        second_loop.close()
+
+
+@pytest.mark.asyncio
+async def test_ingest_scan_data_creates_thumbnail(tmp_path: Path) -> None:
+    message = make_scan_data(
+        "thumbnail-scan",
+        image_bottom_left=Vector2(x=1, y=0),
+        image_top_right=Vector2(x=0, y=0.5),
+    )
+
+    blob_store = LocalBlobStore(tmp_path)
+    with (
+        patch("config.settings.SCAN_THUMBNAILS", new=True),
+        patch.object(IngestScanData, "blob_store", blob_store),
+        patch.object(RenderInventory, "blob_store", blob_store),
+    ):
+        await IngestScanData().run(message, logger)
+        await asyncio.gather(*IngestScanData.background_tasks)
+
+        doc = scan_image_collection.find_one({"scan_id": "thumbnail-scan"})
+        model = ScanImage.model_validate(doc)
+        assert len(model.thumbnails) == 1
+        assert model.thumbnails[0].pixels_per_meter == 400
+
+        # The render opens the thumbnail, already at the render resolution
+        img = RenderInventory.open_scan_image(model)
+        assert img is not None
+        assert img.mode == "LA"
+        assert img.size == (400, 200)
+
+        render_image_meta = RenderInventory.render_image([model])
+        assert render_image_meta.width == 1
+        assert render_image_meta.height == 0.5
+
+
+def test_shard_ownership() -> None:
+    instances = ["ouroboros-0", "ouroboros-1", "ouroboros-2"]
+    owned = {}
+    with (
+        patch("config.settings.SHARD_COUNT", new=64),
+        patch("config.settings.SHARD_INSTANCES", new=instances),
+    ):
+        for instance in instances:
+            with patch("config.settings.INSTANCE_ID", new=instance):
+                owned[instance] = set(get_owned_shards())
+
+        # Every shard has exactly one owner, and each instance has a share
+        assert sorted(shard for shards in owned.values() for shard in shards) == [
+            *range(64)
+        ]
+        assert all(len(shards) > 64 // 6 for shards in owned.values())
+
+        # Removing an instance only moves the shards it owned
+        with (
+            patch("config.settings.SHARD_INSTANCES", new=instances[:2]),
+            patch("config.settings.INSTANCE_ID", new="ouroboros-0"),
+        ):
+            assert set(get_owned_shards()) >= owned["ouroboros-0"]
+
+
+@pytest.mark.asyncio
+async def test_sharded_subscriber_forwards_plain_queue() -> None:
+    test_broker = RabbitBroker()
+    router = RabbitRouter(prefix="scan/")
+    with (
+        patch("config.settings.SHARD_COUNT", new=4),
+        patch("config.settings.SHARD_INSTANCES", new=["0"]),
+        patch("config.settings.INSTANCE_ID", new="0"),
+    ):
+
+        @sharded_subscriber(router, "request")
+        async def handler(body: dict) -> None:
+            pass
+
+    test_broker.include_router(router)
+
+    async with TestRabbitBroker(test_broker) as br:
+        await br.publish({"aisle_index": 35}, queue="scan/request")
+
+        handler.mock.assert_called_once_with({"aisle_index": 35})
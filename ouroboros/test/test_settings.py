@@ -0,0 +1,45 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+import os
+import stat
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from config import settings
+
+
+def test_env_connection_string_skips_key_vault() -> None:
+    secret_client = Mock()
+    with (
+        patch.dict(os.environ, {"AZURE_BLOB_CONN": "UseDevelopmentStorage=true"}),
+        patch("config.settings.get_secret_client", return_value=secret_client),
+    ):
+        assert settings.get_azure_blob_conn() == "UseDevelopmentStorage=true"
+        secret_client.get_secret.assert_not_called()
+
+
+def test_secret_cache(tmp_path: Path) -> None:
+    cache_file = tmp_path / "secrets.json"
+    secret_client = Mock()
+    secret_client.get_secret.return_value.value = "amqps://secret"
+    with (
+        patch("config.settings.SECRET_CACHE_FILE", new=str(cache_file)),
+        patch("config.settings.get_secret_client", return_value=secret_client),
+    ):
+        settings.get_secret.cache_clear()
+        assert settings.get_secret("AMQP-SSL-CONN-STR") == "amqps://secret"
+        assert stat.S_IMODE(cache_file.stat().st_mode) == 0o600
+
+        # A new process reads the secret from the disk cache
+        settings.get_secret.cache_clear()
+        secret_client.get_secret.reset_mock()
+        assert settings.get_secret("AMQP-SSL-CONN-STR") == "amqps://secret"
+        secret_client.get_secret.assert_not_called()
+
+        # Expired secrets are fetched again
+        with patch("config.settings.SECRET_CACHE_TTL_SECONDS", new=0):
+            settings.get_secret.cache_clear()
+            settings.get_secret("AMQP-SSL-CONN-STR")
+            secret_client.get_secret.assert_called_once()
+
+    settings.get_secret.cache_clear()
@@ -1,7 +1,9 @@
 # Copyright 2024 The Rubic. All Rights Reserved.
 
 import asyncio
+import os
 import random
+import tempfile
 import uuid
 from unittest.mock import patch
 
@@ -31,7 +33,9 @@ from test.mock_database import MOCK_CLIENT
 
 with (
     patch("azure.keyvault.secrets.SecretClient"),
-    patch("azure.storage.blob.BlobServiceClient"),
+    patch.dict(
+        os.environ, {"BLOB_STORE": "local", "LOCAL_BLOB_DIR": tempfile.mkdtemp()}
+    ),
     patch("pymongo.MongoClient", return_value=MOCK_CLIENT),
     patch("config.settings.AMQP_CONN_STR", new=""),
 ):
@@ -0,0 +1,32 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Benchmark the size and parse time of full and compact robot batches."""
+
+import argparse
+
+from pydantic import TypeAdapter
+
+from src.models import CompactRobotJob, RobotBatchRequest
+from tools.benchmark_message_codecs import build_payloads, measure
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeats", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    adapter = TypeAdapter(RobotBatchRequest)
+    for repeat in args.repeats:
+        request, _ = build_payloads(repeat)["batch request"]
+        compact = request.model_copy(
+            update={"jobs": [CompactRobotJob.from_job(job) for job in request.jobs]}
+        )
+        print(f"batch request with {len(request.jobs)} jobs")  # noqa: T201
+        for name, message in (("full", request), ("compact", compact)):
+            body = message.model_dump_json()
+            dump_ms = measure(message.model_dump_json, args.runs)
+            parse_ms = measure(lambda body=body: adapter.validate_json(body), args.runs)
+            print(  # noqa: T201
+                f"  {name:>7}: {len(body) / 1024:.0f} KiB, "
+                f"serialize {dump_ms:.2f} ms, parse {parse_ms:.2f} ms"
+            )
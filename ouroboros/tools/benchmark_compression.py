@@ -0,0 +1,53 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Benchmark the message compressions on batch payloads of growing sizes."""
+
+import argparse
+
+from faststream.broker.message import encode_message
+
+from src.codecs import COMPRESSIONS
+from tools.benchmark_message_codecs import build_payloads, measure
+
+# Link speeds in megabits per second to estimate the transfer time at
+BANDWIDTHS_MBIT = (10, 100, 1000)
+
+
+def transfer_ms(size: int, bandwidth_mbit: int) -> float:
+    """Estimate the time to send a body over a link in milliseconds."""
+    return size * 8 / (bandwidth_mbit * 1_000_000) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeats", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    for repeat in args.repeats:
+        message, _ = build_payloads(repeat)["batch response"]
+        body = encode_message(message)[0]
+        transfers = ", ".join(
+            f"{transfer_ms(len(body), mbit):.1f} ms at {mbit} Mbit/s"
+            for mbit in BANDWIDTHS_MBIT
+        )
+        print(f"batch response x{repeat}: {len(body) / 1024:.0f} KiB, {transfers}")  # noqa: T201
+        for name, compression in COMPRESSIONS.items():
+            compressed = compression.compress(body)
+            compress_ms = measure(
+                lambda c=compression, b=body: c.compress(b), args.runs
+            )
+            decompress_ms = measure(
+                lambda c=compression, b=compressed: c.decompress(b), args.runs
+            )
+            codec_ms = compress_ms + decompress_ms
+            transfers = ", ".join(
+                f"{codec_ms + transfer_ms(len(compressed), mbit):.1f} ms "
+                f"at {mbit} Mbit/s"
+                for mbit in BANDWIDTHS_MBIT
+            )
+            print(  # noqa: T201
+                f"  {name:>5}: {len(compressed) / 1024:.0f} KiB "
+                f"({len(compressed) / len(body):.0%}), compress {compress_ms:.2f} ms, "
+                f"decompress {decompress_ms:.2f} ms, total {transfers}"
+            )
@@ -0,0 +1,93 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Benchmark the message codecs on batch payloads built from the test items."""
+
+import argparse
+import statistics
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+from bson.json_util import loads
+from faststream._compat import json_loads  # noqa: PLC2701
+from faststream.broker.message import encode_message
+from pydantic import TypeAdapter
+
+from src.codecs import CODECS
+from src.models import (
+    Item,
+    ItemUpdate,
+    ResultHeader,
+    RobotBatchRequest,
+    RobotBatchResponse,
+    RobotJob,
+)
+
+ITEMS_FILE = (
+    Path(__file__).resolve().parent.parent / "test/data/Orbit/inventory_items.json"
+)
+
+
+def measure(func: Callable[[], object], runs: int) -> float:
+    """Get the median duration of a function in milliseconds."""
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000
+
+
+def build_payloads(repeat: int) -> dict[str, tuple[Any, TypeAdapter[Any]]]:
+    """Build batch requests, responses and item updates of the test items."""
+    items = [Item.model_validate(doc) for doc in loads(ITEMS_FILE.read_text())]
+    jobs = [RobotJob(job_type="FETCH_INVENTORY", item=item) for item in items]
+    jobs *= repeat
+    header = ResultHeader(
+        success=True, error_code=0, error_message="", safe_to_continue=True
+    )
+    return {
+        "batch request": (RobotBatchRequest(jobs=jobs), TypeAdapter(RobotBatchRequest)),
+        "batch response": (
+            RobotBatchResponse(batch_id="benchmark", jobs=jobs, header=header),
+            TypeAdapter(RobotBatchResponse),
+        ),
+        "item updates": (
+            [ItemUpdate(change="UPDATED", item=job.item) for job in jobs],
+            TypeAdapter(list[ItemUpdate]),
+        ),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    # What FastStream does without a codec on the router
+    codecs: dict[str, tuple[Callable[[Any], bytes], Callable[[bytes], Any]]] = {
+        "faststream": (lambda message: encode_message(message)[0], json_loads)
+    }
+    codecs |= {codec.name: (codec.dumps, codec.loads) for codec in CODECS.values()}
+
+    for name, (message, adapter) in build_payloads(args.repeat).items():
+        body = encode_message(message)[0]
+        validate_ms = measure(
+            lambda adapter=adapter, body=body: adapter.validate_python(
+                json_loads(body)
+            ),
+            args.runs,
+        )
+        print(  # noqa: T201
+            f"{name}: {len(body) / 1024:.0f} KiB, "
+            f"parse and validate {validate_ms:.2f} ms"
+        )
+        for codec_name, (dumps, decode) in codecs.items():
+            encode_ms = measure(lambda dumps=dumps, m=message: dumps(m), args.runs)
+            decode_ms = measure(lambda decode=decode, b=body: decode(b), args.runs)
+            print(  # noqa: T201
+                f"  {codec_name:>10}: encode {encode_ms:6.2f} ms, "
+                f"parse {decode_ms:6.2f} ms"
+            )
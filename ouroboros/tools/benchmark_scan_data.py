@@ -0,0 +1,64 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Benchmark the size and parse time of the JSON and binary scan data."""
+
+import argparse
+import json
+import os
+import statistics
+import time
+from collections.abc import Callable
+
+from src.codecs import decode_scan_data, encode_scan_data
+from src.models import ScanData, Timestamp, Vector2
+
+
+def measure(func: Callable[[], object], runs: int) -> float:
+    """Get the median duration of a function in milliseconds."""
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--image-kb", type=int, default=2048)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    message = ScanData(
+        stamp=Timestamp(sec=0, nanosec=0),
+        scan_id="benchmark",
+        side="left",
+        image=os.urandom(args.image_kb * 1024),
+        aisle_index=0,
+        image_bottom_left=Vector2(x=0, y=0),
+        image_top_right=Vector2(x=1, y=1),
+        image_filename="benchmark",
+        partial_items=[],
+        barcodes=[],
+    )
+    json_body = message.model_dump_json().encode()
+    binary_body = encode_scan_data(message)
+
+    formats = {
+        "json": (
+            json_body,
+            lambda: message.model_dump_json().encode(),
+            lambda: ScanData.model_validate(json.loads(json_body)),
+        ),
+        "binary": (
+            binary_body,
+            lambda: encode_scan_data(message),
+            lambda: ScanData.model_validate(decode_scan_data(binary_body)),
+        ),
+    }
+    for name, (body, encode, decode) in formats.items():
+        print(  # noqa: T201
+            f"{name:>6}: {len(body) / 1024:8.0f} KiB, "
+            f"encode {measure(encode, args.runs):7.2f} ms, "
+            f"parse {measure(decode, args.runs):7.2f} ms"
+        )
@@ -0,0 +1,48 @@
+# Copyright 2024 The Rubic. All Rights Reserved.
+
+"""Report the mongodb query shapes of a running instance taking the most time."""
+
+import argparse
+import re
+import urllib.request
+
+from config import settings
+from db.command_monitor import format_report, get_shape_stats
+from src.metrics.registry import Labels
+
+SAMPLE = re.compile(r"^(?P<name>\w+)\{(?P<labels>.*)\} (?P<value>\S+)$")
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+SHAPE_METRICS = (
+    "ouroboros_mongo_shape_calls_total",
+    "ouroboros_mongo_shape_seconds_total",
+    "ouroboros_mongo_shape_documents_total",
+)
+
+
+def parse_samples(text: str) -> list[tuple[str, Labels, float]]:
+    """Parse the samples of the shape counters from rendered metrics."""
+    samples = []
+    for line in text.splitlines():
+        match = SAMPLE.match(line)
+        if match is None or match["name"] not in SHAPE_METRICS:
+            continue
+        labels = tuple(
+            (name, value.replace('\\"', '"').replace("\\\\", "\\"))
+            for name, value in LABEL.findall(match["labels"])
+        )
+        samples.append((match["name"], labels, float(match["value"])))
+    return samples
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--url",
+        default=f"http://{settings.METRICS_HOST}:{settings.METRICS_PORT}/metrics",
+    )
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    with urllib.request.urlopen(args.url) as response:  # noqa: S310
+        text = response.read().decode()
+    print(format_report(get_shape_stats(parse_samples(text)), args.top))  # noqa: T201
@@ -93,7 +93,7 @@ if __name__ == "__main__":
     ]
     message = [job.model_dump() for job in jobs]
     message = json.dumps(message)
-    connection = pika.BlockingConnection(pika.URLParameters(settings.AMQP_CONN_STR))  # pyright: ignore[reportArgumentType]
+    connection = pika.BlockingConnection(pika.URLParameters(settings.AMQP_CONN_STR))
     connection.channel().basic_publish(
         exchange="",
         routing_key="batch/request",
@@ -16,7 +16,7 @@ if __name__ == "__main__":
         overwrite=True,
         aisle_index=69,
     )
-    connection = pika.BlockingConnection(pika.URLParameters(settings.AMQP_CONN_STR))  # pyright: ignore[reportArgumentType]
+    connection = pika.BlockingConnection(pika.URLParameters(settings.AMQP_CONN_STR))
     connection.channel().basic_publish(
         exchange="",
         routing_key="scan/compile",
@@ -13,7 +13,7 @@ if __name__ == "__main__":
         user_id="",
         debug=False,
     )
-    connection = pika.BlockingConnection(pika.URLParameters(settings.AMQP_CONN_STR))  # pyright: ignore[reportArgumentType]
+    connection = pika.BlockingConnection(pika.URLParameters(settings.AMQP_CONN_STR))
     connection.channel().basic_publish(
         exchange="",
         routing_key="inventory/render",
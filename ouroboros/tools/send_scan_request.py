@@ -19,7 +19,7 @@ if __name__ == "__main__":
         waypoint_end_index=745,
         overwrite_scan_id="47db912b-a9a3-4968-8259-9a27beb9a0fe",
     )
-    connection = pika.BlockingConnection(pika.URLParameters(settings.AMQP_CONN_STR))  # pyright: ignore[reportArgumentType]
+    connection = pika.BlockingConnection(pika.URLParameters(settings.AMQP_CONN_STR))
     connection.channel().basic_publish(
         exchange="",
         routing_key="scan/request",